@@ -4,4 +4,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notif.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# импорт после get_asgi_application: модулю нужны настроенные приложения
+from notifications.ingest import asgi_app as ingest_app  # noqa: E402
+
+INGEST_PATH = "/api/ingest/"
+
+
+async def application(scope, receive, send):
+    # высокочастотный приём уведомлений идёт мимо middleware (см. notifications.ingest)
+    if scope["type"] == "http" and scope["path"] == INGEST_PATH:
+        await ingest_app(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -1,8 +1,47 @@
 import os
 from celery import Celery
+from kombu import Exchange, Queue
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notif.settings')  
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notif.settings')
 
 app = Celery('notif')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+# Очереди: по приоритету уведомления и по каналу для пакетной отправки.
+# Каждую очередь (или группу) слушает свой воркер со своей concurrency,
+# поэтому массовая рассылка не задерживает транзакционные уведомления,
+# а медленный SMTP — быстрый Telegram.
+HIGH_QUEUE = 'notif.high'
+DEFAULT_QUEUE = 'notif.default'
+BULK_QUEUE = 'notif.bulk'
+EMAIL_QUEUE = 'notif.email'
+TELEGRAM_QUEUE = 'notif.telegram'
+
+# Notification.priority -> очередь send_notification_task
+PRIORITY_QUEUES = {
+    0: HIGH_QUEUE,
+    1: DEFAULT_QUEUE,
+    2: BULK_QUEUE,
+}
+
+app.conf.task_default_queue = DEFAULT_QUEUE
+# у каждой очереди свой exchange и routing key: без них Celery привязывает
+# все очереди к default-ключу, и сообщение попадает во все сразу
+app.conf.task_queues = [
+    Queue(name, Exchange(name, type='direct'), routing_key=name)
+    for name in (HIGH_QUEUE, DEFAULT_QUEUE, BULK_QUEUE, EMAIL_QUEUE, TELEGRAM_QUEUE)
+]
+app.conf.task_routes = {
+    # релей короткий и публикует в том числе срочные уведомления — не ждёт
+    # за 30-секундными SMTP-отправками в notif.default
+    'notifications.tasks.relay_outbox_task': {'queue': HIGH_QUEUE},
+    'notifications.tasks.send_bulk_task': {'queue': BULK_QUEUE},
+    'notifications.tasks.send_email_batch_task': {'queue': EMAIL_QUEUE},
+    'notifications.tasks.send_telegram_batch_task': {'queue': TELEGRAM_QUEUE},
+    # сводки собираются из шумного трафика — не мешаем транзакционным
+    'notifications.tasks.flush_digest_task': {'queue': BULK_QUEUE},
+    'notifications.tasks.send_digest_task': {'queue': BULK_QUEUE},
+    # долгий проход по dead letters не должен занимать воркер срочных
+    'notifications.tasks.replay_dead_letters_task': {'queue': BULK_QUEUE},
+}
@@ -100,11 +100,46 @@ CELERY_TASK_TIME_LIMIT = int(os.getenv("CELERY_TASK_TIME_LIMIT", "60"))
 CELERY_TASK_SOFT_TIME_LIMIT = int(
     os.getenv("CELERY_TASK_SOFT_TIME_LIMIT", "55")
 )
+# По одной задаче на процесс: длинная SMTP-отправка не держит за собой
+# уже полученные срочные задачи. Очереди и маршруты — в notif/celery.py
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv("CELERY_WORKER_PREFETCH_MULTIPLIER", "1"))
+CELERY_BEAT_SCHEDULE = {
+    # уведомления, чей воркер умер посреди отправки
+    "recover-expired-leases": {
+        "task": "notifications.tasks.recover_expired_leases_task",
+        "schedule": 60.0,
+    },
+    # outbox: страховка публикации после коммита — подбирает то, что не ушло
+    # (брокер недоступен, процесс упал); можно заменить `manage.py relay_outbox --loop`
+    "relay-outbox": {
+        "task": "notifications.tasks.relay_outbox_task",
+        "schedule": float(os.getenv("OUTBOX_RELAY_INTERVAL", "1")),
+    },
+    # отложенные уведомления с наступившим send_at
+    "dispatch-scheduled": {
+        "task": "notifications.tasks.dispatch_scheduled_task",
+        "schedule": float(os.getenv("NOTIFICATION_DISPATCH_INTERVAL", "5")),
+    },
+}
 
-# cacheops
+# Аренда уведомления воркером; должна быть больше CELERY_TASK_TIME_LIMIT
+NOTIFICATION_LEASE_SEC = int(os.getenv("NOTIFICATION_LEASE_SEC", "120"))
+# После стольких аренд уведомление с истёкшей арендой уходит в dead, а не в очередь
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "20"))
+# Сколько отложенных уведомлений диспетчер переводит в очередь за одну пачку
+NOTIFICATION_DISPATCH_BATCH = int(os.getenv("NOTIFICATION_DISPATCH_BATCH", "1000"))
+# Outbox-релей: строк в пачке публикации и пауза процесса relay_outbox --loop, сек
+OUTBOX_RELAY_BATCH = int(os.getenv("OUTBOX_RELAY_BATCH", "500"))
+OUTBOX_RELAY_INTERVAL = float(os.getenv("OUTBOX_RELAY_INTERVAL", "1"))
+
+# cacheops — редкие чтения пользователя по pk в вебе (get/exists), со сбросом
+# на save/delete. Горячие чтения доставки (контакт и маска каналов) идут через
+# notifications.contacts; Notification не кешируется — строка меняется на каждой
+# попытке. При недоступном Redis запросы идут прямо в БД, а не падают.
 CACHEOPS_REDIS = REDIS_URL
+CACHEOPS_DEGRADE_ON_FAILURE = True
 CACHEOPS = {
-    "notifications.user": {"ops": "get", "timeout": 60},
+    "notifications.user": {"ops": {"get", "exists"}, "timeout": 60 * 15},
 }
 
 # DRF
@@ -154,6 +189,101 @@ SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "1") == "1"
 SMTP_DEFAULT_USER = os.getenv("SMTP_DEFAULT_USER", "")
 SMTP_DEFAULT_PASSWORD = os.getenv("SMTP_DEFAULT_PASSWORD", "")
 
+# Пул SMTP-сессий в воркере: лимит писем на сессию, простой до закрытия,
+# порог простоя для проверки NOOP и число свободных сессий на один аккаунт
+SMTP_POOL_MAX_MESSAGES = int(os.getenv("SMTP_POOL_MAX_MESSAGES", "100"))
+SMTP_POOL_IDLE_TIMEOUT = float(os.getenv("SMTP_POOL_IDLE_TIMEOUT", "60"))
+SMTP_POOL_NOOP_AFTER = float(os.getenv("SMTP_POOL_NOOP_AFTER", "5"))
+SMTP_POOL_MAX_IDLE = int(os.getenv("SMTP_POOL_MAX_IDLE", "2"))
+
+# Сколько уведомлений отправлять за одну задачу send_email_batch_task
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "200"))
+# Рассылки (priority bulk) — пакетными задачами каналов, а не задачей на строку
+BULK_BATCH_DELIVERY = os.getenv("BULK_BATCH_DELIVERY", "1") == "1"
+
+# Массовое создание: лимит элементов в запросе
+NOTIFICATIONS_BULK_MAX_ITEMS = int(os.getenv("NOTIFICATIONS_BULK_MAX_ITEMS", "10000"))
+# Приём через /api/ingest/ (ASGI): сколько копить запросы до записи пачкой, мс,
+# максимум элементов в пачке и публиковать ли задачи пачки сразу (иначе — outbox-релей)
+INGEST_BATCH_WINDOW_MS = float(os.getenv("INGEST_BATCH_WINDOW_MS", "5"))
+INGEST_BATCH_MAX = int(os.getenv("INGEST_BATCH_MAX", "500"))
+INGEST_PUBLISH = os.getenv("INGEST_PUBLISH", "1").lower() in ("1", "true", "yes")
+# Список уведомлений: размер страницы по умолчанию/максимум, пачка серверного курсора выгрузки
+NOTIFICATIONS_PAGE_SIZE = int(os.getenv("NOTIFICATIONS_PAGE_SIZE", "100"))
+NOTIFICATIONS_PAGE_MAX = int(os.getenv("NOTIFICATIONS_PAGE_MAX", "1000"))
+NOTIFICATIONS_EXPORT_CHUNK = int(os.getenv("NOTIFICATIONS_EXPORT_CHUNK", "2000"))
+# Сводка: уведомления одному пользователю внутри окна уходят одним сообщением
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "0") == "1"
+DIGEST_WINDOW_SEC = float(os.getenv("DIGEST_WINDOW_SEC", "60"))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "50"))
+# через сколько после конца окна сводку, которую не сбросил flush, подбирает диспетчер
+DIGEST_SWEEP_GRACE_SEC = float(os.getenv("DIGEST_SWEEP_GRACE_SEC", "60"))
+DIGEST_MAX_CHARS = int(os.getenv("DIGEST_MAX_CHARS", "3500"))  # запас до 4096 у Telegram
+DIGEST_TEMPLATE = os.getenv("DIGEST_TEMPLATE", "Новых уведомлений: {count}\n\n{items}").replace("\\n", "\n")
+DIGEST_ITEM_TEMPLATE = os.getenv("DIGEST_ITEM_TEMPLATE", "• {message}")
+DIGEST_MORE_TEMPLATE = os.getenv("DIGEST_MORE_TEMPLATE", "…и ещё {count}")
+# Idempotency-Key: сколько помнить результат и сколько держать маркер "в работе", сек
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "60"))
+
+
+# Стратегия доставки по каналам: sequential | hedged | broadcast.
+# hedged запускает следующий канал, если текущий молчит дольше DELIVERY_HEDGE_DELAY
+DELIVERY_STRATEGY = os.getenv("DELIVERY_STRATEGY", "sequential")
+DELIVERY_HEDGE_DELAY = float(os.getenv("DELIVERY_HEDGE_DELAY", "2"))
+DELIVERY_MAX_WORKERS = int(os.getenv("DELIVERY_MAX_WORKERS", "8"))
+# Ретраи по каналам: только временные отказы, у каждого канала свой
+# экспоненциальный backoff с jitter от DELIVERY_RETRY_BASE_SEC до DELIVERY_RETRY_MAX_SEC
+DELIVERY_RETRY_BASE_SEC = float(os.getenv("DELIVERY_RETRY_BASE_SEC", "10"))
+DELIVERY_RETRY_MAX_SEC = float(os.getenv("DELIVERY_RETRY_MAX_SEC", "600"))
+DELIVERY_CHANNEL_MAX_ATTEMPTS = int(os.getenv("DELIVERY_CHANNEL_MAX_ATTEMPTS", "4"))
+# Повтор dead letters: строк в пачке и потолок скорости, уведомлений/сек (0 — без ограничения)
+DEAD_LETTER_REPLAY_CHUNK = int(os.getenv("DEAD_LETTER_REPLAY_CHUNK", "1000"))
+DEAD_LETTER_REPLAY_RATE = float(os.getenv("DEAD_LETTER_REPLAY_RATE", "1000"))
+
+# Кеш контактов пользователей для доставки: в памяти процесса (сек, размер) и в Redis (сек)
+CONTACT_CACHE_LOCAL_SEC = float(os.getenv("CONTACT_CACHE_LOCAL_SEC", "5"))
+CONTACT_CACHE_LOCAL_SIZE = int(os.getenv("CONTACT_CACHE_LOCAL_SIZE", "10000"))
+CONTACT_CACHE_SEC = int(os.getenv("CONTACT_CACHE_SEC", "3600"))
+
+# Скомпилированные шаблоны сообщений в памяти процесса: сколько держать (сек) и сколько штук.
+# Правку шаблона другие процессы увидят не позже TEMPLATE_CACHE_SEC
+TEMPLATE_CACHE_SEC = float(os.getenv("TEMPLATE_CACHE_SEC", "60"))
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "1000"))
+
+# Circuit breaker по каналам (состояние общее для воркеров, в Redis):
+# доля неудач и минимум вызовов в окне CIRCUIT_WINDOW секунд для размыкания,
+# CIRCUIT_OPEN_SEC — сколько канал пропускается до пробного вызова,
+# CIRCUIT_SUCCESS_BATCH — сколько успехов копится в процессе до записи в Redis
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "1") == "1"
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", "30"))
+CIRCUIT_OPEN_SEC = float(os.getenv("CIRCUIT_OPEN_SEC", "30"))
+CIRCUIT_SUCCESS_BATCH = int(os.getenv("CIRCUIT_SUCCESS_BATCH", "50"))
+
+# Реестр транспортов с персональными кредами: размер LRU и простой до вытеснения
+TRANSPORT_REGISTRY_MAXSIZE = int(os.getenv("TRANSPORT_REGISTRY_MAXSIZE", "256"))
+TRANSPORT_REGISTRY_TTL = float(os.getenv("TRANSPORT_REGISTRY_TTL", "600"))
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
-TELEGRAM_PARSE_MODE = os.getenv("TELEGRAM_PARSE_MODE", "")
\ No newline at end of file
+TELEGRAM_PARSE_MODE = os.getenv("TELEGRAM_PARSE_MODE", "")
+# Адрес Bot API; для бенчмарка — заглушка bench_delivery (http://127.0.0.1:8081)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Транспорт Telegram: "requests" (по умолчанию) или "async" (httpx, конкурентно)
+TELEGRAM_TRANSPORT = os.getenv("TELEGRAM_TRANSPORT", "requests")
+TELEGRAM_CONCURRENCY = int(os.getenv("TELEGRAM_CONCURRENCY", "50"))
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "100"))
+TELEGRAM_BATCH_SIZE = int(os.getenv("TELEGRAM_BATCH_SIZE", "500"))
+
+# Лимиты Bot API (общий на воркеры, через Redis): сообщений/с на бота и на чат.
+# Ответ 429 ставит общую паузу на retry_after; TELEGRAM_RATE_MAX_WAIT —
+# сколько задача готова ждать слот, прежде чем считать отправку неудачной.
+TELEGRAM_RATE_LIMIT_ENABLED = os.getenv("TELEGRAM_RATE_LIMIT_ENABLED", "1") == "1"
+TELEGRAM_RATE_GLOBAL = float(os.getenv("TELEGRAM_RATE_GLOBAL", "30"))
+TELEGRAM_RATE_GLOBAL_BURST = float(os.getenv("TELEGRAM_RATE_GLOBAL_BURST", "30"))
+TELEGRAM_RATE_PER_CHAT = float(os.getenv("TELEGRAM_RATE_PER_CHAT", "1"))
+TELEGRAM_RATE_PER_CHAT_BURST = float(os.getenv("TELEGRAM_RATE_PER_CHAT_BURST", "3"))
+TELEGRAM_RATE_MAX_WAIT = float(os.getenv("TELEGRAM_RATE_MAX_WAIT", "30"))
+TELEGRAM_429_MAX_RETRIES = int(os.getenv("TELEGRAM_429_MAX_RETRIES", "3"))
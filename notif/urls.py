@@ -1,12 +1,22 @@
 from django.contrib import admin
 from django.urls import path, include
+from rest_framework.routers import DefaultRouter
 from notifications import views as notifications_views
 
 from notifications.views import DemoView, create_user_view, send_notification_view
 
+router = DefaultRouter()
+router.register("users", notifications_views.UserViewSet, basename="user")
+router.register("notifications", notifications_views.NotificationViewSet, basename="notification")
+router.register("templates", notifications_views.NotificationTemplateViewSet, basename="template")
+
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+
+    path("api/ingest/", notifications_views.ingest_view, name="ingest"),
+
+    path("api/", include(router.urls)),
     
     path("", notifications_views.DemoView.as_view(), name="demo"),
     
@@ -15,5 +25,7 @@ urlpatterns = [
     path("send/", notifications_views.send_notification_view, name="send_notification"),
     
     path('telegram/ping', notifications_views.telegram_ping_view, name='telegram-ping'),
+
+    path("metrics", notifications_views.metrics_view, name="metrics"),
    
 ]
\ No newline at end of file
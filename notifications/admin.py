@@ -1,7 +1,7 @@
 # Регистрация моделей
 from django.contrib import admin
 
-from .models import Notification, User
+from .models import Notification, NotificationTemplate, User
 
 
 @admin.register(User)
@@ -15,11 +15,20 @@ class NotificationAdmin(admin.ModelAdmin):
     list_display = (
         'id',
         'user',
-        'delivered',
+        'status',
+        'priority',
         'delivery_method',
         'attempts',
         'created_at',
+        'dead_at',
     )
-    list_filter = ('delivered', 'delivery_method')
+    list_filter = ('status', 'priority', 'delivery_method', 'last_error_class', 'template')
+    readonly_fields = ('channel_state', 'dead_at', 'last_error_class')
     search_fields = ('message',)
 
+
+
+@admin.register(NotificationTemplate)
+class NotificationTemplateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'subject', 'telegram_parse_mode', 'updated_at')
+    search_fields = ('name', 'subject')
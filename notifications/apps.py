@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class NotificationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notifications'
+
+    def ready(self):
+        # сигналы сброса кешей контактов (User) и шаблонов (NotificationTemplate)
+        from . import contacts, templating  # noqa: F401
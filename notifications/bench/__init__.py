@@ -0,0 +1,10 @@
+"""
+Нагрузочный стенд доставки без внешней сети.
+
+servers — локальные заменители внешних сервисов: SMTP-приёмник на asyncio
+и заглушка Bot API, обе с настраиваемой задержкой и долей ошибок.
+harness — прогоны настоящих send_notification_task и API поверх них
+с отчётом: пропускная способность, p50/p95/p99, SQL-запросов на уведомление.
+
+Запуск — management-командой bench_delivery.
+"""
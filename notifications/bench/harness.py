@@ -0,0 +1,298 @@
+"""
+Прогоны доставки поверх заменителей из servers.
+
+- task: строки создаются заранее, каждая отправляется send_notification_task.apply
+  в этом процессе — чистый горячий путь задачи;
+- api: POST /api/notifications/ в eager-режиме — запрос, outbox-релей и
+  задача выполняются на месте, задержка — время запроса;
+- worker: POST в API без eager, релей публикует в брокер, доставляют
+  запущенные отдельно воркеры. Задержка — от запроса до приёма сообщения
+  заменителем; воркеры должны смотреть на его порты (см. worker_env).
+
+Пользователи и уведомления стенда создаются с адресами @bench.local и
+удаляются после прогона.
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+
+from notif.celery import app
+
+from .. import metrics, outbox, services
+from ..metrics import QueryCounter
+from ..models import DeliveryStatus, Notification, User
+from ..senders.email import EmailSender, SMTPConfig
+from ..senders.telegram import RequestsTelegramTransport, TelegramConfig, TelegramSender
+from ..tasks import send_notification_task
+from .servers import BotApiStub, SmtpSink, marker
+
+EMAIL_DOMAIN = "bench.local"
+BENCH_TOKEN = "bench"
+
+TASK = "task"
+API = "api"
+WORKER = "worker"
+MODES = (TASK, API, WORKER)
+
+
+@dataclass
+class Report:
+    mode: str
+    count: int
+    seconds: float
+    latencies: List[float] = field(default_factory=list)
+    queries: Optional[int] = None
+    statuses: Dict[str, int] = field(default_factory=dict)
+    received: int = 0
+    contacts: Dict[str, int] = field(default_factory=dict)
+
+    def percentile(self, q: float) -> float:
+        """Перцентиль задержки по ближайшему рангу, секунды."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+        return ordered[index]
+
+    def lines(self) -> List[str]:
+        delivered = self.statuses.get(DeliveryStatus.DELIVERED, 0)
+        others = ", ".join(
+            f"{name} {n}" for name, n in sorted(self.statuses.items()) if name != DeliveryStatus.DELIVERED
+        )
+        lines = [
+            f"режим: {self.mode}, уведомлений: {self.count}, доставлено: {delivered}"
+            + (f" ({others})" if others else ""),
+            f"пропускная способность: {self.received / self.seconds if self.seconds else 0:.1f} уведомлений/с"
+            f" (принято заменителями: {self.received} за {self.seconds:.2f} с)",
+            "задержка, мс: "
+            + "  ".join(f"p{q} {self.percentile(q) * 1000:.1f}" for q in (50, 95, 99))
+            + f"  max {max(self.latencies, default=0) * 1000:.1f}",
+        ]
+        if self.queries is not None:
+            lines.append(f"SQL-запросов на уведомление: {self.queries / max(self.count, 1):.1f}")
+        if any(self.contacts.values()):
+            total = sum(self.contacts.values())
+            hits = self.contacts.get("local", 0) + self.contacts.get("redis", 0)
+            lines.append(
+                "контакты: "
+                + ", ".join(f"{name} {self.contacts.get(name, 0)}" for name in CONTACT_RESULTS)
+                + f" (попаданий {hits / total:.0%})"
+            )
+        return lines
+
+
+CONTACT_RESULTS = ("local", "redis", "db", "missing")
+
+
+def contact_lookups() -> Dict[str, int]:
+    """Счётчики notif_contact_lookups_total процесса; без prometheus_client — пусто."""
+    if metrics.prometheus_client is None:
+        return {}
+    registry = metrics.prometheus_client.REGISTRY
+    return {
+        name: int(registry.get_sample_value("notif_contact_lookups_total", {"result": name}) or 0)
+        for name in CONTACT_RESULTS
+    }
+
+
+def _delta(before: Dict[str, int]) -> Dict[str, int]:
+    after = contact_lookups()
+    return {name: after[name] - before.get(name, 0) for name in after}
+
+
+def bench_manager(smtp_port: int, bot_url: str) -> services.DeliveryChainManager:
+    """
+    Те же отправщики, что в get_default_manager (порядок — по priority), но на
+    заменители: без circuit breaker'ов и без лимитера Telegram, чтобы замер не
+    упирался в их пороги.
+    """
+    smtp_cfg = SMTPConfig(
+        host="127.0.0.1", port=smtp_port, use_tls=False, user=None, password=None, timeout_sec=10,
+    )
+    tg_cfg = TelegramConfig(token=BENCH_TOKEN, base_url=bot_url, parse_mode=None, timeout_sec=10)
+    return services.DeliveryChainManager(
+        [
+            EmailSender(base_config=smtp_cfg),
+            TelegramSender(
+                transport=RequestsTelegramTransport(tg_cfg, rate_limiter=None), base_config=tg_cfg,
+            ),
+        ],
+        strategy=services.get_default_manager().strategy,
+    )
+
+
+def worker_env(smtp: SmtpSink, bot: BotApiStub) -> Dict[str, str]:
+    """Переменные окружения воркеров для режима worker."""
+    return {
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp.port),
+        "SMTP_USE_TLS": "0",
+        "SMTP_DEFAULT_USER": "",
+        "TELEGRAM_API_URL": bot.url,
+        "TELEGRAM_BOT_TOKEN": BENCH_TOKEN,
+        "CIRCUIT_BREAKER_ENABLED": "0",
+        "DIGEST_ENABLED": "0",
+    }
+
+
+@contextmanager
+def use_manager(manager: services.DeliveryChainManager) -> Iterator[None]:
+    previous = services._manager
+    services._manager = manager
+    try:
+        yield
+    finally:
+        services._manager = previous
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryCounter]:
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def seed_users(count: int) -> List[int]:
+    User.objects.bulk_create(
+        User(email=f"u{i}@{EMAIL_DOMAIN}", telegram_id=str(900000 + i)) for i in range(count)
+    )
+    return list(
+        User.objects.filter(email__endswith=f"@{EMAIL_DOMAIN}").order_by("id").values_list("id", flat=True)
+    )
+
+
+def cleanup() -> None:
+    User.objects.filter(email__endswith=f"@{EMAIL_DOMAIN}").delete()
+
+
+def _statuses(user_ids: List[int]) -> Dict[str, int]:
+    rows = (
+        Notification.objects.filter(user_id__in=user_ids)
+        .values("status")
+        .annotate(n=Count("id"))
+        .values_list("status", "n")
+    )
+    return dict(rows)
+
+
+def _received(smtp: SmtpSink, bot: BotApiStub) -> Dict[int, float]:
+    """Метка -> время первого приёма любым из заменителей."""
+    received = dict(bot.recorder.received)
+    for n, at in smtp.recorder.received.items():
+        received[n] = min(at, received.get(n, at))
+    return received
+
+
+def run_task(count: int, user_ids: List[int], smtp: SmtpSink, bot: BotApiStub) -> Report:
+    ids = [
+        notif.id
+        for notif in Notification.objects.bulk_create(
+            Notification(user_id=user_ids[i % len(user_ids)], message=f"{marker(i)} benchmark")
+            for i in range(count)
+        )
+    ]
+    if not all(ids):
+        # бэкенд без RETURNING: берём id последних вставленных строк
+        ids = list(
+            Notification.objects.filter(user_id__in=user_ids).order_by("-id").values_list("id", flat=True)[:count]
+        )[::-1]
+    report = Report(TASK, count, 0.0)
+    lookups = contact_lookups()
+    with override_settings(DIGEST_ENABLED=False), use_manager(
+        bench_manager(smtp.port, bot.url)
+    ), count_queries() as queries:
+        started = time.perf_counter()
+        for notif_id in ids:
+            call_started = time.perf_counter()
+            send_notification_task.apply((notif_id,))
+            report.latencies.append(time.perf_counter() - call_started)
+        report.seconds = time.perf_counter() - started
+    report.queries = queries.count
+    report.contacts = _delta(lookups)
+    report.statuses = _statuses(user_ids)
+    report.received = len(_received(smtp, bot))
+    return report
+
+
+def _post(client: Client, user_id: int, n: int):
+    return client.post(
+        "/api/notifications/",
+        {"user_id": user_id, "message": f"{marker(n)} benchmark"},
+        content_type="application/json",
+    )
+
+
+def run_api(count: int, user_ids: List[int], smtp: SmtpSink, bot: BotApiStub) -> Report:
+    client = Client()
+    report = Report(API, count, 0.0)
+    lookups = contact_lookups()
+    previous_eager = app.conf.task_always_eager
+    app.conf.task_always_eager = True
+    try:
+        with override_settings(
+            CELERY_TASK_ALWAYS_EAGER=True, DIGEST_ENABLED=False, ALLOWED_HOSTS=["*"],
+        ), use_manager(bench_manager(smtp.port, bot.url)), count_queries() as queries:
+            started = time.perf_counter()
+            for i in range(count):
+                call_started = time.perf_counter()
+                response = _post(client, user_ids[i % len(user_ids)], i)
+                report.latencies.append(time.perf_counter() - call_started)
+                if response.status_code != 202:
+                    raise RuntimeError(f"API ответил {response.status_code}: {response.content[:200]!r}")
+            report.seconds = time.perf_counter() - started
+    finally:
+        app.conf.task_always_eager = previous_eager
+    report.queries = queries.count
+    report.contacts = _delta(lookups)
+    report.statuses = _statuses(user_ids)
+    report.received = len(_received(smtp, bot))
+    return report
+
+
+def run_worker(
+    count: int,
+    user_ids: List[int],
+    smtp: SmtpSink,
+    bot: BotApiStub,
+    timeout: float = 60.0,
+) -> Report:
+    """
+    Запросы идут в API, outbox публикуется отсюда же, пока заменители не примут
+    все метки или не выйдет timeout. SQL воркеров здесь не виден — он в
+    notif_task_db_queries на /metrics.
+    """
+    client = Client()
+    report = Report(WORKER, count, 0.0)
+    sent_at: Dict[int, float] = {}
+    previous_eager = app.conf.task_always_eager
+    app.conf.task_always_eager = False
+    try:
+        with override_settings(CELERY_TASK_ALWAYS_EAGER=False, ALLOWED_HOSTS=["*"]):
+            started = time.time()
+            for i in range(count):
+                sent_at[i] = time.time()
+                response = _post(client, user_ids[i % len(user_ids)], i)
+                if response.status_code != 202:
+                    raise RuntimeError(f"API ответил {response.status_code}: {response.content[:200]!r}")
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                outbox.relay()
+                if len(_received(smtp, bot)) >= count:
+                    break
+                time.sleep(0.05)
+    finally:
+        app.conf.task_always_eager = previous_eager
+    received = _received(smtp, bot)
+    report.seconds = (max(received.values()) if received else time.time()) - started
+    report.latencies = [at - sent_at[n] for n, at in received.items() if n in sent_at]
+    report.statuses = _statuses(user_ids)
+    report.received = len(received)
+    return report
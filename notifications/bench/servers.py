@@ -0,0 +1,212 @@
+"""
+Заменители SMTP-сервера и Telegram Bot API для бенчмарка.
+
+Оба слушают 127.0.0.1, отвечают с задержкой latency_ms и с вероятностью
+error_rate возвращают ошибку error_code. Каждый принятый текст с меткой
+"bench-<n>" записывается с временем приёма — по нему считается сквозная
+задержка и в режиме воркеров, когда отправка идёт в других процессах.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Set
+
+MARKER_RE = re.compile(rb"bench-(\d+)")
+
+
+def marker(n: int) -> str:
+    """Метка уведомления в тексте сообщения."""
+    return f"bench-{n}"
+
+
+@dataclass(frozen=True)
+class Behaviour:
+    """Поведение заменителя: задержка ответа и доля ошибок."""
+    latency_ms: float = 0.0
+    error_rate: float = 0.0
+    error_code: int = 0
+    seed: Optional[int] = None
+
+
+class _Recorder:
+    """Время первого приёма каждой метки; общее для потоков сервера."""
+
+    def __init__(self, behaviour: Behaviour) -> None:
+        self.behaviour = behaviour
+        self.received: Dict[int, float] = {}
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(behaviour.seed)
+        self._lock = threading.Lock()
+
+    def decide(self) -> bool:
+        """True — ответить ошибкой."""
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.behaviour.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def record(self, data: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            for match in MARKER_RE.finditer(data):
+                self.received.setdefault(int(match.group(1)), now)
+
+
+class SmtpSink:
+    """
+    Минимальный SMTP-сервер на asyncio (в духе aiosmtpd): EHLO/HELO, MAIL,
+    RCPT, DATA, RSET, NOOP, QUIT, без TLS и авторизации. Задержка и ошибка
+    (по умолчанию 451 — временная) применяются к ответу на DATA.
+    Работает в своём потоке со своим event loop.
+    """
+
+    def __init__(self, behaviour: Behaviour = Behaviour(), port: int = 0) -> None:
+        self.recorder = _Recorder(behaviour)
+        self._port = port
+        self.port: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._sessions: Set[asyncio.Task] = set()
+
+    def start(self) -> "SmtpSink":
+        ready = threading.Event()
+
+        def run() -> None:
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, "127.0.0.1", self._port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="bench-smtp", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+
+        async def shutdown() -> None:
+            self._server.close()
+            # открытые сессии пула SMTP закрываем сами, иначе loop встанет с ними
+            for session in list(self._sessions):
+                session.cancel()
+            await asyncio.gather(*self._sessions, return_exceptions=True)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        behaviour = self.recorder.behaviour
+        session = asyncio.current_task()
+        self._sessions.add(session)
+        writer.write(b"220 bench ESMTP\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                if command == b"EHLO":
+                    writer.write(b"250-bench\r\n250-8BITMIME\r\n250 SIZE 10485760\r\n")
+                elif command in (b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                    writer.write(b"250 OK\r\n")
+                elif command == b"DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    data = await reader.readuntil(b"\r\n.\r\n")
+                    if behaviour.latency_ms:
+                        await asyncio.sleep(behaviour.latency_ms / 1000)
+                    if self.recorder.decide():
+                        code = behaviour.error_code or 451
+                        writer.write(f"{code} bench error\r\n".encode())
+                    else:
+                        self.recorder.record(data)
+                        writer.write(b"250 OK queued\r\n")
+                elif command == b"QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"502 Command not implemented\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._sessions.discard(session)
+            writer.close()
+
+
+class BotApiStub:
+    """
+    Заглушка sendMessage Bot API на ThreadingHTTPServer с keep-alive.
+    Ошибка по умолчанию — 502; для 429 в ответ кладётся retry_after=1.
+    """
+
+    def __init__(self, behaviour: Behaviour = Behaviour(), port: int = 0) -> None:
+        self.recorder = _Recorder(behaviour)
+        recorder = self.recorder
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # заголовки и тело уходят разными write: без этого Nagle + delayed ACK
+            # добавляют ~40 мс к каждому ответу на keep-alive соединении
+            disable_nagle_algorithm = True
+
+            def do_POST(self) -> None:  # noqa: N802 - имя задаёт http.server
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if recorder.behaviour.latency_ms:
+                    time.sleep(recorder.behaviour.latency_ms / 1000)
+                if recorder.decide():
+                    code = recorder.behaviour.error_code or 502
+                    payload = {"ok": False, "error_code": code, "description": "bench error"}
+                    if code == 429:
+                        payload["parameters"] = {"retry_after": 1}
+                else:
+                    recorder.record(body)
+                    code, payload = 200, {"ok": True, "result": {"message_id": 1}}
+                data = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "BotApiStub":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="bench-bot-api", daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,44 @@
+"""Массовое создание уведомлений; в брокер их публикует outbox."""
+from __future__ import annotations
+
+from typing import List, Mapping, Sequence
+
+from django.db import connection, transaction
+
+from .models import Notification, Priority
+
+
+def bulk_create_notifications(
+    rows: Sequence[Mapping],
+    batch_size: int = 1000,
+    priority: int = Priority.BULK,
+    **fields,
+) -> List[int]:
+    """
+    Вставляет уведомления multi-row INSERT'ами и возвращает их id по порядку.
+    rows — поля каждой строки: user_id и message или template_id + params.
+    fields — общие поля всех строк (обычно initial_delivery_fields: тогда
+    в брокер их опубликует outbox-релей).
+    """
+    objs = [Notification(priority=priority, **row, **fields) for row in rows]
+    return insert_notifications(objs, batch_size)
+
+
+def insert_notifications(objs: Sequence[Notification], batch_size: int = 1000) -> List[int]:
+    """
+    Вставляет готовые объекты (поля могут различаться по строкам) и
+    возвращает их id по порядку.
+
+    PostgreSQL отдаёт id прямо из INSERT ... RETURNING. SQLite в Django 3.2
+    так не умеет — тогда берём последние N id внутри той же транзакции:
+    запись в SQLite сериализована, чужих строк между ними быть не может.
+    """
+    with transaction.atomic():
+        created = Notification.objects.bulk_create(objs, batch_size=batch_size)
+        if connection.features.can_return_rows_from_bulk_insert:
+            return [obj.pk for obj in created]
+        ids = list(
+            Notification.objects.order_by("-id").values_list("id", flat=True)[:len(objs)]
+        )
+    ids.reverse()
+    return ids
@@ -0,0 +1,300 @@
+"""
+Circuit breaker для каналов доставки.
+
+Состояние общее для всех воркеров и хранится в Redis:
+- closed: вызовы идут, исходы копятся в скользящем окне из десяти корзин;
+  доля неудач >= failure_rate при min_calls вызовах — канал размыкается;
+- open: канал пропускается без вызова до open_until;
+- half-open: после open_until пропускается ровно одна проба (SET NX);
+  успех замыкает канал, неудача размыкает снова.
+
+Разомкнутое состояние кешируется в процессе до open_until, замкнутое —
+на state_cache_sec, поэтому проверка на горячем пути обычно не ходит в Redis.
+Успехи в замкнутом состоянии тоже не пишутся по одному: процесс копит их
+и отправляет одним EVAL вместе с ближайшей неудачей, по набору
+success_batch или раз в корзину окна. Неудачи и исход пробы пишутся сразу.
+Если Redis недоступен, состояние ведётся в памяти процесса.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_WINDOW_BUCKETS = 10
+
+# KEYS[1]: префикс ключей канала
+# ARGV: now, успехов, неудач, bucket_sec, buckets, failure_rate, min_calls, open_sec,
+#       probe (1 — исход пробы half-open)
+# Возвращает 'closed' или open_until строкой, если канал разомкнут.
+_RECORD_LUA = """
+local base = KEYS[1]
+local now = tonumber(ARGV[1])
+local ok_n = tonumber(ARGV[2])
+local fail_n = tonumber(ARGV[3])
+local bucket_sec = tonumber(ARGV[4])
+local buckets = tonumber(ARGV[5])
+local open_sec = tonumber(ARGV[8])
+local current = math.floor(now / bucket_sec)
+
+local function clear_window()
+  for i = 0, buckets - 1 do
+    redis.call('DEL', base .. ':w:' .. (current - i))
+  end
+end
+
+local open_until = tonumber(redis.call('GET', base .. ':open_until') or '0')
+if open_until > 0 then
+  if now < open_until then
+    return tostring(open_until)
+  end
+  -- half-open: неудача размыкает снова, замыкает только успешная проба;
+  -- успехи, накопленные процессом до размыкания, пробой не считаются
+  if fail_n > 0 then
+    redis.call('DEL', base .. ':probe')
+    redis.call('SET', base .. ':open_until', now + open_sec, 'EX', 86400)
+    return tostring(now + open_sec)
+  end
+  if tonumber(ARGV[9]) == 1 then
+    redis.call('DEL', base .. ':probe')
+    redis.call('DEL', base .. ':open_until')
+    clear_window()
+    return 'closed'
+  end
+  return tostring(open_until)
+end
+
+local key = base .. ':w:' .. current
+redis.call('HINCRBY', key, 'total', ok_n + fail_n)
+if fail_n > 0 then
+  redis.call('HINCRBY', key, 'fail', fail_n)
+end
+redis.call('EXPIRE', key, math.ceil(bucket_sec * buckets) + 1)
+
+local total, fail = 0, 0
+for i = 0, buckets - 1 do
+  local data = redis.call('HMGET', base .. ':w:' .. (current - i), 'total', 'fail')
+  total = total + (tonumber(data[1]) or 0)
+  fail = fail + (tonumber(data[2]) or 0)
+end
+if total >= tonumber(ARGV[7]) and fail / total >= tonumber(ARGV[6]) then
+  redis.call('SET', base .. ':open_until', now + open_sec, 'EX', 86400)
+  clear_window()
+  return tostring(now + open_sec)
+end
+return 'closed'
+"""
+
+
+class _LocalCircuit:
+    """Тот же автомат в памяти процесса — fallback при недоступном Redis."""
+
+    def __init__(self) -> None:
+        self.calls: Deque[Tuple[float, bool]] = deque()
+        self.open_until = 0.0
+        self.probe_until = 0.0
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_rate: float = 0.5,
+        min_calls: int = 10,
+        window_sec: float = 30.0,
+        open_sec: float = 30.0,
+        probe_timeout_sec: float = 60.0,
+        state_cache_sec: float = 1.0,
+        success_batch: int = 50,
+        prefix: str = "cb",
+        use_redis: bool = True,
+    ) -> None:
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_sec = window_sec
+        self.open_sec = open_sec
+        self.probe_timeout_sec = probe_timeout_sec
+        self.state_cache_sec = state_cache_sec
+        self.success_batch = success_batch
+        self._base = f"{prefix}:{name}"
+        self._use_redis = use_redis
+        self._redis_retry_at = 0.0
+        self._local = _LocalCircuit()
+        self._lock = threading.Lock()
+        # кеш процесса: (состояние, до какого момента ему верим)
+        self._cached: Tuple[str, float] = (CLOSED, 0.0)
+        # успехи, ещё не записанные в Redis, и когда их записать самое позднее
+        self._pending_ok = 0
+        self._flush_at = 0.0
+
+    def _redis_available(self) -> bool:
+        return self._use_redis and time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self) -> None:
+        self._redis_retry_at = time.monotonic() + 30
+        logger.warning("Redis недоступен, circuit breaker %s работает локально", self.name)
+
+    def allow(self) -> bool:
+        """Можно ли сейчас вызывать канал (в half-open — только одна проба)."""
+        now = time.time()
+        state, valid_until = self._cached
+        if now < valid_until:
+            return state == CLOSED
+
+        if self._redis_available():
+            try:
+                return self._allow_redis(now)
+            except RedisError:
+                self._redis_failed()
+        return self._allow_local(now)
+
+    def _allow_redis(self, now: float) -> bool:
+        client = get_redis()
+        raw = client.get(f"{self._base}:open_until")
+        open_until = float(raw) if raw else 0.0
+        if not open_until:
+            self._cached = (CLOSED, now + self.state_cache_sec)
+            return True
+        if now < open_until:
+            self._cached = (OPEN, open_until)
+            return False
+        # half-open: пробу забирает один вызов на все воркеры
+        acquired = client.set(
+            f"{self._base}:probe", "1", nx=True, px=int(self.probe_timeout_sec * 1000)
+        )
+        return bool(acquired)
+
+    def _allow_local(self, now: float) -> bool:
+        with self._lock:
+            local = self._local
+            if not local.open_until:
+                return True
+            if now < local.open_until:
+                return False
+            if now < local.probe_until:
+                return False
+            local.probe_until = now + self.probe_timeout_sec
+            return True
+
+    def record(self, ok: bool) -> None:
+        """Учитывает исход вызова канала."""
+        now = time.time()
+        if not self._redis_available():
+            self._record_local(ok, now)
+            return
+        bucket_sec = self.window_sec / _WINDOW_BUCKETS
+        with self._lock:
+            # в замкнутом состоянии успех ничего не меняет — копим их в процессе
+            probe = self._cached[0] != CLOSED
+            if ok:
+                self._pending_ok += 1
+                if not probe and self._pending_ok < self.success_batch and now < self._flush_at:
+                    return
+            successes, self._pending_ok = self._pending_ok, 0
+            self._flush_at = now + bucket_sec
+        try:
+            state = get_redis().eval(
+                _RECORD_LUA,
+                1,
+                self._base,
+                now,
+                successes,
+                0 if ok else 1,
+                bucket_sec,
+                _WINDOW_BUCKETS,
+                self.failure_rate,
+                self.min_calls,
+                self.open_sec,
+                1 if probe else 0,
+            )
+        except RedisError:
+            self._redis_failed()
+            self._record_local(ok, now)
+            return
+        self._apply(state.decode() if isinstance(state, bytes) else state, now)
+
+    def _apply(self, state: str, now: float) -> None:
+        if state == CLOSED:
+            self._cached = (CLOSED, now + self.state_cache_sec)
+            return
+        previous, _ = self._cached
+        self._cached = (OPEN, float(state))
+        if previous != OPEN:
+            logger.warning("Канал %s разомкнут до %s", self.name, state)
+
+    def _record_local(self, ok: bool, now: float) -> None:
+        with self._lock:
+            local = self._local
+            if local.open_until:
+                if now < local.open_until:
+                    return
+                local.probe_until = 0.0
+                if ok:
+                    local.open_until = 0.0
+                    local.calls.clear()
+                    self._cached = (CLOSED, 0.0)
+                else:
+                    local.open_until = now + self.open_sec
+                return
+
+            local.calls.append((now, ok))
+            while local.calls and now - local.calls[0][0] > self.window_sec:
+                local.calls.popleft()
+            total = len(local.calls)
+            failed = sum(1 for _, c_ok in local.calls if not c_ok)
+            if total >= self.min_calls and failed / total >= self.failure_rate:
+                local.open_until = now + self.open_sec
+                local.calls.clear()
+                logger.warning("Канал %s разомкнут на %s с", self.name, self.open_sec)
+
+    def state(self) -> str:
+        """Текущее состояние (для админки/метрик); не занимает пробу."""
+        now = time.time()
+        open_until = self._local.open_until
+        if self._redis_available():
+            try:
+                raw = get_redis().get(f"{self._base}:open_until")
+                open_until = float(raw) if raw else 0.0
+            except RedisError:
+                self._redis_failed()
+        if not open_until:
+            return CLOSED
+        return OPEN if now < open_until else HALF_OPEN
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> Optional[CircuitBreaker]:
+    """Breaker канала по настройкам CIRCUIT_*; None, если выключены."""
+    if not getattr(settings, "CIRCUIT_BREAKER_ENABLED", True):
+        return None
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers.setdefault(
+            name,
+            CircuitBreaker(
+                name,
+                failure_rate=float(getattr(settings, "CIRCUIT_FAILURE_RATE", 0.5)),
+                min_calls=int(getattr(settings, "CIRCUIT_MIN_CALLS", 10)),
+                window_sec=float(getattr(settings, "CIRCUIT_WINDOW", 30)),
+                open_sec=float(getattr(settings, "CIRCUIT_OPEN_SEC", 30)),
+                success_batch=int(getattr(settings, "CIRCUIT_SUCCESS_BATCH", 50)),
+            ),
+        )
+    return breaker
@@ -0,0 +1,220 @@
+"""
+Контакты пользователя для доставки: адреса каналов и битовая маска каналов,
+в которые у пользователя вообще есть куда слать (EMAIL | SMS | TELEGRAM).
+
+Задача доставки берёт контакт по user_id вместо строки User: сначала из
+памяти процесса (CONTACT_CACHE_LOCAL_SEC), затем из Redis (CONTACT_CACHE_SEC)
+и только потом из БД. В Redis контакт — одна короткая строка JSON
+[маска, email, phone, telegram_id]. По маске цепочка сразу отбрасывает
+отправщиков без контакта, не вызывая их (см. Sender.channel_bit).
+
+Новый пользователь (API, форма, админка) записывается в кеш сразу после
+коммита — его первое уведомление не идёт в БД за контактом. Изменение и
+удаление сбрасывают кеши — сразу и ещё раз после коммита, чтобы
+параллельное чтение не вернуло в кеш старую версию; перезаписи при
+изменении нет: порядок on_commit двух конкурирующих сохранений не гарантирован.
+Кеши процессов, кроме текущего, догоняют изменение не позже
+CONTACT_CACHE_LOCAL_SEC. bulk_create/update() сигналов не шлют — после них
+зовите invalidate(). Без Redis остаются кеш процесса и БД.
+
+Попадания считаются в notif_contact_lookups_total{result}: local / redis /
+db (промах) / missing (пользователя нет).
+"""
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from redis.exceptions import RedisError
+
+from . import metrics
+from .localcache import LocalCache
+from .models import User
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Биты каналов в маске контакта
+EMAIL = 1
+SMS = 2
+TELEGRAM = 4
+
+CONTACT_FIELDS = ("email", "phone", "telegram_id")
+_BITS = ((EMAIL, "email"), (SMS, "phone"), (TELEGRAM, "telegram_id"))
+
+
+def channels_of(user: object) -> int:
+    """Маска каналов, для которых у пользователя заполнен контакт."""
+    mask = 0
+    for bit, attr in _BITS:
+        if getattr(user, attr, None):
+            mask |= bit
+    return mask
+
+
+@dataclass
+class UserContact:
+    """
+    Всё, что отправщикам нужно от User. Экземпляр из кеша общий для потоков —
+    разовые SMTP-креды задача кладёт в копию (dataclasses.replace).
+    """
+    id: int
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    telegram_id: Optional[str] = None
+    channels: int = 0
+    smtp_user: Optional[str] = None
+    smtp_password: Optional[str] = None
+
+    @property
+    def pk(self) -> int:
+        return self.id
+
+    @classmethod
+    def from_row(cls, pk: int, email, phone, telegram_id) -> "UserContact":
+        contact = cls(pk, email or None, phone or None, telegram_id or None)
+        contact.channels = channels_of(contact)
+        return contact
+
+    def dumps(self) -> str:
+        return json.dumps([self.channels, self.email, self.phone, self.telegram_id])
+
+    @classmethod
+    def loads(cls, pk: int, raw: bytes) -> "UserContact":
+        channels, email, phone, telegram_id = json.loads(raw)
+        return cls(pk, email, phone, telegram_id, channels)
+
+
+def _local_ttl() -> float:
+    return float(getattr(settings, "CONTACT_CACHE_LOCAL_SEC", 5))
+
+
+def _redis_ttl() -> int:
+    return int(getattr(settings, "CONTACT_CACHE_SEC", 3600))
+
+
+def _redis_key(user_id: int) -> str:
+    return f"notif:contact:{user_id}"
+
+
+_local: LocalCache[UserContact] = LocalCache(int(getattr(settings, "CONTACT_CACHE_LOCAL_SIZE", 10000)))
+
+
+def get_contact(user_id: int) -> Optional[UserContact]:
+    """Контакт пользователя или None, если пользователя нет."""
+    return get_contacts([user_id]).get(user_id)
+
+
+def get_contacts(user_ids: Iterable[int]) -> Dict[int, UserContact]:
+    """
+    Контакты нескольких пользователей: кеш процесса, затем один MGET в Redis,
+    затем один SELECT по оставшимся. Несуществующих пользователей в ответе нет.
+    """
+    found: Dict[int, UserContact] = {}
+    wanted = list(dict.fromkeys(user_ids))
+    local_ttl = _local_ttl()
+    if local_ttl > 0:
+        for user_id in wanted:
+            contact = _local.get(user_id)
+            if contact is not None:
+                found[user_id] = contact
+        _count("local", len(found))
+    rest = [user_id for user_id in wanted if user_id not in found]
+    if not rest:
+        return found
+
+    fresh: Dict[int, UserContact] = {}
+    try:
+        raws = get_redis().mget([_redis_key(user_id) for user_id in rest])
+    except RedisError:
+        logger.warning("Redis недоступен, контакты %s читаются из БД", rest)
+        raws = [None] * len(rest)
+    for user_id, raw in zip(rest, raws):
+        if raw is not None:
+            fresh[user_id] = UserContact.loads(user_id, raw)
+    _count("redis", len(fresh))
+
+    missed = [user_id for user_id in rest if user_id not in fresh]
+    if missed:
+        rows = User.objects.filter(pk__in=missed).values_list("pk", *CONTACT_FIELDS)
+        loaded = {row[0]: UserContact.from_row(*row) for row in rows}
+        _count("db", len(loaded))
+        _count("missing", len(missed) - len(loaded))
+        _store_redis(loaded.values())
+        fresh.update(loaded)
+
+    if local_ttl > 0:
+        for contact in fresh.values():
+            _local.put(contact.id, contact, local_ttl)
+    found.update(fresh)
+    return found
+
+
+def _count(result: str, n: int) -> None:
+    if n:
+        metrics.CONTACT_LOOKUPS.labels(result).inc(n)
+
+
+def _store_redis(items: Iterable[UserContact]) -> None:
+    items = list(items)
+    if not items:
+        return
+    ttl = _redis_ttl()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for contact in items:
+            pipe.set(_redis_key(contact.id), contact.dumps(), ex=ttl)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+def store(user: User) -> None:
+    """Записывает контакт пользователя в оба кеша (write-through)."""
+    contact = UserContact.from_row(user.pk, *(getattr(user, name) for name in CONTACT_FIELDS))
+    _store_redis([contact])
+    local_ttl = _local_ttl()
+    if local_ttl > 0:
+        _local.put(contact.id, contact, local_ttl)
+
+
+def contact_for(user_id: int) -> UserContact:
+    """Контакт или пустой (без каналов), если пользователя уже нет."""
+    return get_contact(user_id) or UserContact(user_id)
+
+
+def invalidate(user_ids: Iterable[int]) -> None:
+    """Сбрасывает контакты в кеше процесса и в Redis."""
+    keys = []
+    for user_id in user_ids:
+        _local.discard(user_id)
+        keys.append(_redis_key(user_id))
+    if not keys:
+        return
+    try:
+        get_redis().delete(*keys)
+    except RedisError:
+        logger.warning("Redis недоступен, контакты %s не сброшены", keys)
+
+
+@receiver(post_save, sender=User, dispatch_uid="notifications.contacts.saved")
+def _user_saved(sender, instance: User, created: bool = False, **kwargs) -> None:
+    if created:
+        # новой строки ни в одном кеше нет; пишем, когда она станет видна воркерам
+        transaction.on_commit(lambda: store(instance))
+        return
+    _user_changed(sender, instance)
+
+
+@receiver(post_delete, sender=User, dispatch_uid="notifications.contacts.deleted")
+def _user_changed(sender, instance: User, **kwargs) -> None:
+    user_id = instance.pk
+    invalidate([user_id])
+    # до коммита параллельная задача могла положить в кеш старую версию
+    transaction.on_commit(lambda: invalidate([user_id]))
@@ -0,0 +1,176 @@
+"""
+Сводка (digest) для пачек уведомлений одному пользователю.
+
+Окно на пользователя открывает первое уведомление: оно уходит сразу,
+а в Redis ставится маркер на DIGEST_WINDOW_SEC и планируется сброс окна.
+Всё, что приходит пока маркер жив, не отправляется по отдельности, а
+помечается в БД сроком сводки (Notification.digest_due_at — конец окна).
+По истечении окна flush забирает помеченные строки и отправляет одной
+сводкой через обычную цепочку каналов — все строки сводки помечаются
+доставленными тем каналом, что доставил сводку.
+
+Redis решает только, открыто ли окно; что ждёт сводки — знает БД. Поэтому
+потерянный сброс, сбой Redis или его перезапуск строки не теряют: диспетчер
+(dispatch_scheduled_task) подбирает просроченные на DIGEST_SWEEP_GRACE_SEC
+и сбрасывает их сам.
+
+Канал выбирает цепочка в момент отправки, поэтому окно общее на
+пользователя, а не на пару пользователь/канал. Срочные уведомления
+(Priority.HIGH) в сводку не попадают.
+Если Redis недоступен, уведомления отправляются как обычно.
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+from typing import List, Optional, Sequence, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from .models import DeliveryStatus, Notification
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS: маркер окна; ARGV: окно (мс), конец окна (unix timestamp)
+# {1, конец} — окна не было, оно открыто этим уведомлением (его шлём сразу);
+# {0, конец} — окно открыто, конец — тот, что записал открывший его.
+_DEFER_LUA = """
+if redis.call('SET', KEYS[1], ARGV[2], 'NX', 'PX', ARGV[1]) then
+  return {1, ARGV[2]}
+end
+return {0, redis.call('GET', KEYS[1])}
+"""
+
+OPENED = "opened"
+DEFERRED = "deferred"
+BYPASS = "bypass"
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, "DIGEST_ENABLED", False))
+
+
+def window_sec() -> float:
+    return float(getattr(settings, "DIGEST_WINDOW_SEC", 60))
+
+
+def max_items() -> int:
+    return int(getattr(settings, "DIGEST_MAX_ITEMS", 50))
+
+
+def sweep_grace_sec() -> float:
+    return float(getattr(settings, "DIGEST_SWEEP_GRACE_SEC", 60))
+
+
+def _key(user_id: int) -> str:
+    return f"notif:digest:{user_id}:open"
+
+
+def _at(timestamp: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+
+def defer(user_id: int) -> Tuple[str, Optional[float]]:
+    """
+    Решает судьбу уведомления пользователя: (OPENED, конец окна) — отправить
+    сразу и запланировать сброс окна; (DEFERRED, конец окна) — копить в сводку
+    (см. hold); (BYPASS, None) — Redis недоступен. Время — unix timestamp.
+    """
+    window = window_sec()
+    now = timezone.now().timestamp()
+    try:
+        opened, end = get_redis().eval(
+            _DEFER_LUA, 1, _key(user_id), int(window * 1000), repr(now + window),
+        )
+    except RedisError:
+        logger.warning("Redis недоступен, сводка для пользователя %s не копится", user_id)
+        return BYPASS, None
+    # срок у всех строк окна — ровно конец, записанный открывшим: сброс по
+    # нему забирает их все. Маркер мог истечь между SET и GET — тогда сейчас
+    due = float(end) if end else now
+    return (OPENED if int(opened) == 1 else DEFERRED), due
+
+
+def hold(notif_id: int, due: float) -> bool:
+    """
+    Помечает уведомление ждущим сводки до due. False — строка уже не в queued
+    (её взяла другая задача), копить нечего.
+    """
+    return bool(
+        Notification.objects.filter(pk=notif_id, status=DeliveryStatus.QUEUED)
+        .update(digest_due_at=_at(due))
+    )
+
+
+def take(user_id: int, due: Optional[float], limit: int) -> Tuple[List[int], bool]:
+    """
+    id до limit строк пользователя, ждущих сводки со сроком не позже due
+    (None — сейчас); второй элемент — остались ли ещё. Строки не меняются:
+    их забирает в аренду send_digest_task.
+    """
+    cutoff = _at(due) if due is not None else timezone.now()
+    ids = list(
+        Notification.objects.filter(
+            user_id=user_id, status=DeliveryStatus.QUEUED, digest_due_at__lte=cutoff,
+        )
+        .order_by("id")
+        .values_list("id", flat=True)[:limit + 1]
+    )
+    return ids[:limit], len(ids) > limit
+
+
+def sweep(limit: int) -> Tuple[Set[int], float]:
+    """
+    Строки сводок, чей сброс опоздал на DIGEST_SWEEP_GRACE_SEC (сброс потерян,
+    упал, Redis перезапущен): их срок переносится на сейчас, чтобы следующий
+    проход не подобрал их снова, пока их сбрасывают. Возвращает пользователей
+    и новый срок — для flush.
+    """
+    now = timezone.now()
+    cutoff = now - datetime.timedelta(seconds=sweep_grace_sec())
+    with transaction.atomic():
+        rows = list(
+            Notification.objects.filter(status=DeliveryStatus.QUEUED, digest_due_at__lt=cutoff)
+            .select_for_update(skip_locked=True)
+            .order_by("digest_due_at")
+            .values_list("id", "user_id")[:limit]
+        )
+        if rows:
+            Notification.objects.filter(pk__in=[pk for pk, _ in rows]).update(digest_due_at=now)
+    return {user_id for _, user_id in rows}, now.timestamp()
+
+
+def render(messages: Sequence[str]) -> str:
+    """
+    Текст сводки по шаблонам DIGEST_TEMPLATE ({count}, {items}) и
+    DIGEST_ITEM_TEMPLATE ({message}). Длина ограничена DIGEST_MAX_CHARS:
+    не влезшие пункты сворачиваются в DIGEST_MORE_TEMPLATE ({count}).
+    """
+    template = getattr(settings, "DIGEST_TEMPLATE", "Новых уведомлений: {count}\n\n{items}")
+    item_template = getattr(settings, "DIGEST_ITEM_TEMPLATE", "• {message}")
+    more_template = getattr(settings, "DIGEST_MORE_TEMPLATE", "…и ещё {count}")
+    max_chars = int(getattr(settings, "DIGEST_MAX_CHARS", 3500))
+
+    # запас под хвост "…и ещё N", чтобы он не вытолкнул сводку за лимит
+    budget = max_chars - len(template.format(count=len(messages), items=""))
+    budget -= len(more_template.format(count=len(messages))) + 1
+    lines: List[str] = []
+    used = 0
+    for message in messages:
+        line = item_template.format(message=message)
+        if used + len(line) + 1 > budget:
+            if not lines:
+                # первый пункт длиннее лимита — обрезаем, а не теряем целиком
+                lines.append(line[:max(budget - 2, 0)] + "…")
+            break
+        lines.append(line)
+        used += len(line) + 1
+
+    rest = len(messages) - len(lines)
+    if rest:
+        lines.append(more_template.format(count=rest))
+    return template.format(count=len(messages), items="\n".join(lines))
@@ -0,0 +1,46 @@
+"""
+Классификация отказов доставки.
+
+Отправщик может вместо False поднять одно из исключений ниже, чтобы
+сказать, стоит ли повторять попытку этим каналом:
+- PermanentDeliveryError — повтор ничего не изменит (бот заблокирован,
+  адрес получателя отвергнут сервером);
+- TransientDeliveryError — сбой временный (таймаут, разрыв, 4xx/429),
+  retry_after — сколько секунд просит подождать сам сервис, если известно;
+- ThrottledDeliveryError — канал не вызывался: не дождались собственного
+  лимита отправки. Повторить позже, но сбоем канала (для circuit breaker)
+  это не считается.
+
+Простой False цепочка считает временным отказом.
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+
+class DeliveryError(Exception):
+    """Отказ канала доставки."""
+
+    permanent = False
+    # отказ из-за собственного лимита, а не канала: circuit breaker его не считает
+    throttled = False
+
+    def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TransientDeliveryError(DeliveryError):
+    """Временный отказ: канал можно повторить позже."""
+
+
+class PermanentDeliveryError(DeliveryError):
+    """Постоянный отказ: повторять этот канал для уведомления бессмысленно."""
+
+    permanent = True
+
+
+class ThrottledDeliveryError(TransientDeliveryError):
+    """Не дождались слота своего лимитера: канал не вызывался, повторить позже."""
+
+    throttled = True
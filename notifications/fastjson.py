@@ -0,0 +1,138 @@
+"""
+Быстрая отдача списков без ModelSerializer.
+
+Строки берутся кортежами через values_list и кодируются сразу в байты
+JSON: orjson, если установлен, иначе stdlib json. Результат побайтно
+совпадает с тем, что выдают NotificationSerializer / UserSerializer
+через JSONRenderer DRF (компактные разделители, UTF-8 без \\u-экранирования,
+дата в ISO 8601 с "Z" для UTC, экранированные U+2028/U+2029).
+"""
+from __future__ import annotations
+
+import datetime
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+# Колонки values_list и ключи в ответе — в порядке полей сериализаторов
+NOTIFICATION_COLUMNS: Sequence[str] = (
+    "id",
+    "user_id",
+    "message",
+    "template_id",
+    "params",
+    "delivered",
+    "status",
+    "priority",
+    "delivery_method",
+    "attempts",
+    "created_at",
+    "send_at",
+    "dead_at",
+    "last_error_class",
+    "channel_state",
+)
+NOTIFICATION_KEYS: Sequence[str] = (
+    "id",
+    "user",
+    "message",
+    "template",
+    "params",
+    "delivered",
+    "status",
+    "priority",
+    "delivery_method",
+    "attempts",
+    "created_at",
+    "send_at",
+    "dead_at",
+    "last_error_class",
+    "channel_state",
+)
+USER_COLUMNS: Sequence[str] = ("id", "email", "phone", "telegram_id")
+
+_DATETIME_INDEXES = tuple(
+    NOTIFICATION_COLUMNS.index(name) for name in ("created_at", "send_at", "dead_at")
+)
+
+
+# дробные, которые orjson пишет не так, как json.dumps (см. dumps)
+_ORJSON_FLOAT_MISMATCH = re.compile(rb"[0-9]e-?[0-9]|0\.0000")
+
+
+def _escape_separators(data: bytes) -> bytes:
+    # JSONRenderer экранирует разделители строк, иначе JSON ломает JS-парсеры
+    if b"\xe2\x80\xa8" in data or b"\xe2\x80\xa9" in data:
+        data = data.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+    return data
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(
+        obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    JSON-байты в формате JSONRenderer DRF. orjson не умеет целые шире 64 бит
+    и пишет дробные в экспоненте иначе (1e16 вместо 1e+16, 1e-7 вместо 1e-07,
+    0.00001 вместо 1e-05) — такие данные (params, channel_state) кодирует stdlib json.
+    """
+    if orjson is None:
+        return _escape_separators(_stdlib_dumps(obj))
+    try:
+        data = orjson.dumps(obj)
+    except TypeError:
+        return _escape_separators(_stdlib_dumps(obj))
+    # совпадение бывает и внутри строки — тогда просто кодируем медленным путём
+    if _ORJSON_FLOAT_MISMATCH.search(data):
+        data = _stdlib_dumps(obj)
+    return _escape_separators(data)
+
+
+def _datetime_formatter():
+    """Форматирование как у serializers.DateTimeField: в текущую зону, "Z" для UTC."""
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def fmt(value: Optional[datetime.datetime]) -> Optional[str]:
+        if value is None:
+            return None
+        if tz is not None and timezone.is_aware(value):
+            value = value.astimezone(tz)
+        text = value.isoformat()
+        if text.endswith("+00:00"):
+            text = text[:-6] + "Z"
+        return text
+
+    return fmt
+
+
+def notification_dicts(rows: Iterable[Tuple]) -> List[Dict[str, Any]]:
+    """Кортежи NOTIFICATION_COLUMNS -> словари в форме NotificationSerializer."""
+    fmt = _datetime_formatter()
+    items = []
+    for row in rows:
+        row = list(row)
+        for index in _DATETIME_INDEXES:
+            row[index] = fmt(row[index])
+        items.append(dict(zip(NOTIFICATION_KEYS, row)))
+    return items
+
+
+def user_dicts(rows: Iterable[Tuple]) -> List[Dict[str, Any]]:
+    """Кортежи USER_COLUMNS -> словари в форме UserSerializer."""
+    return [dict(zip(USER_COLUMNS, row)) for row in rows]
+
+
+def json_response(data: bytes, status: int = 200) -> HttpResponse:
+    return HttpResponse(data, status=status, content_type="application/json")
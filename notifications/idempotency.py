@@ -0,0 +1,173 @@
+"""
+Idempotency-Key для создания уведомлений.
+
+Клиент, повторяющий POST после таймаута, присылает тот же ключ и получает
+исходный ответ вместо второго уведомления и второй отправки.
+
+- Redis (REDIS_URL): SET NX ставит маркер "в работе" на IDEMPOTENCY_LOCK_TTL,
+  по завершении на его место кладётся id уведомления на IDEMPOTENCY_TTL.
+  Параллельный повтор, пока первый запрос не закончен, получает конфликт.
+- БД: уникальный индекс по Notification.idempotency_key — страховка на случай
+  недоступного Redis или истёкшего TTL.
+
+Повтор с тем же ключом, но другим телом запроса — ошибка клиента.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from typing import Callable, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from redis.exceptions import RedisError
+
+from .models import Notification
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 128
+
+_PENDING = b"pending"
+
+
+class IdempotencyError(Exception):
+    """Базовая ошибка идемпотентного создания."""
+
+
+class InvalidIdempotencyKey(IdempotencyError):
+    pass
+
+
+class IdempotencyInProgress(IdempotencyError):
+    """Запрос с этим ключом ещё обрабатывается."""
+
+
+class IdempotencyKeyReused(IdempotencyError):
+    """Ключ уже использован с другим телом запроса."""
+
+
+def clean_key(raw: Optional[str]) -> Optional[str]:
+    """Нормализует ключ из заголовка/формы; None — ключа нет."""
+    if raw is None:
+        return None
+    key = raw.strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH or not key.isascii() or not key.isprintable():
+        raise InvalidIdempotencyKey(
+            f"{HEADER}: до {MAX_KEY_LENGTH} печатных ASCII-символов."
+        )
+    return key
+
+
+def _fingerprint(
+    user_id: int, message: str, template_id: Optional[int] = None, params: Optional[dict] = None,
+) -> str:
+    raw = f"{user_id}\x1f{message}"
+    if template_id is not None:
+        # у текстовых уведомлений отпечаток прежний — сохранённые в Redis остаются верны
+        raw += f"\x1f{template_id}\x1f{json.dumps(params or {}, sort_keys=True)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def _redis_key(key: str) -> str:
+    return f"notif:idem:{key}"
+
+
+def _begin(key: str) -> Optional[dict]:
+    """
+    Занимает ключ. None — ключ наш, можно создавать; иначе сохранённый
+    результат {"id", "fp"}. Без Redis всегда None: остаётся страховка в БД.
+    """
+    lock_ttl = int(getattr(settings, "IDEMPOTENCY_LOCK_TTL", 60))
+    try:
+        client = get_redis()
+        if client.set(_redis_key(key), _PENDING, nx=True, ex=lock_ttl):
+            return None
+        stored = client.get(_redis_key(key))
+    except RedisError:
+        logger.warning("Redis недоступен, Idempotency-Key проверяется только в БД")
+        return None
+    if stored is None:
+        # результат истёк между SET и GET — пусть решает уникальный индекс
+        return None
+    if stored == _PENDING:
+        raise IdempotencyInProgress("Запрос с этим Idempotency-Key ещё обрабатывается.")
+    return json.loads(stored)
+
+
+def _complete(key: str, notif_id: int, fp: str) -> None:
+    ttl = int(getattr(settings, "IDEMPOTENCY_TTL", 86400))
+    try:
+        get_redis().set(_redis_key(key), json.dumps({"id": notif_id, "fp": fp}), ex=ttl)
+    except RedisError:
+        logger.warning("Redis недоступен, результат Idempotency-Key не сохранён")
+
+
+def _abort(key: str) -> None:
+    try:
+        get_redis().delete(_redis_key(key))
+    except RedisError:
+        pass
+
+
+def _check_same(stored_fp: str, fp: str) -> None:
+    if stored_fp != fp:
+        raise IdempotencyKeyReused("Idempotency-Key уже использован с другим запросом.")
+
+
+def create_notification(
+    key: Optional[str],
+    user_id: int,
+    message: str,
+    on_created: Optional[Callable[[Notification], None]] = None,
+    **fields,
+) -> Tuple[int, bool]:
+    """
+    Создаёт уведомление не больше одного раза на ключ и вызывает on_created
+    (постановка задачи мимо outbox, если нужна) только для нового. Возвращает (id, создано ли сейчас).
+    Без ключа — обычное создание. fields — прочие поля модели (template_id, params,
+    priority, send_at...); шаблон и параметры входят в отпечаток запроса.
+    """
+    if key is None:
+        notif = Notification.objects.create(user_id=user_id, message=message, **fields)
+        if on_created is not None:
+            on_created(notif)
+        return notif.id, True
+
+    fp = _fingerprint(user_id, message, fields.get("template_id"), fields.get("params"))
+    stored = _begin(key)
+    if stored is not None:
+        _check_same(stored["fp"], fp)
+        return stored["id"], False
+
+    try:
+        try:
+            with transaction.atomic():
+                notif = Notification.objects.create(
+                    user_id=user_id, message=message, idempotency_key=key, **fields,
+                )
+        except IntegrityError:
+            existing = (
+                Notification.objects.filter(idempotency_key=key)
+                .values_list("id", "user_id", "message", "template_id", "params")
+                .first()
+            )
+            if existing is None:
+                raise
+            existing_fp = _fingerprint(*existing[1:])
+            _check_same(existing_fp, fp)
+            _complete(key, existing[0], existing_fp)
+            return existing[0], False
+        if on_created is not None:
+            on_created(notif)
+    except BaseException:
+        _abort(key)
+        raise
+
+    _complete(key, notif.id, fp)
+    return notif.id, True
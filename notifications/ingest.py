@@ -0,0 +1,287 @@
+"""
+Приём уведомлений с высокой частотой: микробатчер для асинхронного
+POST /api/ingest/ под ASGI.
+
+Запрос не пишет в БД сам: его элементы попадают в общий для event loop'а
+буфер, который через INGEST_BATCH_WINDOW_MS (или по набору INGEST_BATCH_MAX
+элементов) уходит одной пачкой:
+- один запрос проверки пользователей;
+- один multi-row INSERT с отметкой outbox;
+- публикация задач пачки через одно соединение с брокером (outbox.publish_now).
+Пока пачка пишется, следующая копится и уходит сразу после неё — под
+нагрузкой пачки растут сами. Каждый запрос получает id своих строк.
+
+Гарантии — как у обычного create: ответ уходит сразу после коммита пачки,
+строка создаётся с dispatch_pending, и если публикация не удалась, задачу
+отправит outbox-релей. Публикация — самая дорогая часть пачки (Celery
+кладёт задачи в брокер по одной); с INGEST_PUBLISH=False её целиком делает
+релей (relay_outbox --loop), а процесс приёма только пишет в БД.
+Idempotency-Key здесь не поддерживается — для него есть POST /api/notifications/.
+
+Буфер живёт в памяти процесса, поэтому выигрыш — под ASGI-сервером, где
+запросы процесса делят один event loop:
+    uvicorn notif.asgi:application --workers 4
+Там notif.asgi отдаёт /api/ingest/ прямо asgi_app, мимо middleware Django:
+в 3.2 каждый синхронный middleware — переход в общий поток и обратно, и
+на частых мелких запросах это основная цена. Аутентификации у API нет,
+сессии и CSRF приёму не нужны. Под runserver тот же разбор идёт через
+views.ingest_view, но каждый запрос пишется своей пачкой.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import weakref
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+
+from . import outbox
+from .bulk import insert_notifications
+from .fastjson import dumps
+from .models import DeliveryStatus, Notification, User, initial_delivery_fields
+from .serializers import (
+    NotificationCreateSerializer,
+    NotificationIngestSerializer,
+    missing_templates,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def batch_window() -> float:
+    return float(getattr(settings, "INGEST_BATCH_WINDOW_MS", 5)) / 1000
+
+
+def batch_max() -> int:
+    return int(getattr(settings, "INGEST_BATCH_MAX", 500))
+
+
+def publish_inline() -> bool:
+    return bool(getattr(settings, "INGEST_PUBLISH", True))
+
+
+def write_batch(items: Sequence[dict]) -> List[dict]:
+    """
+    Пишет пачку элементов (validated_data NotificationCreateSerializer).
+    На каждый элемент — {"status", "id"} или {"field", "error"} для
+    несуществующего пользователя (field="user_id") или шаблона
+    (field="template_id"); остальные элементы пачки это не затрагивает.
+    """
+    # мимо middleware нет сигналов request_started/finished — соединение
+    # потока записи проверяем сами, как это делал бы обработчик запроса
+    close_old_connections()
+    wanted = {item["user_id"] for item in items}
+    existing = set(User.objects.filter(id__in=wanted).values_list("id", flat=True))
+    missing = set(missing_templates(item["template_id"] for item in items))
+
+    results: List[dict] = []
+    objs: List[Notification] = []
+    slots: List[int] = []
+    for item in items:
+        if item["user_id"] not in existing:
+            results.append({
+                "field": "user_id", "error": f"Пользователь с id={item['user_id']} не найден.",
+            })
+            continue
+        if item["template_id"] in missing:
+            results.append({
+                "field": "template_id", "error": f"Шаблон с id={item['template_id']} не найден.",
+            })
+            continue
+        fields = initial_delivery_fields(item["send_at"])
+        objs.append(Notification(
+            user_id=item["user_id"],
+            message=item["message"].strip(),
+            template_id=item["template_id"],
+            params=item["params"],
+            priority=item["priority"],
+            **fields,
+        ))
+        slots.append(len(results))
+        results.append({"status": fields.get("status", DeliveryStatus.QUEUED)})
+
+    if objs:
+        ids = insert_notifications(objs)
+        for slot, notif_id in zip(slots, ids):
+            results[slot]["id"] = notif_id
+    return results
+
+
+def publish_batch(results: Sequence[dict]) -> int:
+    """Публикует задачи записанной пачки; отложенные (scheduled) ждут диспетчера."""
+    return outbox.publish_now([
+        result["id"] for result in results if result.get("status") == DeliveryStatus.QUEUED
+    ])
+
+
+class MicroBatcher:
+    """
+    Копит элементы запросов и отдаёт их write пачками; submit ждёт
+    результаты своих элементов. after вызывается с результатами пачки,
+    когда ожидающие уже получили ответ. Один экземпляр на event loop,
+    пачки пишутся по очереди — параллельных транзакций вставки нет.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[dict]], Awaitable[List[dict]]],
+        window: float,
+        max_size: int,
+        after: Optional[Callable[[List[dict]], Awaitable[object]]] = None,
+    ) -> None:
+        self._write = write
+        self._after = after
+        self.window = window
+        self.max_size = max_size
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def submit(self, items: Sequence[dict]) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in items]
+        self._pending.extend(zip(items, futures))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._run())
+        elif len(self._pending) >= self.max_size:
+            self._full.set()
+        return list(await asyncio.gather(*futures))
+
+    async def drain(self) -> None:
+        """Дождаться записи и публикации всего, что уже в буфере."""
+        if self._flusher is not None:
+            await asyncio.shield(self._flusher)
+
+    async def _run(self) -> None:
+        # первая пачка ждёт окно; следующие набрались, пока писалась предыдущая
+        if len(self._pending) < self.max_size:
+            self._full.clear()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+        while self._pending:
+            batch = self._pending[:self.max_size]
+            del self._pending[:self.max_size]
+            try:
+                results = await self._write([item for item, _ in batch])
+            except Exception as exc:
+                logger.exception("Не удалось записать пачку из %s уведомлений", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+            else:
+                for (_, future), result in zip(batch, results):
+                    # клиент мог отключиться — строка всё равно создана
+                    if not future.done():
+                        future.set_result(result)
+                if self._after is not None:
+                    try:
+                        await self._after(results)
+                    except Exception:
+                        # строки закоммичены с dispatch_pending — их опубликует релей
+                        logger.exception("Не удалось опубликовать пачку из %s уведомлений", len(batch))
+
+
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, MicroBatcher]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_batcher() -> MicroBatcher:
+    """Батчер текущего event loop'а (создаётся при первом запросе)."""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        # thread_sensitive: запись идёт в одном потоке с его соединением с БД
+        batcher = _batchers[loop] = MicroBatcher(
+            sync_to_async(write_batch, thread_sensitive=True),
+            batch_window(),
+            batch_max(),
+            after=sync_to_async(publish_batch, thread_sensitive=True) if publish_inline() else None,
+        )
+    return batcher
+
+
+# по экземпляру на процесс: DRF копирует все поля при создании сериализатора,
+# и на частых мелких запросах это заметнее записи; run_validation состояния не хранит
+_validate_one = NotificationCreateSerializer().run_validation
+_validate_many = NotificationIngestSerializer().run_validation
+
+
+async def handle(body: bytes) -> Tuple[int, bytes]:
+    """
+    Тело — как у POST /api/notifications/ или {"items": [...]}. Ответ 202 с
+    {"status", "id"} или {"results": [...]}, где у элемента с несуществующим
+    пользователем или шаблоном вместо id — "field" и "error"; одиночный такой
+    запрос — 400 с ошибкой под этим полем, как у POST /api/notifications/.
+    Возвращает (HTTP-статус, JSON-байты).
+    """
+    try:
+        data = json.loads(body or b"null")
+    except ValueError:
+        return 400, dumps({"detail": "Некорректный JSON."})
+
+    many = isinstance(data, dict) and "items" in data
+    try:
+        validated = (_validate_many if many else _validate_one)(data)
+    except ValidationError as exc:
+        return 400, dumps(as_serializer_error(exc))
+
+    items = validated["items"] if many else [validated]
+    results = await get_batcher().submit(items)
+    if many:
+        return 202, dumps({"results": results})
+    if "error" in results[0]:
+        return 400, dumps({results[0]["field"]: [results[0]["error"]]})
+    return 202, dumps(results[0])
+
+
+async def _read_body(receive) -> Optional[bytes]:
+    """Тело запроса ASGI; None — клиент отключился или тело больше лимита Django."""
+    limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    chunks: List[bytes] = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _respond(send, status: int, data: bytes, headers: Sequence[Tuple[bytes, bytes]] = ()) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(data)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def asgi_app(scope, receive, send) -> None:
+    """ASGI-приложение POST /api/ingest/ (подключается в notif.asgi)."""
+    if scope["method"] != "POST":
+        await _respond(send, 405, dumps({"detail": "Разрешён только POST."}), [(b"allow", b"POST")])
+        return
+    body = await _read_body(receive)
+    if body is None:
+        await _respond(send, 413, dumps({"detail": "Тело запроса слишком большое."}))
+        return
+    status, data = await handle(body)
+    await _respond(send, status, data)
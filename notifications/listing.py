@@ -0,0 +1,88 @@
+"""
+Постраничная выдача и выгрузка уведомлений.
+
+Страницы — keyset по id (новые сверху): курсор — id последней строки
+предыдущей страницы, запрос WHERE id < cursor ORDER BY id DESC LIMIT n.
+В отличие от OFFSET стоимость страницы не растёт с её номером.
+Выгрузка идёт серверным курсором (.iterator()) и отдаётся JSON Lines
+по строке на уведомление, весь результат в памяти не держится.
+Строки читаются кортежами values_list и кодируются через fastjson.
+"""
+from __future__ import annotations
+
+from typing import Any, Iterator, List, Mapping, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import QuerySet
+
+from .fastjson import NOTIFICATION_COLUMNS, dumps, notification_dicts
+
+
+def page_size_limits() -> Tuple[int, int]:
+    """(размер страницы по умолчанию, максимальный размер)."""
+    default = int(getattr(settings, "NOTIFICATIONS_PAGE_SIZE", 100))
+    maximum = int(getattr(settings, "NOTIFICATIONS_PAGE_MAX", 1000))
+    return default, maximum
+
+
+def filter_notifications(qs: QuerySet, params: Mapping[str, Any]) -> QuerySet:
+    """
+    Применяет фильтры из провалидированных параметров запроса
+    (NotificationListQuerySerializer). Каждый фильтр ложится на индекс:
+    user — notif_user_history_idx, channel/status — notif_channel_status_idx,
+    диапазон created_at — notif_created_idx.
+    """
+    if params.get("user") is not None:
+        qs = qs.filter(user_id=params["user"])
+    if params.get("delivered") is not None:
+        qs = qs.filter(delivered=params["delivered"])
+    if params.get("channel"):
+        qs = qs.filter(delivery_method=params["channel"])
+    if params.get("status"):
+        qs = qs.filter(status=params["status"])
+    if params.get("created_after") is not None:
+        qs = qs.filter(created_at__gte=params["created_after"])
+    if params.get("created_before") is not None:
+        qs = qs.filter(created_at__lt=params["created_before"])
+    return qs
+
+
+def keyset_page(
+    qs: QuerySet,
+    cursor: Optional[int],
+    limit: int,
+) -> Tuple[List[Tuple], Optional[int]]:
+    """
+    Одна страница по убыванию id кортежами NOTIFICATION_COLUMNS.
+    Берём limit + 1 строку: лишняя говорит, что дальше ещё есть данные,
+    без отдельного COUNT. Возвращает (строки, курсор следующей страницы или None).
+    """
+    if cursor is not None:
+        qs = qs.filter(id__lt=cursor)
+    rows = list(qs.order_by("-id").values_list(*NOTIFICATION_COLUMNS)[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1][0]
+    return rows, None
+
+
+def iter_jsonl(qs: QuerySet, chunk_size: Optional[int] = None) -> Iterator[str]:
+    """
+    Строки JSON Lines для StreamingHttpResponse. values_list() без модельных
+    объектов, iterator() — серверный курсор на PostgreSQL (на SQLite —
+    чтение пачками fetchmany).
+    """
+    size = chunk_size or int(getattr(settings, "NOTIFICATIONS_EXPORT_CHUNK", 2000))
+    rows = qs.order_by("-id").values_list(*NOTIFICATION_COLUMNS).iterator(chunk_size=size)
+    batch: List[Tuple] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield _jsonl(batch)
+            batch = []
+    if batch:
+        yield _jsonl(batch)
+
+
+def _jsonl(rows: List[Tuple]) -> bytes:
+    return b"".join(dumps(item) + b"\n" for item in notification_dicts(rows))
@@ -0,0 +1,79 @@
+"""
+Бенчмарк доставки на локальных заменителях SMTP и Bot API, без внешней сети:
+
+    python manage.py bench_delivery --mode task --count 2000
+    python manage.py bench_delivery --mode api --count 1000 --smtp-latency-ms 20 --smtp-error-rate 0.1
+    python manage.py bench_delivery --mode worker --count 5000 --smtp-port 2525 --bot-port 8081
+
+В режиме worker воркеры запускаются отдельно с переменными окружения,
+которые команда печатает перед прогоном (порты лучше зафиксировать).
+Данные стенда (@bench.local) удаляются после прогона, если не указан --keep.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications.bench import harness
+from notifications.bench.servers import Behaviour, BotApiStub, SmtpSink
+
+
+class Command(BaseCommand):
+    help = "Прогоняет доставку через локальные SMTP и Bot API: пропускная способность, p50/p95/p99, SQL."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--mode", choices=harness.MODES, default=harness.TASK)
+        parser.add_argument("--count", type=int, default=1000, help="Сколько уведомлений")
+        parser.add_argument("--users", type=int, default=100, help="Сколько пользователей стенда")
+        parser.add_argument("--seed", type=int, default=1, help="Seed для доли ошибок")
+        parser.add_argument("--timeout", type=float, default=120.0, help="worker: ждать доставки, сек")
+        parser.add_argument("--keep", action="store_true", help="Не удалять данные стенда")
+        for name, default_code in (("smtp", 451), ("bot", 502)):
+            parser.add_argument(f"--{name}-port", type=int, default=0, help="Порт (0 — любой свободный)")
+            parser.add_argument(f"--{name}-latency-ms", type=float, default=0.0)
+            parser.add_argument(f"--{name}-error-rate", type=float, default=0.0)
+            parser.add_argument(
+                f"--{name}-error-code", type=int, default=default_code, help="Код ответа при ошибке",
+            )
+
+    def _behaviour(self, name: str, options: dict) -> Behaviour:
+        rate = options[f"{name}_error_rate"]
+        if not 0 <= rate <= 1:
+            raise CommandError(f"--{name}-error-rate должен быть от 0 до 1")
+        return Behaviour(
+            latency_ms=options[f"{name}_latency_ms"],
+            error_rate=rate,
+            error_code=options[f"{name}_error_code"],
+            seed=options["seed"],
+        )
+
+    def handle(self, *args, **options) -> None:
+        count, users = options["count"], options["users"]
+        if count < 1 or users < 1:
+            raise CommandError("--count и --users должны быть положительными")
+        smtp = SmtpSink(self._behaviour("smtp", options), port=options["smtp_port"]).start()
+        bot = BotApiStub(self._behaviour("bot", options), port=options["bot_port"]).start()
+        self.stdout.write(f"SMTP: 127.0.0.1:{smtp.port}, Bot API: {bot.url}")
+        if options["mode"] == harness.WORKER:
+            env = " ".join(f"{k}={v}" for k, v in harness.worker_env(smtp, bot).items())
+            self.stdout.write(f"Воркеры запускать с: {env}")
+
+        harness.cleanup()
+        try:
+            user_ids = harness.seed_users(users)
+            if options["mode"] == harness.TASK:
+                report = harness.run_task(count, user_ids, smtp, bot)
+            elif options["mode"] == harness.API:
+                report = harness.run_api(count, user_ids, smtp, bot)
+            else:
+                report = harness.run_worker(count, user_ids, smtp, bot, timeout=options["timeout"])
+        finally:
+            if not options["keep"]:
+                harness.cleanup()
+            smtp.stop()
+            bot.stop()
+
+        for line in report.lines():
+            self.stdout.write(line)
+        for label, server in (("SMTP", smtp), ("Bot API", bot)):
+            recorder = server.recorder
+            self.stdout.write(f"{label}: запросов {recorder.requests}, ошибок {recorder.errors}")
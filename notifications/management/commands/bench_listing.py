@@ -0,0 +1,106 @@
+"""
+Бенчмарк сериализации списков: ModelSerializer + JSONRenderer
+против values_list + fastjson.
+
+    python manage.py bench_listing --rows 20000 --repeat 5
+
+Тестовые строки создаются в транзакции и откатываются после замера.
+Перед замером проверяется, что оба пути дают одинаковые байты.
+"""
+from __future__ import annotations
+
+import time
+from typing import Callable, List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from notifications import fastjson
+from notifications.models import Notification, User
+from notifications.serializers import NotificationSerializer, UserSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость отдачи списков уведомлений/пользователей (строк в секунду)."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--rows", type=int, default=10000, help="Сколько уведомлений создать")
+        parser.add_argument("--repeat", type=int, default=3, help="Повторов каждого замера")
+
+    def handle(self, *args, **options) -> None:
+        rows, repeat = options["rows"], options["repeat"]
+        if rows < 1 or repeat < 1:
+            raise CommandError("--rows и --repeat должны быть положительными")
+        try:
+            with transaction.atomic():
+                self._seed(rows)
+                self._run(repeat)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _seed(self, rows: int) -> None:
+        users = User.objects.bulk_create(
+            User(email=f"bench{i}@example.com", telegram_id=str(100000 + i))
+            for i in range(max(1, rows // 10))
+        )
+        user_ids = list(User.objects.order_by("-id").values_list("id", flat=True)[:len(users)])
+        Notification.objects.bulk_create(
+            (
+                Notification(user_id=user_ids[i % len(user_ids)], message=f"Сообщение №{i}")
+                for i in range(rows)
+            ),
+            batch_size=1000,
+        )
+
+    def _run(self, repeat: int) -> None:
+        notifications = Notification.objects.order_by("-id")
+        users = User.objects.order_by("id")
+        renderer = JSONRenderer()
+
+        def drf_notifications() -> bytes:
+            return renderer.render(NotificationSerializer(notifications, many=True).data)
+
+        def fast_notifications() -> bytes:
+            rows = notifications.values_list(*fastjson.NOTIFICATION_COLUMNS)
+            return fastjson.dumps(fastjson.notification_dicts(rows))
+
+        def drf_users() -> bytes:
+            return renderer.render(UserSerializer(users, many=True).data)
+
+        def fast_users() -> bytes:
+            return fastjson.dumps(fastjson.user_dicts(users.values_list(*fastjson.USER_COLUMNS)))
+
+        if drf_notifications() != fast_notifications():
+            raise CommandError("Ответы по уведомлениям не совпадают побайтно")
+        if drf_users() != fast_users():
+            raise CommandError("Ответы по пользователям не совпадают побайтно")
+
+        encoder = "orjson" if fastjson.orjson is not None else "json (stdlib)"
+        self.stdout.write(f"fastjson: {encoder}, повторов: {repeat}")
+        for label, count, before, after in (
+            ("notifications", notifications.count(), drf_notifications, fast_notifications),
+            ("users", users.count(), drf_users, fast_users),
+        ):
+            slow = self._best(before, repeat)
+            fast = self._best(after, repeat)
+            self.stdout.write(
+                f"{label:<14} {count:>8} строк  "
+                f"ModelSerializer: {count / slow:>10.0f} строк/с  "
+                f"fastjson: {count / fast:>10.0f} строк/с  "
+                f"x{slow / fast:.1f}"
+            )
+
+    @staticmethod
+    def _best(fn: Callable[[], bytes], repeat: int) -> float:
+        timings: List[float] = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
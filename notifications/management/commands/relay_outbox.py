@@ -0,0 +1,42 @@
+"""
+Outbox-релей отдельным процессом:
+
+    python manage.py relay_outbox --loop --interval 0.2
+
+Без --loop — один проход (то же, что relay_outbox_task из beat).
+"""
+from __future__ import annotations
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notifications import outbox
+
+
+class Command(BaseCommand):
+    help = "Публикует в брокер уведомления, ожидающие в outbox (dispatch_pending)."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--loop", action="store_true", help="Работать постоянно")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=float(getattr(settings, "OUTBOX_RELAY_INTERVAL", 1.0)),
+            help="Пауза между проходами, когда очередь outbox пуста (сек)",
+        )
+        parser.add_argument("--batch-size", type=int, default=None, help="Строк в пачке")
+
+    def handle(self, *args, **options) -> None:
+        size = options["batch_size"] or outbox.batch_size()
+        if not options["loop"]:
+            self.stdout.write(f"Опубликовано: {outbox.relay(size)}")
+            return
+        try:
+            while True:
+                # пока есть полные пачки — без паузы
+                if outbox.relay(size, max_batches=1) < size:
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
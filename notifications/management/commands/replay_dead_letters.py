@@ -0,0 +1,61 @@
+"""
+Повторная отправка dead letters:
+
+    python manage.py replay_dead_letters --channel telegram --error-class TransientDeliveryError \
+        --since 2024-05-01T10:00 --until 2024-05-01T12:00 --rate 500
+
+С --dry-run только считает подходящие строки.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications import replay
+from notifications.models import Priority
+
+
+class Command(BaseCommand):
+    help = "Возвращает в очередь уведомления из dead letters (по каналу, времени, классу ошибки)."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--channel", help="Только где отказал этот канал (email, telegram...)")
+        parser.add_argument("--error-class", help="Класс ошибки, например TransientDeliveryError")
+        parser.add_argument("--since", help="dead_at не раньше (ISO 8601)")
+        parser.add_argument("--until", help="dead_at раньше (ISO 8601)")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Строк в пачке")
+        parser.add_argument(
+            "--rate", type=float, default=None, help="Не больше уведомлений в секунду (0 — без ограничения)",
+        )
+        parser.add_argument(
+            "--priority",
+            type=int,
+            choices=[choice.value for choice in Priority],
+            default=None,
+            help="Переопределить приоритет (2 — очередью рассылок)",
+        )
+        parser.add_argument(
+            "--reset-permanent", action="store_true", help="Повторить и каналы с постоянным отказом",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать")
+
+    def handle(self, *args, **options) -> None:
+        try:
+            qs = replay.dead_letters(
+                channel=options["channel"],
+                error_class=options["error_class"],
+                dead_after=options["since"],
+                dead_before=options["until"],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options["dry_run"]:
+            self.stdout.write(f"Подходит: {qs.count()}")
+            return
+        total = replay.replay(
+            qs,
+            size=options["chunk_size"],
+            rate=options["rate"],
+            priority=options["priority"],
+            reset_permanent=options["reset_permanent"],
+        )
+        self.stdout.write(f"Возвращено в очередь: {total}")
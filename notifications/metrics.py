@@ -0,0 +1,160 @@
+"""
+Метрики доставки в формате Prometheus (GET /metrics).
+
+- notif_sender_latency_seconds{channel} — время вызова отправщика;
+- notif_sender_outcomes_total{channel, outcome, error_class} — исходы
+  вызовов: delivered / failed / rejected и класс ошибки;
+- notif_queue_lag_seconds{channel} — от created_at (или наступившего
+  send_at) до доставки;
+- notif_claim_seconds — ожидание аренды строки (условный UPDATE)
+  в send_notification_task;
+- notif_task_db_queries{task} — SQL-запросов за одно выполнение задачи
+  Celery (connection.execute_wrapper на время задачи);
+- notif_contact_lookups_total{result} — чтения контактов пользователей
+  (см. contacts): local / redis — попадания, db — промах, missing — нет
+  пользователя.
+
+Воркеры Celery и веб — разные процессы. Чтобы /metrics показывал сумму
+по всем, задайте PROMETHEUS_MULTIPROC_DIR (общий каталог, очищается при
+старте) — тогда каждый процесс пишет значения в свои mmap-файлы, а /metrics
+собирает их MultiProcessCollector'ом. Без переменной — метрики процесса.
+
+На горячем пути — только инкремент в памяти (или в mmap) без блокировок
+сети. Без prometheus_client метрики превращаются в no-op.
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, Optional, Tuple
+
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+from django.db import connection
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # pragma: no cover - prometheus_client необязателен
+    prometheus_client = None
+
+# Секунды: от быстрых HTTP-вызовов Bot API до медленного SMTP с таймаутом
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_LAG_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+_QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 250)
+
+
+class _Noop:
+    """Заглушка метрики, когда prometheus_client не установлен."""
+
+    def labels(self, *args, **kwargs) -> "_Noop":
+        return self
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+
+def _histogram(name: str, documentation: str, labelnames=(), buckets=None):
+    if prometheus_client is None:
+        return _Noop()
+    return prometheus_client.Histogram(
+        name, documentation, labelnames, buckets=buckets or prometheus_client.Histogram.DEFAULT_BUCKETS,
+    )
+
+
+def _counter(name: str, documentation: str, labelnames=()):
+    if prometheus_client is None:
+        return _Noop()
+    return prometheus_client.Counter(name, documentation, labelnames)
+
+
+SENDER_LATENCY = _histogram(
+    "notif_sender_latency_seconds", "Время вызова отправщика", ("channel",), _LATENCY_BUCKETS,
+)
+SENDER_OUTCOMES = _counter(
+    "notif_sender_outcomes", "Исходы вызовов отправщиков", ("channel", "outcome", "error_class"),
+)
+QUEUE_LAG = _histogram(
+    "notif_queue_lag_seconds", "От создания (или send_at) до доставки", ("channel",), _LAG_BUCKETS,
+)
+CLAIM_SECONDS = _histogram(
+    "notif_claim_seconds", "Ожидание аренды строки уведомления", buckets=_LATENCY_BUCKETS,
+)
+TASK_DB_QUERIES = _histogram(
+    "notif_task_db_queries", "SQL-запросов за выполнение задачи", ("task",), _QUERY_BUCKETS,
+)
+CONTACT_LOOKUPS = _counter(
+    "notif_contact_lookups", "Чтения контактов пользователей по источнику", ("result",),
+)
+
+
+def observe_call(channel: str, seconds: float, outcome: str, error: Optional[Exception]) -> None:
+    """Итог одного вызова отправщика (DeliveryChainManager._call)."""
+    SENDER_LATENCY.labels(channel).observe(seconds)
+    error_class = error.__class__.__name__ if error is not None else ""
+    SENDER_OUTCOMES.labels(channel, outcome, error_class).inc()
+
+
+def observe_lag(channel: str, seconds: float) -> None:
+    QUEUE_LAG.labels(channel).observe(max(seconds, 0.0))
+
+
+class QueryCounter:
+    """execute_wrapper: считает запросы, ничего не меняя в их выполнении."""
+
+    __slots__ = ("count",)
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+# task_id -> (контекст execute_wrapper, счётчик); задачи в потоках воркера
+# не пересекаются по task_id, а connection у каждого потока свой
+_task_counters: Dict[str, Tuple[object, QueryCounter]] = {}
+
+
+@task_prerun.connect
+def _start_query_count(task_id=None, **kwargs) -> None:
+    if prometheus_client is None or task_id is None:
+        return
+    counter = QueryCounter()
+    wrapper = connection.execute_wrapper(counter)
+    wrapper.__enter__()
+    _task_counters[task_id] = (wrapper, counter)
+
+
+@task_postrun.connect
+def _finish_query_count(task_id=None, task=None, **kwargs) -> None:
+    entry = _task_counters.pop(task_id, None)
+    if entry is None:
+        return
+    wrapper, counter = entry
+    wrapper.__exit__(None, None, None)
+    TASK_DB_QUERIES.labels(getattr(task, "name", "unknown")).observe(counter.count)
+
+
+@worker_process_shutdown.connect
+def _mark_process_dead(pid=None, **kwargs) -> None:
+    if prometheus_client is not None and _multiprocess_dir():
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def _multiprocess_dir() -> Optional[str]:
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir")
+
+
+def render() -> Tuple[bytes, str]:
+    """Текст для /metrics и его content type."""
+    if prometheus_client is None:
+        return b"# prometheus_client is not installed\n", "text/plain; charset=utf-8"
+    if _multiprocess_dir():
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
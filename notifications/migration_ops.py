@@ -0,0 +1,96 @@
+"""Операции миграций, безопасные для больших таблиц."""
+from django.db.migrations.operations import AddConstraint, AddIndex, RemoveIndex
+
+
+class AddIndexConcurrentlyIfSupported(AddIndex):
+    """
+    CREATE INDEX CONCURRENTLY на PostgreSQL — без блокировки записи в таблицу;
+    на остальных БД (SQLite в dev) — обычный AddIndex.
+    Миграция с такой операцией должна быть atomic = False.
+    """
+
+    atomic = False
+
+    @staticmethod
+    def _concurrently(schema_editor) -> bool:
+        return schema_editor.connection.vendor == "postgresql"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if self._concurrently(schema_editor):
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if self._concurrently(schema_editor):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+
+class RemoveIndexConcurrentlyIfSupported(RemoveIndex):
+    """
+    DROP INDEX CONCURRENTLY на PostgreSQL — без блокировки записи в таблицу;
+    на остальных БД — обычный RemoveIndex. Миграция должна быть atomic = False.
+    """
+
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        index = from_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+        if AddIndexConcurrentlyIfSupported._concurrently(schema_editor):
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        index = to_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+        if AddIndexConcurrentlyIfSupported._concurrently(schema_editor):
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+
+class AddUniqueConstraintConcurrentlyIfSupported(AddConstraint):
+    """
+    Частичный UniqueConstraint (с condition) на PostgreSQL — это уникальный
+    индекс, его тоже можно строить CREATE UNIQUE INDEX CONCURRENTLY.
+    На остальных БД — обычный AddConstraint. Нужна atomic = False.
+    """
+
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor != "postgresql" or self.constraint.condition is None:
+            schema_editor.add_constraint(model, self.constraint)
+            return
+        sql = str(self.constraint.create_sql(model, schema_editor))
+        schema_editor.execute(
+            sql.replace("CREATE UNIQUE INDEX", "CREATE UNIQUE INDEX CONCURRENTLY", 1)
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor != "postgresql" or self.constraint.condition is None:
+            schema_editor.remove_constraint(model, self.constraint)
+            return
+        schema_editor.execute(
+            "DROP INDEX CONCURRENTLY IF EXISTS %s" % schema_editor.quote_name(self.constraint.name)
+        )
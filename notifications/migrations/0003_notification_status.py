@@ -0,0 +1,65 @@
+"""
+Статус доставки и индексы под реальные выборки.
+
+Миграция неатомарная: на таблице в десятки миллионов строк бэкфилл идёт
+пачками по диапазонам id, каждая пачка — отдельная короткая транзакция,
+а индексы на PostgreSQL строятся CREATE INDEX CONCURRENTLY.
+Добавление колонки с константным default на PostgreSQL 11+ не переписывает таблицу.
+"""
+from django.db import migrations, models, transaction
+from django.db.models import Max, Min, Q
+
+from notifications.migration_ops import AddIndexConcurrentlyIfSupported
+
+BACKFILL_BATCH = 10000
+# max_retries задачи (3) + первая попытка: дальше ретраев уже не было
+EXHAUSTED_ATTEMPTS = 4
+
+
+def backfill_status(apps, schema_editor):
+    Notification = apps.get_model("notifications", "Notification")
+    bounds = Notification.objects.aggregate(lo=Min("id"), hi=Max("id"))
+    if bounds["lo"] is None:
+        return
+
+    for start in range(bounds["lo"], bounds["hi"] + 1, BACKFILL_BATCH):
+        batch = Notification.objects.filter(
+            id__gte=start, id__lt=start + BACKFILL_BATCH, status="queued",
+        )
+        with transaction.atomic():
+            batch.filter(delivered=True).update(status="delivered")
+            batch.filter(delivered=False, attempts__gte=EXHAUSTED_ATTEMPTS).update(status="dead")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0002_notification_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='status',
+            field=models.CharField(choices=[('queued', 'В очереди'), ('sending', 'Отправляется'), ('delivered', 'Доставлено'), ('failed', 'Ошибка, будет повтор'), ('dead', 'Не доставлено')], default='queued', max_length=16),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(condition=Q(('status__in', ['queued', 'failed'])), fields=['created_at'], name='notif_pending_created_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(condition=Q(('status', 'sending')), fields=['lease_expires_at'], name='notif_sending_lease_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(fields=['user', '-id'], name='notif_user_history_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(fields=['delivery_method', 'status'], name='notif_channel_status_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+from notifications.migration_ops import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0003_notification_status'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(fields=['created_at'], name='notif_created_idx'),
+        ),
+    ]
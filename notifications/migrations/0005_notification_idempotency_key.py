@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+from notifications.migration_ops import AddUniqueConstraintConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0004_notification_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        AddUniqueConstraintConcurrentlyIfSupported(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key__isnull', False)), fields=('idempotency_key',), name='notif_idempotency_key_uniq'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notification_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Высокий (коды, транзакционные)'), (1, 'Обычный'), (2, 'Массовая рассылка')], default=1),
+        ),
+    ]
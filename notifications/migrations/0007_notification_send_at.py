@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+from notifications.migration_ops import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0006_notification_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='send_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Запланировано'), ('queued', 'В очереди'), ('sending', 'Отправляется'), ('delivered', 'Доставлено'), ('failed', 'Ошибка, будет повтор'), ('dead', 'Не доставлено')], default='queued', max_length=16),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('status', 'scheduled')), fields=['send_at'], name='notif_scheduled_send_at_idx'),
+        ),
+    ]
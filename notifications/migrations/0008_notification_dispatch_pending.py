@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+from notifications.migration_ops import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0007_notification_send_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='dispatch_pending',
+            field=models.BooleanField(default=False),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('dispatch_pending', True)), fields=['id'], name='notif_dispatch_pending_idx'),
+        ),
+    ]
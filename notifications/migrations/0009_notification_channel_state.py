@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0008_notification_dispatch_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='channel_state',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+from notifications.migration_ops import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0009_notification_channel_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='dead_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='last_error_class',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('status', 'dead')), fields=['id', 'dead_at'], name='notif_dead_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+import notifications.models
+from notifications.migration_ops import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0010_notification_dead_letters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.SlugField(max_length=64, unique=True)),
+                ('subject', models.CharField(blank=True, max_length=255, validators=[notifications.models.validate_template_syntax])),
+                ('body', models.TextField(validators=[notifications.models.validate_template_syntax])),
+                ('html_body', models.TextField(blank=True, validators=[notifications.models.validate_template_syntax])),
+                ('telegram_body', models.TextField(blank=True, validators=[notifications.models.validate_template_syntax])),
+                ('telegram_parse_mode', models.CharField(blank=True, choices=[('HTML', 'HTML'), ('MarkdownV2', 'MarkdownV2')], max_length=16)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='message',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='template',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='notifications', to='notifications.notificationtemplate'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='params',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('template__isnull', False)), fields=['template'], name='notif_template_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+"""
+Индекс ожидающих отправки по created_at больше ничем не читается: в брокер
+строки публикует outbox (notif_dispatch_pending_idx), отложенные — диспетчер
+по send_at, а диапазон дат списка покрывает полный notif_created_idx.
+"""
+from django.db import migrations
+
+from notifications.migration_ops import RemoveIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0012_notification_digest_due_at'),
+    ]
+
+    operations = [
+        RemoveIndexConcurrentlyIfSupported(
+            model_name='notification',
+            name='notif_pending_created_idx',
+        ),
+    ]
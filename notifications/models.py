@@ -1,4 +1,12 @@
-from django.db import models
+from datetime import timedelta
+from typing import Iterable, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+from django.core.exceptions import ValidationError
+from django.db import connections, models, transaction
+from django.db.models import F, Q
+from django.db.models.sql import UpdateQuery
+from django.utils import timezone
 
 
 class User(models.Model):
@@ -12,26 +20,360 @@ class User(models.Model):
         return self.email or self.phone or self.telegram_id or f'User#{self.pk}'
 
 
+class DeliveryStatus(models.TextChoices):
+    """Состояние доставки уведомления."""
+    SCHEDULED = "scheduled", "Запланировано"
+    QUEUED = "queued", "В очереди"
+    SENDING = "sending", "Отправляется"
+    DELIVERED = "delivered", "Доставлено"
+    FAILED = "failed", "Ошибка, будет повтор"
+    DEAD = "dead", "Не доставлено"
+
+
+class Priority(models.IntegerChoices):
+    """Приоритет уведомления; определяет очередь Celery (ниже — срочнее)."""
+    HIGH = 0, "Высокий (коды, транзакционные)"
+    NORMAL = 1, "Обычный"
+    BULK = 2, "Массовая рассылка"
+
+
+class TelegramParseMode(models.TextChoices):
+    """parse_mode Bot API для текста шаблона в Telegram."""
+    HTML = "HTML", "HTML"
+    MARKDOWN_V2 = "MarkdownV2", "MarkdownV2"
+
+
+def validate_template_syntax(source: str) -> None:
+    """Проверяет, что текст компилируется как шаблон Django."""
+    from .templating import TemplateSyntaxError, compile_source
+
+    try:
+        compile_source(source)
+    except TemplateSyntaxError as exc:
+        raise ValidationError(f"Ошибка в шаблоне: {exc}") from exc
+
+
+class NotificationTemplate(models.Model):
+    """Шаблон сообщения: уведомление хранит ссылку на него и параметры (см. templating).
+
+    Поля:
+    - name: короткое имя для админки и продюсеров
+    - subject: тема письма
+    - body: текст по умолчанию — для каналов без своего варианта
+    - html_body: HTML-письмо вместо body в email
+    - telegram_body / telegram_parse_mode: текст и разметка для Telegram
+    """
+    name = models.SlugField(max_length=64, unique=True)
+    subject = models.CharField(max_length=255, blank=True, validators=[validate_template_syntax])
+    body = models.TextField(validators=[validate_template_syntax])
+    html_body = models.TextField(blank=True, validators=[validate_template_syntax])
+    telegram_body = models.TextField(blank=True, validators=[validate_template_syntax])
+    telegram_parse_mode = models.CharField(
+        max_length=16,
+        choices=TelegramParseMode.choices,
+        blank=True,
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+# Статусы, из которых уведомление можно взять в работу
+PENDING_STATUSES = (DeliveryStatus.QUEUED, DeliveryStatus.FAILED)
+# last_error_class уведомления, чья аренда истекала, пока не кончились попытки
+LEASE_EXPIRED = "LeaseExpired"
+
+
+def initial_delivery_fields(send_at=None, outbox: bool = True) -> dict:
+    """
+    Поля нового уведомления: с send_at в будущем оно ждёт диспетчера в scheduled,
+    иначе помечается для outbox-релея (dispatch_pending) в том же INSERT.
+    outbox=False — вызывающий ставит задачу сам (например, с разовыми SMTP-кредами)
+    и помечает строку для релея, только если публикация не удалась.
+    """
+    if send_at is not None and send_at > timezone.now():
+        return {"send_at": send_at, "status": DeliveryStatus.SCHEDULED}
+    fields = {"send_at": send_at} if send_at is not None else {}
+    if outbox:
+        fields["dispatch_pending"] = True
+    return fields
+
+
+def _update_returning(connection) -> bool:
+    """Умеет ли бэкенд UPDATE ... RETURNING (в Django 3.2 для этого нет флага features)."""
+    if connection.vendor == "postgresql":
+        return True
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+class NotificationQuerySet(models.QuerySet):
+    """
+    Захват уведомлений в аренду (lease) вместо select_for_update на всё время отправки.
+
+    Захват — атомарный условный UPDATE: строка в queued/failed или в sending
+    с истёкшей арендой. Отправка идёт вне транзакции, итог пишется
+    коротким UPDATE только при совпадении токена аренды.
+    """
+
+    def claimable(self, now=None) -> "NotificationQuerySet":
+        now = now or timezone.now()
+        return self.filter(
+            Q(status__in=PENDING_STATUSES)
+            | Q(status=DeliveryStatus.SENDING, lease_expires_at__lt=now)
+        )
+
+    def _lease_fields(self, token: str, now, lease_sec: float) -> dict:
+        return {
+            "status": DeliveryStatus.SENDING,
+            "lease_token": token,
+            "lease_expires_at": now + timedelta(seconds=lease_sec),
+            "attempts": F("attempts") + 1,
+            # строка сводки, взятая задачей, больше не ждёт сброса окна
+            "digest_due_at": None,
+        }
+
+    def claim_fetch(
+        self, pk: int, lease_sec: float, fields: Sequence[str],
+    ) -> Tuple[Optional[str], Optional[dict]]:
+        """
+        Берёт одно уведомление в аренду и сразу возвращает поля захваченной
+        строки: (токен, {поле: значение}) или (None, None), если занято или
+        доставлено. Где есть UPDATE ... RETURNING (PostgreSQL, SQLite >= 3.35),
+        строка приходит тем же запросом, иначе — отдельным SELECT.
+        """
+        now = timezone.now()
+        token = uuid4().hex
+        qs = self.claimable(now).filter(pk=pk)
+        connection = connections[self.db]
+        if not _update_returning(connection):
+            if not qs.update(**self._lease_fields(token, now, lease_sec)):
+                return None, None
+            return token, self.model.objects.filter(pk=pk).values(*fields).get()
+
+        query = qs.query.chain(UpdateQuery)
+        query.add_update_values(self._lease_fields(token, now, lease_sec))
+        sql, params = query.get_compiler(self.db).as_sql()
+        model_fields = [self.model._meta.get_field(name) for name in fields]
+        returning = ", ".join(connection.ops.quote_name(f.column) for f in model_fields)
+        with connection.cursor() as cursor:
+            cursor.execute(f"{sql} RETURNING {returning}", params)
+            row = cursor.fetchone()
+        if row is None:
+            return None, None
+        values = {}
+        for name, field, value in zip(fields, model_fields, row):
+            # те же преобразования, что у обычного SELECT (даты SQLite, JSON и т.п.)
+            col = field.get_col(self.model._meta.db_table)
+            for converter in connection.ops.get_db_converters(col) + field.get_db_converters(connection):
+                value = converter(value, col, connection)
+            values[name] = value
+        return token, values
+
+    def claim_many(self, ids: Iterable[int], lease_sec: float) -> Tuple[str, List[int]]:
+        """Берёт в аренду свободные из переданных id; возвращает токен и захваченные id."""
+        now = timezone.now()
+        token = uuid4().hex
+        self.claimable(now).filter(pk__in=list(ids)).update(
+            **self._lease_fields(token, now, lease_sec)
+        )
+        claimed = list(
+            self.model.objects.filter(lease_token=token).order_by("id").values_list("id", flat=True)
+        )
+        return token, claimed
+
+    def take_due(self, limit: int, now=None) -> int:
+        """
+        Переводит до limit запланированных уведомлений с наступившим send_at
+        в queued и отдаёт их outbox-релею. SKIP LOCKED — несколько
+        диспетчеров не мешают друг другу. Возвращает число строк.
+        """
+        now = now or timezone.now()
+        with transaction.atomic():
+            ids = list(
+                self.filter(status=DeliveryStatus.SCHEDULED, send_at__lte=now)
+                .select_for_update(skip_locked=True)
+                .order_by("send_at")
+                .values_list("id", flat=True)[:limit]
+            )
+            if ids:
+                self.model.objects.filter(pk__in=ids).update(
+                    status=DeliveryStatus.QUEUED,
+                    dispatch_pending=True,
+                )
+        return len(ids)
+
+    def requeue_expired(self, limit: int, max_attempts: int, now=None) -> Tuple[List[int], int]:
+        """
+        Возвращает в queued до limit строк с истёкшей арендой (воркер умер
+        посреди отправки) и отдаёт их outbox-релею. Доставку делает обычная
+        send_notification_task: со сроками каналов из channel_state и своей
+        арендой на каждое уведомление. Строки, взятые в аренду max_attempts
+        раз и больше, — скорее всего, сами роняют воркер: они уходят в dead.
+        Возвращает (id возвращённых в очередь, сколько ушло в dead).
+        """
+        now = now or timezone.now()
+        with transaction.atomic():
+            rows = list(
+                self.filter(status=DeliveryStatus.SENDING, lease_expires_at__lt=now)
+                .select_for_update(skip_locked=True)
+                .order_by("id")
+                .values_list("id", "attempts")[:limit]
+            )
+            ids = [pk for pk, attempts in rows if attempts < max_attempts]
+            dead = [pk for pk, attempts in rows if attempts >= max_attempts]
+            released = {"lease_token": None, "lease_expires_at": None}
+            if ids:
+                self.model.objects.filter(pk__in=ids).update(
+                    status=DeliveryStatus.QUEUED, dispatch_pending=True, **released,
+                )
+            if dead:
+                self.model.objects.filter(pk__in=dead).update(
+                    status=DeliveryStatus.DEAD,
+                    dead_at=now,
+                    last_error_class=LEASE_EXPIRED,
+                    **released,
+                )
+        return ids, len(dead)
+
+    def release(self, token: str, status: str, **fields) -> int:
+        """
+        Снимает аренду и выставляет итоговый статус строкам выборки,
+        всё ещё принадлежащим token. Флаг delivered держим в согласии со статусом,
+        для dead отмечаем время попадания в dead letters.
+        """
+        if status == DeliveryStatus.DEAD:
+            fields.setdefault("dead_at", timezone.now())
+        return self.filter(lease_token=token).update(
+            status=status,
+            delivered=status == DeliveryStatus.DELIVERED,
+            lease_token=None,
+            lease_expires_at=None,
+            **fields,
+        )
+
+
 class Notification(models.Model):
     """Факт доставки сообщения.
 
     Поля:
     - user: получатель
-    - message: текст уведомления
-    - delivered: доставлено ли
+    - message: текст уведомления; у уведомления из шаблона пустой
+    - template / params: шаблон и его параметры — текст собирается при
+      доставке, для каждого канала свой (см. templating)
+    - delivered: доставлено ли (дублирует status == delivered для совместимости)
+    - status: состояние доставки (scheduled|queued|sending|delivered|failed|dead)
     - delivery_method: способ доставки (email|sms|tg)
     - attempts: количество попыток
+    - lease_token / lease_expires_at: аренда воркером на время отправки
+    - idempotency_key: Idempotency-Key запроса, создавшего уведомление
+    - priority: приоритет (high|normal|bulk) — очередь, в которую ставится отправка
+    - send_at: время отложенной отправки; до него статус scheduled
+    - dispatch_pending: задача ещё не опубликована в брокер (outbox)
+    - channel_state: попытки по каналам — счётчик, время ретрая, постоянный
+      ли отказ и последняя ошибка (см. retry)
+    - dead_at / last_error_class: когда и с каким классом ошибки
+      уведомление ушло в dead letters (см. replay)
+    - digest_due_at: уведомление ждёт сводки пользователя — к этому времени
+      её отправит сброс окна, опоздавшие подбирает диспетчер (см. digest)
     """
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='notifications'
     )
-    message = models.TextField()
+    message = models.TextField(blank=True)
+    template = models.ForeignKey(
+        NotificationTemplate,
+        on_delete=models.PROTECT,
+        related_name='notifications',
+        blank=True,
+        null=True,
+        # индекс — частичный, только по строкам с шаблоном (см. Meta)
+        db_index=False,
+    )
+    params = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     delivered = models.BooleanField(default=False)
     delivery_method = models.CharField(max_length=20, blank=True, null=True)
     attempts = models.PositiveIntegerField(default=0)
+    status = models.CharField(
+        max_length=16,
+        choices=DeliveryStatus.choices,
+        default=DeliveryStatus.QUEUED,
+    )
+    lease_token = models.CharField(max_length=32, blank=True, null=True)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    idempotency_key = models.CharField(max_length=128, blank=True, null=True)
+    priority = models.PositiveSmallIntegerField(
+        choices=Priority.choices,
+        default=Priority.NORMAL,
+    )
+    send_at = models.DateTimeField(blank=True, null=True)
+    dispatch_pending = models.BooleanField(default=False)
+    channel_state = models.JSONField(default=dict, blank=True)
+    dead_at = models.DateTimeField(blank=True, null=True)
+    last_error_class = models.CharField(max_length=64, blank=True, null=True)
+    digest_due_at = models.DateTimeField(blank=True, null=True)
+
+    objects = NotificationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # подбор строк с истёкшей арендой
+            models.Index(
+                fields=["lease_expires_at"],
+                name="notif_sending_lease_idx",
+                condition=Q(status="sending"),
+            ),
+            # диспетчер отложенных: наступившие send_at
+            models.Index(
+                fields=["send_at"],
+                name="notif_scheduled_send_at_idx",
+                condition=Q(status="scheduled"),
+            ),
+            # outbox: ещё не опубликованные в брокер
+            models.Index(
+                fields=["id"],
+                name="notif_dispatch_pending_idx",
+                condition=Q(dispatch_pending=True),
+            ),
+            # dead letters: повторная отправка идёт keyset'ом по id,
+            # фильтр по dead_at проверяется по тому же индексу
+            models.Index(
+                fields=["id", "dead_at"],
+                name="notif_dead_idx",
+                condition=Q(status="dead"),
+            ),
+            # сводки: строки, ждущие сброса окна, по сроку
+            models.Index(
+                fields=["digest_due_at"],
+                name="notif_digest_due_idx",
+                condition=Q(digest_due_at__isnull=False),
+            ),
+            # история пользователя, новые сверху
+            models.Index(fields=["user", "-id"], name="notif_user_history_idx"),
+            # фильтр списка по диапазону дат
+            models.Index(fields=["created_at"], name="notif_created_idx"),
+            # уведомления шаблона: PROTECT при удалении, выборки по рассылке
+            models.Index(
+                fields=["template"],
+                name="notif_template_idx",
+                condition=Q(template__isnull=False),
+            ),
+            # статистика по каналам
+            models.Index(fields=["delivery_method", "status"], name="notif_channel_status_idx"),
+        ]
+        constraints = [
+            # страховка идемпотентности; строки без ключа в индекс не попадают
+            models.UniqueConstraint(
+                fields=["idempotency_key"],
+                name="notif_idempotency_key_uniq",
+                condition=Q(idempotency_key__isnull=False),
+            ),
+        ]
 
 
 
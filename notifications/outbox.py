@@ -0,0 +1,130 @@
+"""
+Transactional outbox для постановки send_notification_task.
+
+Запрос не ходит в брокер: уведомление создаётся сразу с dispatch_pending=True
+(тот же INSERT), и задача существует ровно тогда, когда закоммичена строка.
+Релей забирает помеченные строки пачками (SKIP LOCKED — релеев может быть
+несколько), публикует их через одно соединение с брокером и снимает флаг
+в той же транзакции. Если брокер недоступен, транзакция откатывается и
+флаги остаются — следующий проход опубликует их снова.
+
+Массовые уведомления (Priority.BULK) публикуются одной send_bulk_task на
+пачку: она раскладывает их по пакетным задачам каналов (BULK_BATCH_DELIVERY).
+
+Гарантия — at-least-once: при сбое посреди пачки часть задач может уйти
+дважды. Это безопасно: send_notification_task берёт строку в аренду
+условным UPDATE, и второй экземпляр задачи просто пропускает её.
+
+Создавший строки код публикует их сам сразу после коммита (publish_on_commit),
+релей — страховка для того, что не ушло: брокер был недоступен, процесс
+упал между коммитом и публикацией. Релей запускается beat'ом
+(relay_outbox_task, очередь срочных) или отдельным процессом:
+    python manage.py relay_outbox --loop
+"""
+from __future__ import annotations
+
+import logging
+from typing import Optional, Sequence
+
+from django.conf import settings
+from django.db import transaction
+from kombu.exceptions import OperationalError
+
+from notif.celery import app
+
+from .models import Notification, Priority
+from .tasks import queue_for, send_bulk_task, send_notification_task
+
+logger = logging.getLogger(__name__)
+
+
+def batch_size() -> int:
+    return int(getattr(settings, "OUTBOX_RELAY_BATCH", 500))
+
+
+def bulk_batches() -> bool:
+    return bool(getattr(settings, "BULK_BATCH_DELIVERY", True))
+
+
+def _relay_batch(size: int, producer, ids: Optional[Sequence[int]] = None) -> int:
+    qs = Notification.objects.filter(dispatch_pending=True)
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    with transaction.atomic():
+        rows = list(
+            qs.select_for_update(skip_locked=True)
+            .order_by("id")
+            .values_list("id", "priority")[:size]
+        )
+        if not rows:
+            return 0
+        batch_bulk = bulk_batches()
+        bulk = []
+        for notif_id, priority in rows:
+            if batch_bulk and priority == Priority.BULK:
+                bulk.append(notif_id)
+                continue
+            # без внутренних ретраев kombu: повторит следующий проход релея
+            send_notification_task.apply_async(
+                (notif_id,), queue=queue_for(priority), producer=producer, retry=False,
+            )
+        if bulk:
+            # рассылка — одной задачей на пачку, дальше пакетами по каналу
+            send_bulk_task.apply_async((bulk,), producer=producer, retry=False)
+        Notification.objects.filter(pk__in=[pk for pk, _ in rows]).update(
+            dispatch_pending=False,
+        )
+    return len(rows)
+
+
+def relay(size: Optional[int] = None, max_batches: int = 100) -> int:
+    """
+    Один проход релея: до max_batches пачек по size строк.
+    Возвращает число опубликованных задач; при недоступном брокере — то,
+    что успело уйти до сбоя.
+    """
+    size = size or batch_size()
+    total = 0
+    try:
+        with app.producer_or_acquire() as producer:
+            for _ in range(max_batches):
+                published = _relay_batch(size, producer)
+                total += published
+                if published < size:
+                    break
+    except OperationalError:
+        logger.warning("Брокер недоступен, outbox-релей повторит позже", exc_info=True)
+    if total:
+        logger.info("Outbox relay published %s notifications", total)
+    return total
+
+
+def publish_now(ids: Sequence[int]) -> int:
+    """
+    Публикует только что закоммиченные строки сразу, не дожидаясь релея:
+    пачками по batch_size через одно соединение с брокером. Строки, которые
+    уже забрал релей, пропускаются (SKIP LOCKED); при недоступном брокере
+    флаги остаются, и строки опубликует релей. Возвращает число задач.
+    """
+    if not ids:
+        return 0
+    size = batch_size()
+    total = 0
+    try:
+        with app.producer_or_acquire() as producer:
+            for start in range(0, len(ids), size):
+                chunk = ids[start:start + size]
+                total += _relay_batch(len(chunk), producer, chunk)
+    except OperationalError:
+        logger.warning("Брокер недоступен, уведомления опубликует outbox-релей", exc_info=True)
+    return total
+
+
+def publish_on_commit(ids: Sequence[int]) -> None:
+    """
+    Публикует строки после коммита текущей транзакции (вне транзакции —
+    сразу). Уже опубликованные и отложенные (без dispatch_pending) пропускаются.
+    """
+    ids = list(ids)
+    if ids:
+        transaction.on_commit(lambda: publish_now(ids))
@@ -0,0 +1,254 @@
+"""
+Token-bucket лимитер отправки в Telegram.
+
+Два ведра: общее на бота (сообщений в секунду) и по чату этого бота —
+лимиты Bot API считаются для каждого бота отдельно, поэтому вёдра и пауза
+ключуются отпечатком токена. Состояние лежит в Redis, поэтому лимит общий
+для всех воркеров. Ответ 429 с retry_after ставит паузу боту — её соблюдают
+все воркеры до истечения срока, остальные боты шлют дальше.
+Если Redis недоступен, лимитер работает по in-process вёдрам.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS: global, chat, pause
+# ARGV: now, global_rate, global_burst, chat_rate, chat_burst, ttl_ms
+# Возвращает 0, если слот выдан, иначе сколько секунд подождать (строкой:
+# Lua-числа при возврате из скрипта усекаются до целых).
+_RESERVE_LUA = """
+local now = tonumber(ARGV[1])
+local pause_until = tonumber(redis.call('GET', KEYS[3]) or '0')
+if pause_until > now then
+  return tostring(pause_until - now)
+end
+
+local function refill(key, rate, burst)
+  local data = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(data[1]) or burst
+  local ts = tonumber(data[2]) or now
+  return math.min(burst, tokens + math.max(0, now - ts) * rate)
+end
+
+local g_rate, g_burst = tonumber(ARGV[2]), tonumber(ARGV[3])
+local c_rate, c_burst = tonumber(ARGV[4]), tonumber(ARGV[5])
+local g = refill(KEYS[1], g_rate, g_burst)
+local c = refill(KEYS[2], c_rate, c_burst)
+
+local wait = 0
+if g < 1 then wait = math.max(wait, (1 - g) / g_rate) end
+if c < 1 then wait = math.max(wait, (1 - c) / c_rate) end
+if wait > 0 then
+  return tostring(wait)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', g - 1, 'ts', now)
+redis.call('HSET', KEYS[2], 'tokens', c - 1, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], ARGV[6])
+redis.call('PEXPIRE', KEYS[2], ARGV[6])
+return '0'
+"""
+
+# KEYS: pause; ARGV: until, ttl_ms. Паузу только продлеваем, не сокращаем.
+_PAUSE_LUA = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+  redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+end
+return 1
+"""
+
+
+class _LocalBuckets:
+    """Те же вёдра в памяти процесса — fallback при недоступном Redis."""
+
+    def __init__(self) -> None:
+        self._buckets: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self._pause_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _refill(self, key: Tuple[str, str], now: float, rate: float, burst: float) -> float:
+        tokens, ts = self._buckets.get(key, (burst, now))
+        return min(burst, tokens + max(0.0, now - ts) * rate)
+
+    def reserve(
+        self,
+        bot: str,
+        chat_key: str,
+        now: float,
+        g_rate: float,
+        g_burst: float,
+        c_rate: float,
+        c_burst: float,
+    ) -> float:
+        with self._lock:
+            pause_until = self._pause_until.get(bot, 0.0)
+            if pause_until > now:
+                return pause_until - now
+            g_key, c_key = (bot, ""), (bot, chat_key)
+            g = self._refill(g_key, now, g_rate, g_burst)
+            c = self._refill(c_key, now, c_rate, c_burst)
+            wait = 0.0
+            if g < 1:
+                wait = max(wait, (1 - g) / g_rate)
+            if c < 1:
+                wait = max(wait, (1 - c) / c_rate)
+            if wait > 0:
+                return wait
+            self._buckets[g_key] = (g - 1, now)
+            self._buckets[c_key] = (c - 1, now)
+            if len(self._buckets) > 10000:
+                # вёдра, простоявшие дольше burst/rate, снова полные
+                idle = max(c_burst / c_rate, g_burst / g_rate)
+                self._buckets = {
+                    k: v for k, v in self._buckets.items() if now - v[1] < idle
+                }
+                self._pause_until = {
+                    k: until for k, until in self._pause_until.items() if until > now
+                }
+            return 0.0
+
+    def pause(self, bot: str, until: float) -> None:
+        with self._lock:
+            self._pause_until[bot] = max(self._pause_until.get(bot, 0.0), until)
+
+
+class TelegramRateLimiter:
+    """
+    Лимитер Bot API: на бота и по чату бота. bot — отпечаток токена
+    (registry.credential_fingerprint), сам токен в ключи Redis не попадает.
+
+    reserve() не блокирует — возвращает, сколько ждать; acquire()/aacquire()
+    ждут слота сами, но не дольше max_wait_sec.
+    """
+
+    def __init__(
+        self,
+        *,
+        global_rate: float,
+        global_burst: float,
+        chat_rate: float,
+        chat_burst: float,
+        max_wait_sec: float,
+        prefix: str = "tg:rl",
+        use_redis: bool = True,
+    ) -> None:
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_wait_sec = max_wait_sec
+        self._prefix = prefix
+        self._use_redis = use_redis
+        self._local = _LocalBuckets()
+        self._redis_retry_at = 0.0
+        # ведро живёт, пока не наполнится заново
+        self._ttl_ms = int(
+            1000 * max(global_burst / global_rate, chat_burst / chat_rate) + 1000
+        )
+
+    def _redis_available(self) -> bool:
+        return self._use_redis and time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self) -> None:
+        # Не долбим недоступный Redis на каждом сообщении: 30 с живём локально
+        self._redis_retry_at = time.monotonic() + 30
+        logger.warning("Redis недоступен, лимит Telegram считается в процессе")
+
+    def _key(self, bot: str, name: str) -> str:
+        return f"{self._prefix}:{bot}:{name}"
+
+    def reserve(self, chat_id: str, bot: str = "") -> float:
+        """0 — слот выдан; иначе сколько секунд подождать до следующей попытки."""
+        now = time.time()
+        if self._redis_available():
+            try:
+                wait = get_redis().eval(
+                    _RESERVE_LUA,
+                    3,
+                    self._key(bot, "global"),
+                    self._key(bot, f"chat:{chat_id}"),
+                    self._key(bot, "pause"),
+                    now,
+                    self.global_rate,
+                    self.global_burst,
+                    self.chat_rate,
+                    self.chat_burst,
+                    self._ttl_ms,
+                )
+                return float(wait)
+            except RedisError:
+                self._redis_failed()
+        return self._local.reserve(
+            bot,
+            str(chat_id),
+            now,
+            self.global_rate,
+            self.global_burst,
+            self.chat_rate,
+            self.chat_burst,
+        )
+
+    def pause(self, seconds: float, bot: str = "") -> None:
+        """Пауза бота для всех воркеров (ответ 429 с retry_after)."""
+        until = time.time() + seconds
+        self._local.pause(bot, until)
+        if self._redis_available():
+            try:
+                get_redis().eval(
+                    _PAUSE_LUA, 1, self._key(bot, "pause"), until, int(seconds * 1000) + 1000,
+                )
+            except RedisError:
+                self._redis_failed()
+
+    def acquire(self, chat_id: str, bot: str = "") -> bool:
+        deadline = time.monotonic() + self.max_wait_sec
+        while True:
+            wait = self.reserve(chat_id, bot)
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def aacquire(self, chat_id: str, bot: str = "") -> bool:
+        # reserve ходит в Redis синхронным клиентом — в пуле потоков, не блокируя loop
+        deadline = time.monotonic() + self.max_wait_sec
+        while True:
+            wait = await asyncio.to_thread(self.reserve, chat_id, bot)
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+_limiter: Optional[TelegramRateLimiter] = None
+
+
+def get_telegram_rate_limiter() -> Optional[TelegramRateLimiter]:
+    """Лимитер процесса по настройкам TELEGRAM_RATE_*; None, если выключен."""
+    global _limiter
+    if not getattr(settings, "TELEGRAM_RATE_LIMIT_ENABLED", True):
+        return None
+    if _limiter is None:
+        _limiter = TelegramRateLimiter(
+            global_rate=float(getattr(settings, "TELEGRAM_RATE_GLOBAL", 30)),
+            global_burst=float(getattr(settings, "TELEGRAM_RATE_GLOBAL_BURST", 30)),
+            chat_rate=float(getattr(settings, "TELEGRAM_RATE_PER_CHAT", 1)),
+            chat_burst=float(getattr(settings, "TELEGRAM_RATE_PER_CHAT_BURST", 3)),
+            max_wait_sec=float(getattr(settings, "TELEGRAM_RATE_MAX_WAIT", 30)),
+        )
+    return _limiter
@@ -0,0 +1,29 @@
+"""Общий клиент Redis на REDIS_URL (тот же, что у Celery и cacheops)."""
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+import redis
+from django.conf import settings
+
+_client: Optional[redis.Redis] = None
+_lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis:
+    """
+    Ленивый клиент процесса. Таймауты короткие: Redis здесь вспомогательный,
+    и вызывающий код должен иметь возможность быстро уйти в fallback.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                timeout = float(getattr(settings, "REDIS_SOCKET_TIMEOUT", 0.5))
+                _client = redis.Redis.from_url(
+                    settings.REDIS_URL,
+                    socket_timeout=timeout,
+                    socket_connect_timeout=timeout,
+                )
+    return _client
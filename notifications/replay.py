@@ -0,0 +1,160 @@
+"""
+Dead letters: уведомления в статусе dead и их повторная отправка.
+
+Уведомление попадает в dead, когда у него не осталось каналов для ретрая
+(см. retry); dead_at и last_error_class отмечаются тогда же, причины по
+каналам — в channel_state.
+
+Повтор идёт keyset'ом по id пачками (частичный индекс notif_dead_idx):
+каждая пачка в своей транзакции возвращается в queued с отметкой outbox,
+задачи публикуются после коммита пачки. Счётчики временных отказов обнуляются, постоянные
+отказы (заблокированный бот, отвергнутый адрес) по умолчанию остаются
+закрытыми. Скорость ограничивается rate уведомлений в секунду — после
+аварии сотни тысяч писем не уходят в каналы одной волной.
+
+    python manage.py replay_dead_letters --channel email --since 2024-05-01T10:00 --rate 500
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+import time
+from typing import Optional, Tuple, Union
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import outbox, retry
+from .models import DeliveryStatus, Notification
+
+logger = logging.getLogger(__name__)
+
+DateLike = Union[datetime.datetime, str, None]
+
+
+def chunk_size() -> int:
+    return int(getattr(settings, "DEAD_LETTER_REPLAY_CHUNK", 1000))
+
+
+def default_rate() -> float:
+    return float(getattr(settings, "DEAD_LETTER_REPLAY_RATE", 1000))
+
+
+def _as_datetime(value: DateLike) -> Optional[datetime.datetime]:
+    # из задачи Celery даты приходят строками ISO 8601
+    if isinstance(value, str):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Некорректная дата: {value}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    return value
+
+
+def dead_letters(
+    channel: Optional[str] = None,
+    error_class: Optional[str] = None,
+    dead_after: DateLike = None,
+    dead_before: DateLike = None,
+) -> QuerySet:
+    """
+    Dead letters по фильтрам. С channel — только те, где этот канал отказал,
+    и error_class сверяется с его ошибкой; без channel — с last_error_class.
+    """
+    qs = Notification.objects.filter(status=DeliveryStatus.DEAD)
+    if channel:
+        # пропущенный без контакта канал попыток не имеет — он не "отказал"
+        qs = qs.filter(**{f"channel_state__{channel}__has_key": "attempts"})
+        if error_class:
+            qs = qs.filter(**{f"channel_state__{channel}__error_class": error_class})
+    elif error_class:
+        qs = qs.filter(last_error_class=error_class)
+    dead_after, dead_before = _as_datetime(dead_after), _as_datetime(dead_before)
+    if dead_after is not None:
+        qs = qs.filter(dead_at__gte=dead_after)
+    if dead_before is not None:
+        qs = qs.filter(dead_at__lt=dead_before)
+    return qs
+
+
+def replay_chunk(
+    qs: QuerySet,
+    after_id: int = 0,
+    size: Optional[int] = None,
+    priority: Optional[int] = None,
+    reset_permanent: bool = False,
+) -> Tuple[int, int]:
+    """
+    Одна пачка после after_id: (сколько возвращено в очередь, id последней
+    строки). Фоновый повтор — задача на пачку, следующая ставится с паузой
+    под rate (replay_dead_letters_task), поэтому проход любой длины не
+    упирается в лимит времени задачи.
+    """
+    size = size or chunk_size()
+    with transaction.atomic():
+        rows = list(
+            qs.filter(id__gt=after_id)
+            .select_for_update(skip_locked=True)
+            .order_by("id")
+            .values_list("id", "channel_state")[:size]
+        )
+        if not rows:
+            return 0, after_id
+        ids = [pk for pk, _ in rows]
+        fields = {
+            "status": DeliveryStatus.QUEUED,
+            "dispatch_pending": True,
+            "dead_at": None,
+            "last_error_class": None,
+            "channel_state": {},
+        }
+        if priority is not None:
+            fields["priority"] = priority
+        Notification.objects.filter(pk__in=ids).update(**fields)
+        # обычно после аварии все отказы временные и состояние просто обнуляется;
+        # строки с постоянными отказами сохраняют их отдельным bulk_update
+        kept = [
+            Notification(pk=pk, channel_state=retry.reopen(state or {}, reset_permanent))
+            for pk, state in rows
+        ]
+        kept = [notif for notif in kept if notif.channel_state]
+        if kept:
+            Notification.objects.bulk_update(kept, ["channel_state"])
+        outbox.publish_on_commit(ids)
+    return len(rows), ids[-1]
+
+
+def replay(
+    qs: QuerySet,
+    size: Optional[int] = None,
+    rate: Optional[float] = None,
+    priority: Optional[int] = None,
+    reset_permanent: bool = False,
+) -> int:
+    """
+    Возвращает dead letters выборки в очередь пачками по size, не быстрее
+    rate уведомлений в секунду (0 — без ограничения), в текущем процессе —
+    для команды replay_dead_letters. priority переопределяет
+    приоритет, например чтобы повтор шёл очередью рассылок. Возвращает число строк.
+    """
+    size = size or chunk_size()
+    rate = default_rate() if rate is None else rate
+    started = time.monotonic()
+    total = 0
+    last_id = 0
+    while True:
+        replayed, last_id = replay_chunk(qs, last_id, size, priority, reset_permanent)
+        if not replayed:
+            break
+        total += replayed
+        logger.info("Dead letters: %s replayed, last id %s", total, last_id)
+        if rate:
+            # пачка уже ушла — ждём, пока средняя скорость не опустится до rate
+            delay = started + total / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    return total
@@ -0,0 +1,134 @@
+"""
+Ретраи доставки по каналам.
+
+Вместо повтора всей цепочки у каждого канала уведомления своё состояние
+в Notification.channel_state:
+    {"email": {"attempts": 2, "retry_at": 1700000000.0, "permanent": false,
+               "error_class": "TransientDeliveryError",
+               "error": "TransientDeliveryError: ..."}}
+
+- постоянный отказ (REJECTED) и отсутствие контакта закрывают канал
+  для уведомления навсегда;
+- временный отказ (FAILED, CIRCUIT_OPEN) назначает каналу retry_at по
+  экспоненциальному backoff с jitter, но не раньше retry_after сервиса;
+- после DELIVERY_CHANNEL_MAX_ATTEMPTS попыток канал тоже закрыт.
+
+Повтор задачи планируется на ближайший retry_at, и в нём вызываются только
+каналы, чей срок наступил. Когда повторять нечего — уведомление DEAD.
+"""
+from __future__ import annotations
+
+import random
+from typing import Dict, Optional, Set
+
+from django.conf import settings
+
+from .services import CIRCUIT_OPEN, FAILED, REJECTED, SKIPPED, DeliveryResult
+
+ChannelState = Dict[str, dict]
+
+_ERROR_MAX_CHARS = 200
+
+
+def max_attempts() -> int:
+    return int(getattr(settings, "DELIVERY_CHANNEL_MAX_ATTEMPTS", 4))
+
+
+def backoff(attempts: int, retry_after: Optional[float] = None) -> float:
+    """
+    Пауза перед следующей попыткой канала: base * 2^(attempts-1) до потолка,
+    из неё случайная вторая половина (equal jitter) — ретраи пачки уведомлений,
+    упавших вместе, не приходят в канал одной волной.
+    """
+    base = float(getattr(settings, "DELIVERY_RETRY_BASE_SEC", 10))
+    cap = float(getattr(settings, "DELIVERY_RETRY_MAX_SEC", 600))
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    return max(delay, retry_after or 0)
+
+
+def _closed(entry: dict) -> bool:
+    return entry.get("permanent", False) or entry.get("attempts", 0) >= max_attempts()
+
+
+def settled(state: ChannelState) -> Set[str]:
+    """Каналы, которые для уведомления больше не вызываются."""
+    return {name for name, entry in state.items() if _closed(entry)}
+
+
+def excluded(state: ChannelState, now: float) -> Set[str]:
+    """Закрытые каналы и те, чей retry_at ещё не наступил."""
+    return {
+        name for name, entry in state.items()
+        if _closed(entry) or entry.get("retry_at", 0) > now
+    }
+
+
+def _error_text(error: Optional[Exception]) -> Optional[str]:
+    if error is None:
+        return None
+    return f"{error.__class__.__name__}: {error}"[:_ERROR_MAX_CHARS]
+
+
+def record(state: ChannelState, result: DeliveryResult, now: float) -> ChannelState:
+    """Новое состояние каналов с учётом исходов попытки."""
+    state = {name: dict(entry) for name, entry in state.items()}
+    for name, outcome in result.outcomes.items():
+        if outcome == SKIPPED:
+            state[name] = {
+                **state.get(name, {}),
+                "permanent": True,
+                "error_class": SKIPPED,
+                "error": "no contact",
+            }
+            continue
+        if outcome not in (FAILED, REJECTED, CIRCUIT_OPEN):
+            continue
+        entry = state.setdefault(name, {})
+        entry["attempts"] = entry.get("attempts", 0) + 1
+        error = result.errors.get(name)
+        # класс ошибки — для фильтра dead letters; без исключения — сам исход
+        entry["error_class"] = error.__class__.__name__ if error is not None else outcome
+        entry["error"] = _error_text(error) if error is not None else outcome
+        if outcome == REJECTED:
+            entry["permanent"] = True
+            entry.pop("retry_at", None)
+        else:
+            entry["retry_at"] = now + backoff(
+                entry["attempts"], getattr(error, "retry_after", None),
+            )
+    return state
+
+
+def next_retry_in(state: ChannelState, now: float) -> Optional[float]:
+    """Через сколько секунд повторять (ближайший retry_at) или None — нечего."""
+    pending = [
+        entry.get("retry_at", now) for entry in state.values() if not _closed(entry)
+    ]
+    if not pending:
+        return None
+    return max(min(pending) - now, 0.0)
+
+
+def last_error_class(state: ChannelState, result: DeliveryResult) -> Optional[str]:
+    """
+    Класс ошибки, закрывшей уведомление: последний отказавший в попытке канал,
+    иначе любой с попытками; пропуск без контакта — только если других нет.
+    """
+    names = [name for name in reversed(list(result.outcomes)) if name in state]
+    names += [name for name in state if name not in names]
+    classes = [state[name].get("error_class") for name in names]
+    for error_class in classes:
+        if error_class and error_class != SKIPPED:
+            return error_class
+    return next((error_class for error_class in classes if error_class), None)
+
+
+def reopen(state: ChannelState, reset_permanent: bool = False) -> ChannelState:
+    """
+    Состояние для повторной отправки из dead letters: счётчики временных
+    отказов обнуляются, постоянные отказы остаются закрытыми (если не reset_permanent).
+    """
+    if reset_permanent:
+        return {}
+    return {name: entry for name, entry in state.items() if entry.get("permanent")}
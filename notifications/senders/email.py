@@ -1,13 +1,21 @@
 from __future__ import annotations
 
+import atexit
 import logging
 import smtplib
+import threading
+import time
+from contextlib import ExitStack, contextmanager
 from dataclasses import dataclass
 from email.message import EmailMessage
-from typing import Optional, Protocol, runtime_checkable
+from typing import Dict, Iterator, List, Optional, Protocol, Sequence, Tuple, runtime_checkable
 
 from django.conf import settings
 
+from ..contacts import EMAIL
+from ..errors import DeliveryError, PermanentDeliveryError, TransientDeliveryError
+from .registry import credential_fingerprint, get_transport_registry
+
 logger = logging.getLogger(__name__)
 
 
@@ -36,6 +44,10 @@ class EmailTransport(Protocol):
     """Интерфейс транспорта отправки писем."""
     def send(self, content: EmailContent) -> bool: ...
 
+    def send_many(self, contents: Sequence[EmailContent]) -> List[bool]:
+        """Отправляет пачку писем; результат — по одному bool на письмо."""
+        ...
+
 
 @runtime_checkable
 class UserWithEmail(Protocol):
@@ -49,41 +61,338 @@ class UserWithEmail(Protocol):
 
 
 
+def _open_smtp(cfg: SMTPConfig) -> smtplib.SMTP:
+    """Открывает соединение и проходит EHLO / STARTTLS / LOGIN."""
+    srv = smtplib.SMTP(cfg.host, cfg.port, timeout=cfg.timeout_sec)
+    try:
+        srv.ehlo()
+        if cfg.use_tls:
+            srv.starttls()
+            srv.ehlo()
+
+        # Логин обязателен только если указан пользователь
+        if cfg.user:
+            srv.login(cfg.user, cfg.password or "")
+    except Exception:
+        srv.close()
+        raise
+    return srv
+
+
+# ответы на RCPT TO, которые относятся к самому адресу: ящика нет,
+# пользователь не локальный, имя ящика недопустимо
+_RECIPIENT_REJECTED_CODES = frozenset({550, 551, 553})
+
+
+def smtp_error(exc: Exception) -> DeliveryError:
+    """
+    Исключение для отказа SMTP. Постоянный — только отказ в адресе получателя
+    (SMTPRecipientsRefused с 550/551/553 у всех адресов): повтор его не исправит.
+    Всё остальное — временный отказ канала, в том числе 5xx на логин (535),
+    на отправителя (SMTPSenderRefused) и политика сервера (554): это ошибка
+    настройки или сервера, а не адресата, и она должна открывать circuit breaker,
+    а не молча закрывать email у каждого уведомления.
+    """
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [item[0] for item in exc.recipients.values()]
+        if codes and all(code in _RECIPIENT_REJECTED_CODES for code in codes):
+            return PermanentDeliveryError(f"SMTP {min(codes)}: {exc}")
+    return TransientDeliveryError(f"SMTP: {exc!r}")
+
+
+def _build_message(content: EmailContent) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = content.subject
+    msg["From"] = content.from_email
+    msg["To"] = ", ".join(content.to)
+    if content.is_html:
+        msg.add_alternative(content.body, subtype="html")
+    else:
+        msg.set_content(content.body)
+    return msg
+
+
 class SmtpEmailTransport:
-    """Транспорт отправки через smtplib"""
+    """Транспорт отправки через smtplib: новое соединение на каждое письмо."""
     def __init__(self, config: SMTPConfig) -> None:
         self._cfg = config
 
-    @staticmethod
-    def _build_message(content: EmailContent) -> EmailMessage:
-        msg = EmailMessage()
-        msg["Subject"] = content.subject
-        msg["From"] = content.from_email
-        msg["To"] = ", ".join(content.to)
-        if content.is_html:
-            msg.add_alternative(content.body, subtype="html")
-        else:
-            msg.set_content(content.body)
-        return msg
+    _build_message = staticmethod(_build_message)
 
     def send(self, content: EmailContent) -> bool:
         msg = self._build_message(content)
         try:
-            with smtplib.SMTP(self._cfg.host, self._cfg.port, timeout=self._cfg.timeout_sec) as srv:
-                srv.ehlo()
-                if self._cfg.use_tls:
-                    srv.starttls()
-                    srv.ehlo()
-
-                # Логин обязателен только если указан пользователь
-                if self._cfg.user:
-                    srv.login(self._cfg.user, self._cfg.password or "")
-
+            srv = _open_smtp(self._cfg)
+            with srv:
                 srv.send_message(msg)
             return True
-        except Exception:
+        except Exception as exc:
             logger.exception("SMTP ошибка при отправке на %s", content.to)
+            raise smtp_error(exc) from exc
+
+    def send_many(self, contents: Sequence[EmailContent]) -> List[bool]:
+        """Одна сессия на всю пачку; ошибка письма не прерывает остальные."""
+        results: List[bool] = []
+        try:
+            srv = _open_smtp(self._cfg)
+        except Exception:
+            logger.exception("SMTP ошибка подключения к %s:%s", self._cfg.host, self._cfg.port)
+            return [False] * len(contents)
+        with srv:
+            for content in contents:
+                try:
+                    srv.send_message(self._build_message(content))
+                    results.append(True)
+                except Exception:
+                    logger.exception("SMTP ошибка при отправке на %s", content.to)
+                    results.append(False)
+        return results
+
+
+PoolKey = Tuple[str, int, bool, Optional[str], str]
+
+
+def _pool_key(cfg: SMTPConfig) -> PoolKey:
+    """
+    Ключ пула: (host, port, tls, user) + отпечаток пароля.
+    Пароль в ключ не кладём, но без отпечатка сессию, авторизованную
+    верным паролем, получил бы и вызов с неверным.
+    """
+    return (cfg.host, cfg.port, cfg.use_tls, cfg.user, credential_fingerprint(cfg.password))
+
+
+def _config_key(cfg: SMTPConfig) -> Tuple[str, str]:
+    """Ключ реестра транспортов: отпечаток всей конфигурации вместе с кредами."""
+    return (
+        "smtp",
+        credential_fingerprint(
+            cfg.host, cfg.port, cfg.use_tls, cfg.user, cfg.password, cfg.timeout_sec
+        ),
+    )
+
+
+@dataclass
+class _PooledConnection:
+    smtp: smtplib.SMTP
+    last_used: float
+    sent: int = 0
+
+    def close(self) -> None:
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+
+@dataclass
+class SmtpPoolConfig:
+    """
+    Параметры пула SMTP-сессий.
+
+    - max_messages: сколько писем отправить через одну сессию до переподключения
+    - idle_timeout_sec: простаивающие дольше сессии закрываются
+    - noop_after_sec: сессию, простоявшую дольше, проверяем NOOP перед отправкой
+    - max_idle_per_key: сколько свободных сессий держать на один ключ
+    """
+    max_messages: int = int(getattr(settings, "SMTP_POOL_MAX_MESSAGES", 100))
+    idle_timeout_sec: float = float(getattr(settings, "SMTP_POOL_IDLE_TIMEOUT", 60))
+    noop_after_sec: float = float(getattr(settings, "SMTP_POOL_NOOP_AFTER", 5))
+    max_idle_per_key: int = int(getattr(settings, "SMTP_POOL_MAX_IDLE", 2))
+
+
+class SmtpConnectionPool:
+    """
+    Пул авторизованных SMTP-сессий внутри процесса воркера.
+
+    Сессии выдаются в монопольное пользование (acquire/release), поэтому
+    пул безопасен и для prefork, и для threads-пула Celery.
+    """
+
+    def __init__(self, config: Optional[SmtpPoolConfig] = None) -> None:
+        self._pcfg = config or SmtpPoolConfig()
+        self._idle: Dict[PoolKey, List[_PooledConnection]] = {}
+        self._lock = threading.Lock()
+
+    def _is_alive(self, conn: _PooledConnection, now: float) -> bool:
+        if now - conn.last_used < self._pcfg.noop_after_sec:
+            return True
+        try:
+            code, _ = conn.smtp.noop()
+        except (smtplib.SMTPException, OSError):
             return False
+        return code == 250
+
+    def _evict_idle(self, now: float) -> List[_PooledConnection]:
+        """Вынимает из пула просроченные сессии (закрывать — вне лока)."""
+        expired: List[_PooledConnection] = []
+        for key in list(self._idle):
+            alive = []
+            for conn in self._idle[key]:
+                if now - conn.last_used > self._pcfg.idle_timeout_sec:
+                    expired.append(conn)
+                else:
+                    alive.append(conn)
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+        return expired
+
+    def acquire(self, cfg: SMTPConfig) -> _PooledConnection:
+        key = _pool_key(cfg)
+        now = time.monotonic()
+        with self._lock:
+            expired = self._evict_idle(now)
+            candidates = self._idle.pop(key, [])
+        for conn in expired:
+            conn.close()
+
+        conn: Optional[_PooledConnection] = None
+        while candidates:
+            cand = candidates.pop()
+            if self._is_alive(cand, now):
+                conn = cand
+                break
+            cand.close()
+
+        if candidates:
+            with self._lock:
+                self._idle.setdefault(key, []).extend(candidates)
+
+        if conn is None:
+            conn = _PooledConnection(smtp=_open_smtp(cfg), last_used=now)
+        return conn
+
+    def release(self, cfg: SMTPConfig, conn: _PooledConnection, *, broken: bool = False) -> None:
+        if broken or conn.sent >= self._pcfg.max_messages:
+            conn.close()
+            return
+        conn.last_used = time.monotonic()
+        with self._lock:
+            bucket = self._idle.setdefault(_pool_key(cfg), [])
+            if len(bucket) < self._pcfg.max_idle_per_key:
+                bucket.append(conn)
+                return
+        conn.close()
+
+    def send_message(self, cfg: SMTPConfig, msg: EmailMessage) -> None:
+        """
+        Отправляет письмо через сессию из пула.
+        Если сервер закрыл сессию (SMTPServerDisconnected) — один раз
+        переподключаемся и повторяем. Прочие ошибки пробрасываются.
+        """
+        for attempt in (1, 2):
+            conn = self.acquire(cfg)
+            try:
+                conn.smtp.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self.release(cfg, conn, broken=True)
+                if attempt == 2:
+                    raise
+                logger.info("SMTP-сессия %s:%s закрыта сервером, переподключаемся", cfg.host, cfg.port)
+                continue
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+                # smtplib уже сделал RSET — сессия пригодна для следующих писем
+                conn.sent += 1
+                self.release(cfg, conn)
+                raise
+            except Exception:
+                self.release(cfg, conn, broken=True)
+                raise
+            conn.sent += 1
+            self.release(cfg, conn)
+            return
+
+    def send_many(self, cfg: SMTPConfig, msgs: Sequence[EmailMessage]) -> List[bool]:
+        """
+        Прогоняет пачку писем через одну сессию, переоткрывая её по лимиту
+        max_messages или после разрыва. Результат — по bool на письмо;
+        ошибка отдельного письма логируется и не прерывает пачку.
+        Если не удаётся даже подключиться — остаток пачки помечается False.
+        """
+        results: List[bool] = []
+        conn: Optional[_PooledConnection] = None
+        try:
+            for idx, msg in enumerate(msgs):
+                ok = False
+                for attempt in (1, 2):
+                    if conn is not None and conn.sent >= self._pcfg.max_messages:
+                        self.release(cfg, conn)
+                        conn = None
+                    if conn is None:
+                        try:
+                            conn = self.acquire(cfg)
+                        except Exception:
+                            logger.exception("SMTP ошибка подключения к %s:%s", cfg.host, cfg.port)
+                            results.extend([False] * (len(msgs) - idx))
+                            return results
+                    try:
+                        conn.smtp.send_message(msg)
+                    except smtplib.SMTPServerDisconnected:
+                        self.release(cfg, conn, broken=True)
+                        conn = None
+                        if attempt == 1:
+                            continue
+                        logger.exception("SMTP-сессия %s:%s оборвалась повторно", cfg.host, cfg.port)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+                        conn.sent += 1
+                        logger.exception("SMTP отказ при отправке на %s", msg["To"])
+                    except Exception:
+                        self.release(cfg, conn, broken=True)
+                        conn = None
+                        logger.exception("SMTP ошибка при отправке на %s", msg["To"])
+                    else:
+                        conn.sent += 1
+                        ok = True
+                    break
+                results.append(ok)
+        finally:
+            if conn is not None:
+                self.release(cfg, conn)
+        return results
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns = [c for bucket in self._idle.values() for c in bucket]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+
+_pool: Optional[SmtpConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SmtpConnectionPool:
+    """Пул процесса: живёт между вызовами задач Celery в одном воркере."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SmtpConnectionPool()
+                atexit.register(_pool.close_all)
+    return _pool
+
+
+class PooledSmtpEmailTransport:
+    """Транспорт через smtplib с переиспользованием авторизованных сессий."""
+    def __init__(self, config: SMTPConfig, pool: Optional[SmtpConnectionPool] = None) -> None:
+        self._cfg = config
+        self._pool = pool
+
+    def send(self, content: EmailContent) -> bool:
+        msg = _build_message(content)
+        pool = self._pool or get_smtp_pool()
+        try:
+            pool.send_message(self._cfg, msg)
+            return True
+        except Exception as exc:
+            logger.exception("SMTP ошибка при отправке на %s", content.to)
+            raise smtp_error(exc) from exc
+
+    def send_many(self, contents: Sequence[EmailContent]) -> List[bool]:
+        pool = self._pool or get_smtp_pool()
+        return pool.send_many(self._cfg, [_build_message(c) for c in contents])
 
 
 class DummyEmailTransport:
@@ -92,12 +401,16 @@ class DummyEmailTransport:
         logger.debug("DummyEmailTransport: %s", content)
         return True
 
+    def send_many(self, contents: Sequence[EmailContent]) -> List[bool]:
+        return [self.send(c) for c in contents]
+
 
 
 
 class EmailSender:
    
     name = "email"
+    channel_bit = EMAIL
 
     def __init__(
         self,
@@ -106,7 +419,7 @@ class EmailSender:
     ) -> None:
         # Базовая конфигурация по умолчанию — из settings
         self._base_cfg = base_config or SMTPConfig()
-        self._transport = transport or SmtpEmailTransport(self._base_cfg)
+        self._transport = transport or PooledSmtpEmailTransport(self._base_cfg)
 
     @staticmethod
     def _normalize_recipients(to_emails: str | list[str]) -> list[str]:
@@ -114,26 +427,26 @@ class EmailSender:
             return [to_emails]
         return list(to_emails)
 
-    def deliver(
+    def can_deliver(self, user: UserWithEmail) -> bool:
+        return bool(getattr(user, "email", None))
+
+    def build_content(
         self,
         user: UserWithEmail,
         message: str,
         subject: str = "Notification",
         html: bool = False,
-    ) -> bool:
-        """
-        Готовит письмо и отправляет. Если у пользователя заданы `smtp_user/password`,
-        они перекроют базовые из settings.
-        """
+    ) -> Optional[EmailContent]:
+        """Собирает письмо для пользователя или None, если email не задан."""
         if not getattr(user, "email", None):
-            return False
+            return None
 
         # Сформировать итоговый from_email
         from_email = getattr(user, "from_email", None) or self._base_cfg.user or getattr(
             settings, "DEFAULT_FROM_EMAIL", "noreply@example.com"
         )
 
-        content = EmailContent(
+        return EmailContent(
             to=self._normalize_recipients(user.email),  # type: ignore[arg-type]
             subject=subject,
             body=message,
@@ -141,30 +454,122 @@ class EmailSender:
             is_html=html,
         )
 
-        # Если у пользователя есть свои креды — временно создаём одноразовый транспорт с ними
-        u_user = getattr(user, "smtp_user", None) or self._base_cfg.user
-        u_pwd = getattr(user, "smtp_password", None) or self._base_cfg.password
-
-        if u_user != self._base_cfg.user or u_pwd != self._base_cfg.password:
-            # Создаём транспорт с переопределёнными кредами
-            cfg = SMTPConfig(
-                host=self._base_cfg.host,
-                port=self._base_cfg.port,
-                use_tls=self._base_cfg.use_tls,
-                user=u_user,
-                password=u_pwd,
-                timeout_sec=self._base_cfg.timeout_sec,
-            )
-            transport = SmtpEmailTransport(cfg)
-        else:
-            transport = self._transport
+    def _credentials(self, user: UserWithEmail) -> Tuple[Optional[str], Optional[str]]:
+        return (
+            getattr(user, "smtp_user", None) or self._base_cfg.user,
+            getattr(user, "smtp_password", None) or self._base_cfg.password,
+        )
+
+    @contextmanager
+    def transport_for(self, user: UserWithEmail) -> Iterator[EmailTransport]:
+        """
+        Транспорт для пользователя на время блока with. Если у него есть свои
+        креды — берём транспорт с ними из реестра; сессии под эти креды живут
+        в общем пуле процесса.
+        """
+        u_user, u_pwd = self._credentials(user)
+        if u_user == self._base_cfg.user and u_pwd == self._base_cfg.password:
+            yield self._transport
+            return
+
+        # Транспорт с переопределёнными кредами — из реестра процесса
+        cfg = SMTPConfig(
+            host=self._base_cfg.host,
+            port=self._base_cfg.port,
+            use_tls=self._base_cfg.use_tls,
+            user=u_user,
+            password=u_pwd,
+            timeout_sec=self._base_cfg.timeout_sec,
+        )
+        with get_transport_registry().lease(
+            _config_key(cfg), lambda: PooledSmtpEmailTransport(cfg)
+        ) as transport:
+            yield transport
+
+    def deliver(
+        self,
+        user: UserWithEmail,
+        message: str,
+        subject: str = "Notification",
+        html: bool = False,
+    ) -> bool:
+        """
+        Готовит письмо и отправляет. Если у пользователя заданы `smtp_user/password`,
+        они перекроют базовые из settings. Отказ SMTP поднимается как
+        DeliveryError (см. smtp_error).
+        """
+        content = self.build_content(user, message, subject=subject, html=html)
+        if content is None:
+            return False
 
         try:
-            return bool(transport.send(content))
+            with self.transport_for(user) as transport:
+                return bool(transport.send(content))
+        except DeliveryError:
+            raise
         except Exception:
             logger.exception("Ошибка в EmailSender.deliver для пользователя %s", getattr(user, "pk", user))
             return False
 
+    def send_many(self, contents: Sequence[EmailContent]) -> List[bool]:
+        """Пачка готовых писем через базовый транспорт (одна SMTP-сессия)."""
+        if not contents:
+            return []
+        try:
+            return [bool(ok) for ok in self._transport.send_many(contents)]
+        except Exception:
+            logger.exception("Ошибка в EmailSender.send_many (%s писем)", len(contents))
+            return [False] * len(contents)
+
+    def deliver_many(
+        self,
+        items: Sequence[Tuple],
+        subject: str = "Notification",
+        html: bool = False,
+    ) -> List[bool]:
+        """
+        Пакетный аналог deliver: пары (user, message) или тройки
+        (user, message, options) -> bool на каждую в том же порядке; options
+        (subject, html из шаблона) перекрывают общие для своего письма.
+        Письма группируются по транспорту (кредам), каждая группа уходит
+        через одну SMTP-сессию.
+        """
+        results: List[bool] = [False] * len(items)
+        groups: Dict[
+            Tuple[Optional[str], Optional[str]],
+            Tuple[EmailTransport, List[int], List[EmailContent]],
+        ] = {}
+
+        with ExitStack() as leases:
+            for idx, (user, message, *options) in enumerate(items):
+                content = self.build_content(
+                    user, message, **{"subject": subject, "html": html, **(options[0] if options else {})}
+                )
+                if content is None:
+                    continue
+                creds = self._credentials(user)
+                if creds not in groups:
+                    groups[creds] = (leases.enter_context(self.transport_for(user)), [], [])
+                _, positions, contents = groups[creds]
+                positions.append(idx)
+                contents.append(content)
+
+            for transport, positions, contents in groups.values():
+                try:
+                    sent = transport.send_many(contents)
+                except Exception:
+                    logger.exception("Ошибка в EmailSender.deliver_many (%s писем)", len(contents))
+                    continue
+                for idx, ok in zip(positions, sent):
+                    results[idx] = bool(ok)
+        return results
+
+    def close(self) -> None:
+        """Закрывает базовый транспорт, если у него есть close(); зовёт реестр при вытеснении."""
+        close = getattr(self._transport, "close", None)
+        if close is not None:
+            close()
+
 
 def send_email_via_smtp(
     to_emails: str | list[str],
@@ -187,13 +592,19 @@ def send_email_via_smtp(
         password=smtp_password or getattr(settings, "SMTP_DEFAULT_PASSWORD", "") or None,
     )
 
-    sender = EmailSender(SmtpEmailTransport(base_cfg), base_cfg)
-
     class _TmpUser:
         email = to_emails
         smtp_user = base_cfg.user
         smtp_password = base_cfg.password
-        from_email = from_email
         pk = "facade"
 
-    return sender.deliver(_TmpUser(), message=body, subject=subject, html=html)
+    user = _TmpUser()
+    user.from_email = from_email
+    with get_transport_registry().lease(
+        ("email-sender",) + _config_key(base_cfg),
+        lambda: EmailSender(PooledSmtpEmailTransport(base_cfg), base_cfg),
+    ) as sender:
+        try:
+            return sender.deliver(user, message=body, subject=subject, html=html)
+        except DeliveryError:
+            return False
@@ -0,0 +1,147 @@
+"""
+Реестр транспортов и отправщиков процесса.
+
+Транспорты с персональными кредами (SMTP-аккаунт пользователя, токен
+его бота) раньше создавались на каждый вызов. Реестр держит их тёплыми:
+LRU с ограничением размера и вытеснением по простою. Ключи строятся из
+отпечатков кредов, сами секреты в ключах не хранятся.
+
+Объект берётся через lease() и возвращается по выходу из блока with.
+Вытесненный объект, которым ещё пользуется другой поток, закрывается
+не сразу, а когда его отпустит последний пользователь.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple, TypeVar
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def credential_fingerprint(*parts: object) -> str:
+    """Стабильный отпечаток набора кредов: sha256, секреты не восстановимы."""
+    raw = "\x1f".join("" if p is None else str(p) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class TransportRegistry:
+    """
+    LRU-кеш объектов с idle-TTL; вытесненным вызывается close(), если есть,
+    но только после того, как их отпустят все, кто взял через lease().
+    """
+
+    def __init__(self, maxsize: int = 256, ttl_sec: float = 600.0) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl_sec
+        self._items: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        # id(obj) -> число незавершённых lease(); вытесненные, но занятые — в _retired
+        self._refs: Dict[int, int] = {}
+        self._retired: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self, key: Hashable, factory: Callable[[], T]) -> Iterator[T]:
+        """Объект по ключу (или новый из factory) на время блока with."""
+        obj = self._checkout(key, factory)
+        try:
+            yield obj
+        finally:
+            self._checkin(obj)
+
+    def _checkout(self, key: Hashable, factory: Callable[[], T]) -> T:
+        now = time.monotonic()
+        evicted: List[Any] = []
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and now - item[1] <= self._ttl:
+                obj = item[0]
+                self._items.move_to_end(key)
+            else:
+                if item is not None:
+                    evicted.append(item[0])
+                obj = factory()
+            self._items[key] = (obj, now)
+
+            while len(self._items) > self._maxsize:
+                _, (old, _) = self._items.popitem(last=False)
+                evicted.append(old)
+            # просроченные лежат в начале — там, где давно не трогали
+            while self._items:
+                first_key, (old, used_at) = next(iter(self._items.items()))
+                if now - used_at <= self._ttl:
+                    break
+                del self._items[first_key]
+                evicted.append(old)
+
+            self._refs[id(obj)] = self._refs.get(id(obj), 0) + 1
+            to_close = self._retire(evicted)
+
+        for old in to_close:
+            _close_quietly(old)
+        return obj
+
+    def _checkin(self, obj: Any) -> None:
+        with self._lock:
+            left = self._refs[id(obj)] - 1
+            if left:
+                self._refs[id(obj)] = left
+                return
+            del self._refs[id(obj)]
+            retired = self._retired.pop(id(obj), None)
+        if retired is not None:
+            _close_quietly(retired)
+
+    def _retire(self, evicted: List[Any]) -> List[Any]:
+        """Под self._lock: свободные — закрыть сейчас, занятые — при последнем checkin."""
+        to_close = []
+        for old in evicted:
+            if id(old) in self._refs:
+                self._retired[id(old)] = old
+            else:
+                to_close.append(old)
+        return to_close
+
+    def clear(self) -> None:
+        with self._lock:
+            to_close = self._retire([obj for obj, _ in self._items.values()])
+            self._items.clear()
+        for obj in to_close:
+            _close_quietly(obj)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def _close_quietly(obj: object) -> None:
+    close = getattr(obj, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:
+        logger.exception("Ошибка при закрытии %s", obj.__class__.__name__)
+
+
+_registry: Optional[TransportRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_transport_registry() -> TransportRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TransportRegistry(
+                    maxsize=int(getattr(settings, "TRANSPORT_REGISTRY_MAXSIZE", 256)),
+                    ttl_sec=float(getattr(settings, "TRANSPORT_REGISTRY_TTL", 600)),
+                )
+    return _registry
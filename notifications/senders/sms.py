@@ -1,10 +1,16 @@
 import logging
 
+from ..contacts import SMS
+
 logger = logging.getLogger(__name__)
 
 
 class SmsSender:
     name = "sms"
+    channel_bit = SMS
+
+    def can_deliver(self, user: object) -> bool:
+        return bool(getattr(user, "phone", None))
 
     def deliver(self, user: object, message: str) -> bool:
         phone = getattr(user, "phone", None)
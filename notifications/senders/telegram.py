@@ -1,12 +1,24 @@
 from __future__ import annotations
 
 import logging
+import time
+from contextlib import ExitStack, contextmanager
 from dataclasses import dataclass
-from typing import Optional, Protocol, runtime_checkable
+from typing import Any, Dict, Iterator, List, Optional, Protocol, Sequence, Tuple, runtime_checkable
 
 import requests
 from django.conf import settings
 
+from ..contacts import TELEGRAM
+from ..errors import (
+    DeliveryError,
+    PermanentDeliveryError,
+    ThrottledDeliveryError,
+    TransientDeliveryError,
+)
+from ..ratelimit import TelegramRateLimiter, get_telegram_rate_limiter
+from .registry import credential_fingerprint, get_transport_registry
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,7 +32,7 @@ class TelegramConfig:
     token: Optional[str] = (
         getattr(settings, "TELEGRAM_BOT_TOKEN", "") or None
     )
-    base_url: str = "https://api.telegram.org"
+    base_url: str = getattr(settings, "TELEGRAM_API_URL", "https://api.telegram.org")
     parse_mode: Optional[str] = (
         getattr(settings, "TELEGRAM_PARSE_MODE", "") or None
     )
@@ -44,6 +56,10 @@ class TelegramTransport(Protocol):
     """Интерфейс транспорта отправки сообщений в Telegram."""
     def send(self, message: TelegramMessage) -> bool: ...
 
+    def send_many(self, messages: Sequence[TelegramMessage]) -> List[bool]:
+        """Отправляет пачку сообщений; результат — по одному bool на сообщение."""
+        ...
+
 
 @runtime_checkable
 class UserWithTelegram(Protocol):
@@ -54,6 +70,82 @@ class UserWithTelegram(Protocol):
 
 
 
+def build_payload(message: TelegramMessage) -> Dict[str, Any]:
+    """Тело запроса sendMessage."""
+    payload: Dict[str, Any] = {
+        "chat_id": message.chat_id,
+        "text": message.text,
+        "disable_web_page_preview": message.disable_web_page_preview,
+    }
+    if message.parse_mode:
+        payload["parse_mode"] = message.parse_mode
+    return payload
+
+
+def check_response(status_code: int, data: Optional[Dict[str, Any]], text: str) -> bool:
+    """Разбирает ответ Bot API: True, если сообщение принято."""
+    if status_code != 200:
+        logger.error("Telegram HTTP %s: %s", status_code, text)
+        return False
+    if not (data or {}).get("ok", False):
+        logger.error(
+            "Telegram API error: code=%s desc=%s",
+            (data or {}).get("error_code"),
+            (data or {}).get("description"),
+        )
+        return False
+    return True
+
+
+def get_retry_after(status_code: int, data: Optional[Dict[str, Any]]) -> Optional[float]:
+    """Для ответа 429 — сколько секунд просит подождать Bot API (parameters.retry_after)."""
+    if status_code != 429:
+        return None
+    params = (data or {}).get("parameters") or {}
+    try:
+        return float(params.get("retry_after", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+# 400 (chat not found и т.п.) и 403 (бот заблокирован) повтором не лечатся
+_PERMANENT_STATUSES = frozenset({400, 403})
+
+
+def response_error(
+    status_code: int, data: Optional[Dict[str, Any]], text: str,
+) -> DeliveryError:
+    """Исключение для отказа Bot API: постоянное для 400/403, иначе временное."""
+    description = (data or {}).get("description") or text[:200]
+    if status_code in _PERMANENT_STATUSES:
+        return PermanentDeliveryError(f"Telegram {status_code}: {description}")
+    return TransientDeliveryError(
+        f"Telegram {status_code}: {description}",
+        retry_after=get_retry_after(status_code, data),
+    )
+
+
+def send_quietly(send, message: TelegramMessage) -> bool:
+    """send транспорта для пакетов: отказ — просто False (он уже залогирован)."""
+    try:
+        return bool(send(message))
+    except DeliveryError:
+        return False
+
+
+def make_send_url(config: TelegramConfig) -> str:
+    if not config.token:
+        raise ValueError("TELEGRAM_BOT_TOKEN не задан")
+    return f"{config.base_url}/bot{config.token}/sendMessage"
+
+
+def _json_or_none(resp: requests.Response) -> Optional[Dict[str, Any]]:
+    try:
+        return resp.json()
+    except ValueError:
+        return None
+
+
 class RequestsTelegramTransport:
     """
     Транспорт на базе requests.Session.
@@ -62,47 +154,60 @@ class RequestsTelegramTransport:
         self,
         config: TelegramConfig,
         session: Optional[requests.Session] = None,
+        rate_limiter: Optional[TelegramRateLimiter] = None,
     ) -> None:
         self._cfg = config
         self._session = session or requests.Session()
+        self._limiter = rate_limiter
+        # лимиты Bot API — на бота: ключ лимитера по отпечатку токена
+        self._bot = credential_fingerprint(config.token)
+        self._max_429 = int(getattr(settings, "TELEGRAM_429_MAX_RETRIES", 3))
 
     def _make_url(self) -> str:
-        if not self._cfg.token:
-            raise ValueError("TELEGRAM_BOT_TOKEN не задан")
-        return f"{self._cfg.base_url}/bot{self._cfg.token}/sendMessage"
+        return make_send_url(self._cfg)
 
     def send(self, message: TelegramMessage) -> bool:
         url = self._make_url()
-        payload = {
-            "chat_id": message.chat_id,
-            "text": message.text,
-            "disable_web_page_preview": message.disable_web_page_preview,
-        }
-        if message.parse_mode:
-            payload["parse_mode"] = message.parse_mode
+        payload = build_payload(message)
 
         try:
-            resp = self._session.post(url, json=payload, timeout=self._cfg.timeout_sec)
-            if resp.status_code != 200:
-                logger.error("Telegram HTTP %s: %s", resp.status_code, resp.text)
-                return False
-
-            data = resp.json()
-            if not data.get("ok", False):
-                logger.error(
-                    "Telegram API error: code=%s desc=%s",
-                    data.get("error_code"),
-                    data.get("description"),
-                )
-                return False
-            return True
-        except requests.RequestException:
-            logger.exception("Ошибка сети при отправке в Telegram")
+            for attempt in range(self._max_429 + 1):
+                if self._limiter is not None and not self._limiter.acquire(message.chat_id, self._bot):
+                    raise ThrottledDeliveryError(
+                        f"Telegram: не дождались слота лимита для чата {message.chat_id}"
+                    )
+
+                resp = self._session.post(url, json=payload, timeout=self._cfg.timeout_sec)
+                data = _json_or_none(resp)
+                retry_after = get_retry_after(resp.status_code, data)
+                if retry_after is not None and attempt < self._max_429:
+                    # 429 — не ошибка доставки: ждём ровно retry_after и повторяем
+                    logger.warning("Telegram 429: пауза %s с", retry_after)
+                    if self._limiter is not None:
+                        self._limiter.pause(retry_after, self._bot)
+                    else:
+                        time.sleep(retry_after)
+                    continue
+                if check_response(resp.status_code, data, resp.text):
+                    return True
+                raise response_error(resp.status_code, data, resp.text)
             return False
+        except DeliveryError:
+            raise
+        except requests.RequestException as exc:
+            logger.exception("Ошибка сети при отправке в Telegram")
+            raise TransientDeliveryError(f"Telegram: {exc}") from exc
         except Exception:
             logger.exception("Непредвиденная ошибка при отправке в Telegram")
             return False
 
+    def send_many(self, messages: Sequence[TelegramMessage]) -> List[bool]:
+        """Последовательно, но через одно keep-alive соединение сессии."""
+        return [send_quietly(self.send, m) for m in messages]
+
+    def close(self) -> None:
+        self._session.close()
+
 
 class DummyTelegramTransport:
     """Заглушка для тестов/локальной разработки — всегда True."""
@@ -110,6 +215,36 @@ class DummyTelegramTransport:
         logger.debug("DummyTelegramTransport: %s", message)
         return True
 
+    def send_many(self, messages: Sequence[TelegramMessage]) -> List[bool]:
+        return [self.send(m) for m in messages]
+
+
+def _config_key(config: TelegramConfig) -> Tuple[str, str]:
+    """Ключ реестра: отпечаток токена и параметров, сам токен в ключ не попадает."""
+    return (
+        "telegram",
+        credential_fingerprint(
+            config.token,
+            config.base_url,
+            config.parse_mode,
+            config.disable_web_page_preview,
+            config.timeout_sec,
+        ),
+    )
+
+
+def make_transport(config: TelegramConfig) -> TelegramTransport:
+    """
+    Транспорт по настройке TELEGRAM_TRANSPORT: "requests" (по умолчанию)
+    или "async" — конкурентная отправка на httpx.
+    """
+    limiter = get_telegram_rate_limiter()
+    if getattr(settings, "TELEGRAM_TRANSPORT", "requests") == "async":
+        from .telegram_async import AsyncTelegramTransport
+
+        return AsyncTelegramTransport(config, rate_limiter=limiter)
+    return RequestsTelegramTransport(config, rate_limiter=limiter)
+
 
 
 class TelegramSender:
@@ -118,6 +253,7 @@ class TelegramSender:
     """
     name = "telegram"
     priority = 30
+    channel_bit = TELEGRAM
 
     def __init__(
         self,
@@ -125,27 +261,27 @@ class TelegramSender:
         base_config: Optional[TelegramConfig] = None,
     ) -> None:
         self._base_cfg = base_config or TelegramConfig()
-        self._transport = transport or RequestsTelegramTransport(self._base_cfg)
+        self._transport = transport or make_transport(self._base_cfg)
 
     @staticmethod
     def _normalize_chat_id(chat_id: str | int) -> str:
         return str(chat_id)
 
-    def deliver(
+    def can_deliver(self, user: UserWithTelegram) -> bool:
+        return bool(getattr(user, "telegram_id", None))
+
+    def build_message(
         self,
         user: UserWithTelegram,
         message: str,
         *,
         parse_mode: Optional[str] = None,
         disable_web_page_preview: Optional[bool] = None,
-    ) -> bool:
-        """
-        Отправляет сообщение пользователю.
-        Если у пользователя задан персональный токен, он перекроет базовый.
-        """
+    ) -> Optional[TelegramMessage]:
+        """Собирает сообщение для пользователя или None, если нет telegram_id."""
         chat_id = getattr(user, "telegram_id", None)
         if not chat_id:
-            return False
+            return None
 
         # Итоговые параметры
         pmode = (
@@ -159,32 +295,67 @@ class TelegramSender:
             else bool(disable_web_page_preview)
         )
 
-        msg = TelegramMessage(
+        return TelegramMessage(
             chat_id=self._normalize_chat_id(chat_id),
             text=message,
             parse_mode=pmode,
             disable_web_page_preview=disable_wpp,
         )
 
-        # При необходимости создаём одноразовый транспорт с персональным токеном
-        user_token = getattr(user, "telegram_bot_token", None)
-        if user_token and user_token != self._base_cfg.token:
-            cfg = TelegramConfig(
-                token=user_token,
-                base_url=self._base_cfg.base_url,
-                parse_mode=self._base_cfg.parse_mode,
-                disable_web_page_preview=self._base_cfg.disable_web_page_preview,
-                timeout_sec=self._base_cfg.timeout_sec,
-            )
-            transport = RequestsTelegramTransport(cfg)
-        else:
-            transport = self._transport
+    def _token(self, user: UserWithTelegram) -> Optional[str]:
+        return getattr(user, "telegram_bot_token", None) or self._base_cfg.token
+
+    @contextmanager
+    def transport_for(self, user: UserWithTelegram) -> Iterator[TelegramTransport]:
+        """
+        Транспорт пользователя на время блока with. Транспорт с персональным
+        токеном берётся из реестра процесса и не закрывается, пока занят.
+        """
+        user_token = self._token(user)
+        if user_token == self._base_cfg.token:
+            yield self._transport
+            return
+
+        cfg = TelegramConfig(
+            token=user_token,
+            base_url=self._base_cfg.base_url,
+            parse_mode=self._base_cfg.parse_mode,
+            disable_web_page_preview=self._base_cfg.disable_web_page_preview,
+            timeout_sec=self._base_cfg.timeout_sec,
+        )
+        with get_transport_registry().lease(_config_key(cfg), lambda: make_transport(cfg)) as transport:
+            yield transport
+
+    def deliver(
+        self,
+        user: UserWithTelegram,
+        message: str,
+        *,
+        parse_mode: Optional[str] = None,
+        disable_web_page_preview: Optional[bool] = None,
+    ) -> bool:
+        """
+        Отправляет сообщение пользователю.
+        Если у пользователя задан персональный токен, он перекроет базовый.
+        Отказ Bot API или сети поднимается как DeliveryError (см. errors).
+        """
+        msg = self.build_message(
+            user,
+            message,
+            parse_mode=parse_mode,
+            disable_web_page_preview=disable_web_page_preview,
+        )
+        if msg is None:
+            return False
 
         try:
-            ok = bool(transport.send(msg))
+            with self.transport_for(user) as transport:
+                ok = bool(transport.send(msg))
             if not ok:
-                logger.warning("Telegram send to %s вернул False", chat_id)
+                logger.warning("Telegram send to %s вернул False", msg.chat_id)
             return ok
+        except DeliveryError:
+            raise
         except Exception:
             logger.exception(
                 "Ошибка в TelegramSender.deliver для пользователя %s",
@@ -192,6 +363,50 @@ class TelegramSender:
             )
             return False
 
+    def deliver_many(
+        self,
+        items: Sequence[Tuple],
+    ) -> List[bool]:
+        """
+        Пакетный аналог deliver: пары (user, message) или тройки
+        (user, message, options) -> bool на каждую в том же порядке; options —
+        аргументы build_message (parse_mode из шаблона). Сообщения
+        группируются по токену бота; каждая группа уходит одним send_many транспорта.
+        """
+        results: List[bool] = [False] * len(items)
+        groups: Dict[
+            Optional[str],
+            Tuple[TelegramTransport, List[int], List[TelegramMessage]],
+        ] = {}
+
+        with ExitStack() as leases:
+            for idx, (user, message, *options) in enumerate(items):
+                msg = self.build_message(user, message, **(options[0] if options else {}))
+                if msg is None:
+                    continue
+                token = self._token(user)
+                if token not in groups:
+                    groups[token] = (leases.enter_context(self.transport_for(user)), [], [])
+                _, positions, messages = groups[token]
+                positions.append(idx)
+                messages.append(msg)
+
+            for transport, positions, messages in groups.values():
+                try:
+                    sent = transport.send_many(messages)
+                except Exception:
+                    logger.exception("Ошибка в TelegramSender.deliver_many (%s сообщений)", len(messages))
+                    continue
+                for idx, ok in zip(positions, sent):
+                    results[idx] = bool(ok)
+        return results
+
+    def close(self) -> None:
+        """Закрывает базовый транспорт (сессию); зовёт реестр при вытеснении."""
+        close = getattr(self._transport, "close", None)
+        if close is not None:
+            close()
+
 
 
 def send_telegram_message(
@@ -206,7 +421,7 @@ def send_telegram_message(
    
     base_cfg = TelegramConfig(
         token=token or getattr(settings, "TELEGRAM_BOT_TOKEN", "") or None,
-        base_url="https://api.telegram.org",
+        base_url=getattr(settings, "TELEGRAM_API_URL", "https://api.telegram.org"),
         parse_mode=(
             parse_mode
             if parse_mode is not None
@@ -216,14 +431,21 @@ def send_telegram_message(
         timeout_sec=timeout,
     )
 
-    sender = TelegramSender(
-        transport=RequestsTelegramTransport(base_cfg),
-        base_config=base_cfg,
-    )
-
     class _TmpUser:
         telegram_id = chat_id
         telegram_bot_token = base_cfg.token
         pk = "facade"
 
-    return sender.deliver(_TmpUser(), message=text)
+    with get_transport_registry().lease(
+        ("telegram-sender",) + _config_key(base_cfg),
+        lambda: TelegramSender(
+            transport=RequestsTelegramTransport(
+                base_cfg, rate_limiter=get_telegram_rate_limiter()
+            ),
+            base_config=base_cfg,
+        ),
+    ) as sender:
+        try:
+            return sender.deliver(_TmpUser(), message=text)
+        except DeliveryError:
+            return False
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Awaitable, List, Optional, Sequence, TypeVar
+
+import httpx
+from django.conf import settings
+
+from ..errors import DeliveryError, ThrottledDeliveryError, TransientDeliveryError
+from ..ratelimit import TelegramRateLimiter
+from .registry import credential_fingerprint
+from .telegram import (
+    TelegramConfig,
+    TelegramMessage,
+    build_payload,
+    check_response,
+    get_retry_after,
+    make_send_url,
+    response_error,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _LoopThread:
+    """
+    Фоновый event loop процесса. Синхронный код (задачи Celery) отдаёт
+    в него корутины и ждёт результат, а пул соединений httpx живёт между
+    вызовами. После fork (prefork-воркер Celery) loop поднимается заново.
+    """
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure(self) -> asyncio.AbstractEventLoop:
+        pid = os.getpid()
+        if self._loop is None or self._pid != pid:
+            with self._lock:
+                if self._loop is None or self._pid != pid:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(
+                        target=loop.run_forever,
+                        name="telegram-async-loop",
+                        daemon=True,
+                    )
+                    thread.start()
+                    self._loop, self._pid = loop, pid
+        return self._loop
+
+    def run(self, coro: Awaitable[T]) -> T:
+        loop = self._ensure()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+_runner = _LoopThread()
+
+
+class AsyncTelegramTransport:
+    """
+    Транспорт на httpx.AsyncClient: общий keep-alive пул соединений
+    и конкурентные sendMessage с ограничением concurrency.
+
+    Можно использовать из asyncio-кода (asend / asend_many) и из
+    синхронного (send / send_many) — тогда вызовы выполняются в
+    фоновом loop процесса.
+    """
+
+    def __init__(
+        self,
+        config: TelegramConfig,
+        *,
+        concurrency: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        rate_limiter: Optional[TelegramRateLimiter] = None,
+    ) -> None:
+        self._cfg = config
+        self._limiter = rate_limiter
+        self._bot = credential_fingerprint(config.token)
+        self._max_429 = int(getattr(settings, "TELEGRAM_429_MAX_RETRIES", 3))
+        self._concurrency = concurrency or int(getattr(settings, "TELEGRAM_CONCURRENCY", 50))
+        self._max_connections = max_connections or int(
+            getattr(settings, "TELEGRAM_MAX_CONNECTIONS", 100)
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        # Клиент и семафор привязаны к loop, в котором созданы
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._drop_client()
+            self._client = httpx.AsyncClient(
+                timeout=self._cfg.timeout_sec,
+                limits=httpx.Limits(
+                    max_connections=self._max_connections,
+                    max_keepalive_connections=self._max_connections,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._loop = loop
+        return self._client
+
+    def _drop_client(self) -> None:
+        # Клиент прошлого loop закрываем в нём же: его соединения привязаны к тому loop
+        client, loop = self._client, self._loop
+        self._client = self._loop = None
+        if client is None or loop is None:
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # loop остановлен или закрыт — его сокеты закрылись вместе с ним
+            logger.debug("Клиент Telegram остановленного loop отброшен без aclose")
+
+    async def asend(self, message: TelegramMessage) -> bool:
+        client = self._ensure_client()
+        assert self._semaphore is not None
+        try:
+            url = make_send_url(self._cfg)
+            payload = build_payload(message)
+            for attempt in range(self._max_429 + 1):
+                if self._limiter is not None and not await self._limiter.aacquire(
+                    message.chat_id, self._bot,
+                ):
+                    raise ThrottledDeliveryError(
+                        f"Telegram: не дождались слота лимита для чата {message.chat_id}"
+                    )
+
+                async with self._semaphore:
+                    resp = await client.post(url, json=payload)
+                try:
+                    data = resp.json()
+                except ValueError:
+                    data = None
+                retry_after = get_retry_after(resp.status_code, data)
+                if retry_after is not None and attempt < self._max_429:
+                    # 429 — не ошибка доставки: ждём ровно retry_after и повторяем
+                    logger.warning("Telegram 429: пауза %s с", retry_after)
+                    if self._limiter is not None:
+                        await asyncio.to_thread(self._limiter.pause, retry_after, self._bot)
+                    else:
+                        await asyncio.sleep(retry_after)
+                    continue
+                if check_response(resp.status_code, data, resp.text):
+                    return True
+                raise response_error(resp.status_code, data, resp.text)
+            return False
+        except DeliveryError:
+            raise
+        except httpx.HTTPError as exc:
+            logger.exception("Ошибка сети при отправке в Telegram")
+            raise TransientDeliveryError(f"Telegram: {exc}") from exc
+        except Exception:
+            logger.exception("Непредвиденная ошибка при отправке в Telegram")
+            return False
+
+    async def asend_many(self, messages: Sequence[TelegramMessage]) -> List[bool]:
+        # отказ отдельного сообщения (DeliveryError) — False, остальные не страдают
+        results = await asyncio.gather(*(self.asend(m) for m in messages), return_exceptions=True)
+        return [result is True for result in results]
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def send(self, message: TelegramMessage) -> bool:
+        return _runner.run(self.asend(message))
+
+    def send_many(self, messages: Sequence[TelegramMessage]) -> List[bool]:
+        if not messages:
+            return []
+        return _runner.run(self.asend_many(messages))
+
+    def close(self) -> None:
+        if self._client is not None:
+            _runner.run(self.aclose())
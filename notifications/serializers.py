@@ -1,7 +1,9 @@
 """Сериализаторы для уведомлений и пользователей."""
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import Notification, User
+from .listing import page_size_limits
+from .models import DeliveryStatus, Notification, NotificationTemplate, Priority, User
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -12,11 +14,195 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ("id", "email", "phone", "telegram_id")
 
 
+class NotificationTemplateSerializer(serializers.ModelSerializer):
+    """Шаблон сообщения; синтаксис частей проверяют валидаторы модели."""
+
+    class Meta:
+        model = NotificationTemplate
+        fields = (
+            "id",
+            "name",
+            "subject",
+            "body",
+            "html_body",
+            "telegram_body",
+            "telegram_parse_mode",
+            "updated_at",
+        )
+
+
+def missing_templates(template_ids) -> list:
+    """Id шаблонов, которых нет в БД (один запрос на все)."""
+    wanted = {template_id for template_id in template_ids if template_id is not None}
+    if not wanted:
+        return []
+    existing = set(
+        NotificationTemplate.objects.filter(id__in=wanted).values_list("id", flat=True)
+    )
+    return sorted(wanted - existing)
+
+
 class NotificationCreateSerializer(serializers.Serializer):
-    """Сериализатор входных данных при создании уведомления."""
+    """
+    Сериализатор входных данных при создании уведомления: текст (message)
+    или шаблон с параметрами (template_id + params) — ровно одно из двух.
+    Существование шаблона проверяет тот, кто пишет строки (одним запросом на пачку).
+    """
 
     user_id = serializers.IntegerField()
-    message = serializers.CharField()
+    message = serializers.CharField(required=False, default="")
+    template_id = serializers.IntegerField(required=False, allow_null=True, default=None, min_value=1)
+    params = serializers.DictField(required=False, default=dict)
+    priority = serializers.ChoiceField(choices=Priority.choices, default=Priority.NORMAL)
+    send_at = serializers.DateTimeField(required=False, allow_null=True, default=None)
+
+    def validate(self, attrs: dict) -> dict:
+        if attrs["template_id"] is None:
+            if not attrs["message"]:
+                raise serializers.ValidationError({"message": ["Нужен message или template_id."]})
+        elif attrs["message"]:
+            raise serializers.ValidationError("Передайте либо message, либо template_id + params.")
+        return attrs
+
+
+class NotificationIngestSerializer(serializers.Serializer):
+    """
+    Несколько уведомлений в одном запросе к /api/ingest/: {"items": [...]},
+    элементы — как у создания по одному. Пользователи проверяются при
+    записи пачки, ошибка — в результате своего элемента.
+    """
+
+    items = NotificationCreateSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items: list) -> list:
+        max_items = int(getattr(settings, "NOTIFICATIONS_BULK_MAX_ITEMS", 10000))
+        if len(items) > max_items:
+            raise serializers.ValidationError(
+                f"Не больше {max_items} уведомлений за запрос."
+            )
+        return items
+
+
+class NotificationBulkCreateSerializer(serializers.Serializer):
+    """
+    Входные данные массового создания. Два режима (ровно один из них):
+    - items: список {user_id, message} или {user_id, template_id, params};
+    - user_ids + message (или template_id + params): одно сообщение для
+      списка пользователей.
+    Существование всех пользователей и шаблонов проверяется одним запросом на каждое.
+    priority и send_at — общие для всего запроса, priority по умолчанию bulk.
+    Результат — rows: поля каждой строки (user_id, message, template_id, params).
+    """
+
+    items = NotificationCreateSerializer(many=True, required=False)
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False,
+    )
+    message = serializers.CharField(required=False)
+    template_id = serializers.IntegerField(required=False, min_value=1)
+    params = serializers.DictField(required=False, default=dict)
+    priority = serializers.ChoiceField(choices=Priority.choices, default=Priority.BULK)
+    send_at = serializers.DateTimeField(required=False, allow_null=True, default=None)
+
+    def validate(self, attrs: dict) -> dict:
+        items = attrs.get("items")
+        user_ids = attrs.get("user_ids")
+        message = attrs.get("message")
+        template_id = attrs.get("template_id")
+
+        if items is not None and (
+            user_ids is not None or message is not None or template_id is not None
+        ):
+            raise serializers.ValidationError(
+                "Передайте либо items, либо user_ids + message (или template_id)."
+            )
+        if items is not None:
+            rows = [
+                {
+                    "user_id": item["user_id"],
+                    "message": item["message"],
+                    "template_id": item["template_id"],
+                    "params": item["params"],
+                }
+                for item in items
+            ]
+        elif user_ids is not None and bool(message) != (template_id is not None):
+            content = {"message": message or "", "template_id": template_id, "params": attrs["params"]}
+            rows = [{"user_id": user_id, **content} for user_id in user_ids]
+        else:
+            raise serializers.ValidationError(
+                "Нужны items или user_ids + message (или template_id)."
+            )
+
+        if not rows:
+            raise serializers.ValidationError("Пустой список уведомлений.")
+        max_items = int(getattr(settings, "NOTIFICATIONS_BULK_MAX_ITEMS", 10000))
+        if len(rows) > max_items:
+            raise serializers.ValidationError(
+                f"Не больше {max_items} уведомлений за запрос."
+            )
+
+        wanted = {row["user_id"] for row in rows}
+        existing = set(
+            User.objects.filter(id__in=wanted).values_list("id", flat=True)
+        )
+        missing = sorted(wanted - existing)
+        if missing:
+            raise serializers.ValidationError(
+                {"user_ids": [f"Пользователи не найдены: {missing[:50]}"]}
+            )
+        missing = missing_templates(row["template_id"] for row in rows)
+        if missing:
+            raise serializers.ValidationError(
+                {"template_id": [f"Шаблоны не найдены: {missing[:50]}"]}
+            )
+
+        return {"rows": rows, "priority": attrs["priority"], "send_at": attrs["send_at"]}
+
+
+class NotificationListQuerySerializer(serializers.Serializer):
+    """
+    Параметры списка и выгрузки уведомлений (query string):
+    фильтры user, delivered, channel, status, created_after/created_before
+    и keyset-пагинация cursor + limit.
+    """
+
+    user = serializers.IntegerField(required=False, min_value=1)
+    delivered = serializers.BooleanField(required=False, allow_null=True, default=None)
+    channel = serializers.CharField(required=False, max_length=20)
+    status = serializers.ChoiceField(choices=DeliveryStatus.choices, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    cursor = serializers.IntegerField(required=False, min_value=1)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_limit(self, value: int) -> int:
+        _, maximum = page_size_limits()
+        return min(value, maximum)
+
+
+class DeadLetterReplaySerializer(serializers.Serializer):
+    """
+    Фильтры и параметры повтора dead letters (см. replay):
+    channel, error_class, dead_after/dead_before, rate, priority, reset_permanent.
+    """
+
+    channel = serializers.RegexField(r"^[a-z0-9_]+$", required=False, max_length=20)
+    error_class = serializers.CharField(required=False, max_length=64)
+    dead_after = serializers.DateTimeField(required=False)
+    dead_before = serializers.DateTimeField(required=False)
+    rate = serializers.FloatField(required=False, min_value=0)
+    priority = serializers.ChoiceField(choices=Priority.choices, required=False)
+    reset_permanent = serializers.BooleanField(default=False)
+
+    def filters(self) -> dict:
+        """Фильтры для replay.dead_letters; даты строками — так они переживут брокер."""
+        data = self.validated_data
+        filters = {name: data[name] for name in ("channel", "error_class") if data.get(name)}
+        for name in ("dead_after", "dead_before"):
+            if data.get(name) is not None:
+                filters[name] = data[name].isoformat()
+        return filters
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -28,9 +214,17 @@ class NotificationSerializer(serializers.ModelSerializer):
             "id",
             "user",
             "message",
+            "template",
+            "params",
             "delivered",
+            "status",
+            "priority",
             "delivery_method",
             "attempts",
             "created_at",
+            "send_at",
+            "dead_at",
+            "last_error_class",
+            "channel_state",
         )
 
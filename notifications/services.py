@@ -1,12 +1,40 @@
 from __future__ import annotations
 
 import logging
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Iterable, List, Optional, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Collection, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from . import metrics
+from .circuit import CircuitBreaker, get_breaker
+from .errors import DeliveryError
+from .templating import Message, content_for
 
 logger = logging.getLogger(__name__)
 
 
+# Стратегии доставки
+SEQUENTIAL = "sequential"  # по цепочке, следующий канал — только после неудачи
+HEDGED = "hedged"          # следующий канал стартует, если текущий молчит дольше hedge_delay
+BROADCAST = "broadcast"    # во все каналы сразу
+
+STRATEGIES = (SEQUENTIAL, HEDGED, BROADCAST)
+
+# Исходы по каналу
+DELIVERED = "delivered"
+FAILED = "failed"  # временный отказ, канал можно повторить
+REJECTED = "rejected"  # постоянный отказ (PermanentDeliveryError), повторять бессмысленно
+PENDING = "pending"  # hedged: канал ещё не ответил, когда другой уже доставил
+SKIPPED = "skipped"  # у пользователя нет контакта для канала
+CIRCUIT_OPEN = "circuit_open"  # канал разомкнут circuit breaker'ом
+
+
 class Sender(ABC):
     """
     Базовый интерфейс транспорта доставки.
@@ -14,39 +42,289 @@ class Sender(ABC):
     """
     name: str = "sender"
     priority: int = 100  # ниже — выше в цепочке
+    channel_bit: int = 0  # бит канала в маске контакта (contacts); 0 — спрашивать can_deliver
 
     @abstractmethod
     def deliver(self, user: object, message: str) -> bool:
-        """Пытается доставить сообщение. True при успехе, иначе False."""
+        """
+        Пытается доставить сообщение. True при успехе, иначе False
+        или DeliveryError с классификацией отказа (см. errors).
+        Параметры канала из шаблона (тема письма, parse_mode) приходят
+        именованными аргументами — только каналам, для которых они есть.
+        """
         raise NotImplementedError
 
+    def can_deliver(self, user: object) -> bool:
+        """Есть ли у пользователя контакт для этого канала (без сетевых вызовов)."""
+        return True
+
+
+@dataclass
+class DeliveryResult:
+    """
+    Итог попытки доставки.
+    method — первый канал, доставивший сообщение (по приоритету для broadcast);
+    outcomes — исход по каждому запущенному каналу;
+    errors — исключение отказа по каналам FAILED/REJECTED, если оно было.
+    """
+    method: Optional[str] = None
+    outcomes: Dict[str, str] = field(default_factory=dict)
+    errors: Dict[str, Exception] = field(default_factory=dict)
+
+    @property
+    def delivered(self) -> bool:
+        return self.method is not None
+
+    def fail(self, name: str, error: Optional[Exception]) -> None:
+        """Отмечает отказ канала: REJECTED для постоянного, иначе FAILED."""
+        permanent = isinstance(error, DeliveryError) and error.permanent
+        self.outcomes[name] = REJECTED if permanent else FAILED
+        if error is not None:
+            self.errors[name] = error
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Пул потоков процесса; после fork воркера Celery создаётся заново."""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(getattr(settings, "DELIVERY_MAX_WORKERS", 8)),
+                    thread_name_prefix="delivery",
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def _sender_name(sender: Sender) -> str:
+    return getattr(sender, "name", sender.__class__.__name__)
+
+
+def _eligible(sender: Sender, user: object) -> bool:
+    """
+    Есть ли у пользователя контакт для канала. У контакта с маской channels
+    (contacts.UserContact) это одна битовая проверка без вызова отправщика.
+    """
+    bit = getattr(sender, "channel_bit", 0)
+    mask = getattr(user, "channels", None)
+    if bit and mask is not None:
+        return bool(mask & bit)
+    can_deliver = getattr(sender, "can_deliver", None)
+    return can_deliver is None or can_deliver(user)
+
 
 class DeliveryChainManager:
     """
     Идёт по цепочке отправщиков (в порядке приоритета) и пытается доставить.
     Возвращает имя первого успешного отправщика или None.
+
+    Кроме последовательной цепочки есть параллельные стратегии:
+    - hedged: если канал не ответил за hedge_delay_sec, параллельно
+      запускается следующий; побеждает первый успешный. Медленный канал
+      может дослать сообщение и после победы другого — дубль возможен;
+    - broadcast: сообщение уходит во все каналы сразу, в outcomes — исход каждого.
+    Параллельные стратегии работают на общем пуле потоков процесса.
+
+    Маршрут считается один раз на доставку: каналы без контакта пользователя
+    (по маске контакта или can_deliver) сразу получают SKIPPED, стратегия
+    видит только остальные. Каналы с разомкнутым circuit breaker'ом
+    пропускаются без вызова, пока тот не пустит пробу.
+    Каналы из exclude (уже отказавшие навсегда или ждущие своего ретрая)
+    не вызываются и в outcomes не попадают.
+
+    Сообщение — текст или сообщение из шаблона (templating.TemplateMessage):
+    тогда каждый канал получает свой текст и аргументы deliver (тему и HTML
+    письма, parse_mode Telegram), отрендеренные при первом обращении к каналу.
     """
 
-    def __init__(self, senders: Iterable[Sender]) -> None:
+    def __init__(
+        self,
+        senders: Iterable[Sender],
+        strategy: str = SEQUENTIAL,
+        hedge_delay_sec: float = 2.0,
+        breakers: Optional[Mapping[str, CircuitBreaker]] = None,
+    ) -> None:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия доставки: {strategy}")
         self._senders: List[Sender] = sorted(
             list(senders),
             key=lambda s: getattr(s, "priority", 100),
         )
+        self.strategy = strategy
+        self.hedge_delay_sec = hedge_delay_sec
+        self._breakers: Dict[str, CircuitBreaker] = dict(breakers or {})
 
     @property
     def senders(self) -> Sequence[Sender]:
         return tuple(self._senders)
 
-    def try_deliver(self, user: object, message: str) -> Optional[str]:
+    def _circuit_open(self, sender: Sender) -> bool:
+        breaker = self._breakers.get(_sender_name(sender))
+        return breaker is not None and not breaker.allow()
+
+    def _call(
+        self, sender: Sender, user: object, message: Message,
+    ) -> Tuple[bool, Optional[Exception]]:
+        """Вызов канала: (доставлено ли, исключение отказа или None)."""
+        error: Optional[Exception] = None
+        started = time.perf_counter()
+        try:
+            # ошибка шаблона — PermanentDeliveryError, отказ этого канала
+            text, options = content_for(message, _sender_name(sender))
+            ok = bool(sender.deliver(user, text, **options))
+        except DeliveryError as exc:
+            logger.warning("Отказ доставки в %s: %s", _sender_name(sender), exc)
+            ok, error = False, exc
+        except Exception as exc:
+            logger.exception("Ошибка доставки в %s", _sender_name(sender))
+            ok, error = False, exc
+        permanent = isinstance(error, DeliveryError) and error.permanent
+        throttled = isinstance(error, DeliveryError) and error.throttled
+        metrics.observe_call(
+            _sender_name(sender),
+            time.perf_counter() - started,
+            DELIVERED if ok else REJECTED if permanent else FAILED,
+            error,
+        )
+        breaker = self._breakers.get(_sender_name(sender))
+        # свой лимит отправки — не сбой канала: запрос до него даже не дошёл
+        if breaker is not None and not throttled:
+            # постоянный отказ — проблема адресата, а не канала
+            breaker.record(ok or permanent)
+        return ok, error
+
+    def deliver(
+        self,
+        user: object,
+        message: Message,
+        strategy: Optional[str] = None,
+        exclude: Collection[str] = (),
+    ) -> DeliveryResult:
+        """Доставка по выбранной стратегии (по умолчанию — стратегия менеджера)."""
+        strategy = strategy or self.strategy
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия доставки: {strategy}")
+        result = DeliveryResult()
+        route = []
         for sender in self._senders:
-            try:
-                if sender.deliver(user, message):
-                    return sender.name
-            except Exception:
-                logger.exception(
-                    "Ошибка доставки в %s",
-                    getattr(sender, "name", sender.__class__.__name__),
-                )
+            name = _sender_name(sender)
+            if name in exclude:
+                continue
+            if _eligible(sender, user):
+                route.append(sender)
+            else:
+                result.outcomes[name] = SKIPPED
+        if strategy == HEDGED:
+            return self._deliver_hedged(route, user, message, result)
+        if strategy == BROADCAST:
+            return self._deliver_broadcast(route, user, message, result)
+        return self._deliver_sequential(route, user, message, result)
+
+    def first_channel(self, user: object) -> Optional[str]:
+        """Первый канал цепочки, для которого у пользователя есть контакт."""
+        for sender in self._senders:
+            if _eligible(sender, user):
+                return _sender_name(sender)
+        return None
+
+    def try_deliver(self, user: object, message: Message) -> Optional[str]:
+        return self.deliver(user, message).method
+
+    def _deliver_sequential(
+        self, senders: List[Sender], user: object, message: Message, result: DeliveryResult,
+    ) -> DeliveryResult:
+        for sender in senders:
+            name = _sender_name(sender)
+            if self._circuit_open(sender):
+                result.outcomes[name] = CIRCUIT_OPEN
+                continue
+            ok, error = self._call(sender, user, message)
+            if ok:
+                result.outcomes[name] = DELIVERED
+                result.method = name
+                break
+            result.fail(name, error)
+        return result
+
+    def _deliver_hedged(
+        self, senders: List[Sender], user: object, message: Message, result: DeliveryResult,
+    ) -> DeliveryResult:
+        queue = list(senders)
+        pending: Dict[Future, str] = {}
+        executor = _get_executor()
+
+        def launch() -> None:
+            # запускает следующий вызываемый канал, пропуская разомкнутые
+            while queue:
+                sender = queue.pop(0)
+                name = _sender_name(sender)
+                if self._circuit_open(sender):
+                    result.outcomes[name] = CIRCUIT_OPEN
+                    continue
+                pending[executor.submit(self._call, sender, user, message)] = name
+                result.outcomes[name] = PENDING
+                return
+
+        launch()
+        while pending:
+            done, _ = wait(
+                list(pending),
+                timeout=self.hedge_delay_sec if queue else None,
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                # канал молчит дольше hedge_delay — страхуемся следующим
+                launch()
+                continue
+            for fut in done:
+                name = pending.pop(fut)
+                ok, error = fut.result()
+                if ok:
+                    result.outcomes[name] = DELIVERED
+                    if result.method is None:
+                        result.method = name
+                else:
+                    result.fail(name, error)
+            if result.method is not None:
+                break
+            if queue:
+                launch()
+        return result
+
+    def _deliver_broadcast(
+        self, senders: List[Sender], user: object, message: Message, result: DeliveryResult,
+    ) -> DeliveryResult:
+        executor = _get_executor()
+        futures = []
+        for sender in senders:
+            name = _sender_name(sender)
+            if self._circuit_open(sender):
+                result.outcomes[name] = CIRCUIT_OPEN
+                continue
+            futures.append((name, executor.submit(self._call, sender, user, message)))
+        # порядок futures — порядок приоритета, поэтому method — лучший из успешных
+        for name, fut in futures:
+            ok, error = fut.result()
+            if not ok:
+                result.fail(name, error)
+                continue
+            result.outcomes[name] = DELIVERED
+            if result.method is None:
+                result.method = name
+        return result
+
+    def get_sender(self, name: str) -> Optional[Sender]:
+        """Отправщик цепочки по имени канала или None."""
+        for sender in self._senders:
+            if getattr(sender, "name", None) == name:
+                return sender
         return None
 
     def add_sender(self, sender: Sender) -> None:
@@ -61,6 +339,7 @@ _manager: Optional[DeliveryChainManager] = None
 def get_default_manager() -> DeliveryChainManager:
     """
     Email ставим раньше Telegram, но это можно переопределить через приоритеты.
+    Стратегия и задержка hedging — из DELIVERY_STRATEGY / DELIVERY_HEDGE_DELAY.
     """
     global _manager
     if _manager is None:
@@ -68,16 +347,25 @@ def get_default_manager() -> DeliveryChainManager:
         from .senders.telegram import TelegramSender
 
         # можно подключить SMS, Push и т.д., просто добавив сюда
+        senders = [
+            EmailSender(),     # priority по умолчанию у классов отправки
+            TelegramSender(),
+        ]
+        breakers = {}
+        for sender in senders:
+            breaker = get_breaker(sender.name)
+            if breaker is not None:
+                breakers[sender.name] = breaker
         _manager = DeliveryChainManager(
-            [
-                EmailSender(),     # priority по умолчанию у классов отправки
-                TelegramSender(),
-            ]
+            senders,
+            strategy=getattr(settings, "DELIVERY_STRATEGY", SEQUENTIAL),
+            hedge_delay_sec=float(getattr(settings, "DELIVERY_HEDGE_DELAY", 2.0)),
+            breakers=breakers,
         )
     return _manager
 
 
-def try_deliver(user: object, message: str) -> Optional[str]:
+def try_deliver(user: object, message: Message) -> Optional[str]:
     """
     Удобный фасад: попробует доставить через стандартный менеджер
     и вернёт имя канала-успешника или None.
@@ -1,52 +1,464 @@
 from __future__ import annotations
 
+import dataclasses
 import logging
-from typing import Optional
+import time
+from typing import Dict, Iterable, List, Optional
 
 from celery import shared_task
-from django.db import transaction
+from django.conf import settings
+from django.db.models import Case, F, JSONField, Value, When
+from django.utils import timezone
 
-from .models import Notification
-from .services import try_deliver
+from notif.celery import DEFAULT_QUEUE, PRIORITY_QUEUES
+
+from . import contacts, digest, metrics, retry, templating
+from .circuit import get_breaker
+from .errors import DeliveryError
+from .models import PENDING_STATUSES, DeliveryStatus, Notification, Priority
+from .services import SEQUENTIAL, DeliveryResult, get_default_manager
 
 logger = logging.getLogger(__name__)
 
 
+def queue_for(priority: Optional[int]) -> str:
+    """Очередь send_notification_task для приоритета уведомления."""
+    return PRIORITY_QUEUES.get(priority, DEFAULT_QUEUE)
+
+
+def enqueue_notification(notif_id: int, priority: Optional[int], *args) -> None:
+    """Ставит отправку уведомления в очередь его приоритета."""
+    send_notification_task.apply_async((notif_id, *args), queue=queue_for(priority))
+
+
+# поля строки, нужные задаче доставки, — приходят вместе с арендой (claim_fetch)
+_CLAIM_FIELDS = (
+    "user_id", "message", "template_id", "params", "channel_state", "created_at", "send_at",
+)
+# поля строки для текста сообщения (см. templating.messages_for)
+_MESSAGE_FIELDS = ("message", "template_id", "params")
+
+
+def _lease_sec() -> float:
+    # аренда должна переживать жёсткий лимит задачи, иначе её перехватят живой
+    return float(getattr(settings, "NOTIFICATION_LEASE_SEC", 120))
+
+
+def _release_failed(task, rows, token: str, exc: BaseException) -> None:
+    """
+    Снимает аренду после непредвиденной ошибки доставки: failed, пока у
+    autoretry остались попытки, иначе dead — ретраить строку больше некому,
+    а из dead её достанет повтор dead letters (см. replay).
+    """
+    if task.request.retries >= task.max_retries:
+        rows.release(token, DeliveryStatus.DEAD, last_error_class=type(exc).__name__)
+    else:
+        rows.release(token, DeliveryStatus.FAILED)
+
+
 @shared_task(
     bind=True,
     autoretry_for=(Exception,),
     retry_backoff=True,
     max_retries=3,
+    # итог — в строке Notification; без этого бэкенд результатов Redis делает
+    # SUBSCRIBE/UNSUBSCRIBE на каждую публикацию и SET на каждое выполнение
+    ignore_result=True,
 )
 def send_notification_task(
     self,
     notif_id: int,
     smtp_user: Optional[str] = None,
     smtp_password: Optional[str] = None,) -> None:
- 
-    with transaction.atomic():
-        notif = Notification.objects.select_for_update().get(pk=notif_id)
+    """
+    Доставка одного уведомления. Строка берётся в аренду условным UPDATE,
+    сеть — вне транзакции, итог — коротким UPDATE по токену аренды.
+    При DIGEST_ENABLED уведомления внутри окна пользователя копятся в сводку.
 
-        user = notif.user
-        if smtp_user:
-            user.smtp_user = smtp_user
-        if smtp_password:
-            user.smtp_password = smtp_password
+    Неудача не повторяет всю цепочку: ретрай планируется на ближайший срок
+    канала с временным отказом, и вызываются только каналы, чей срок
+    наступил (см. retry). autoretry остаётся для непредвиденных ошибок.
+    """
+    if self.request.retries == 0 and not (smtp_user or smtp_password) and digest.enabled():
+        row = (
+            Notification.objects.filter(pk=notif_id, status=DeliveryStatus.QUEUED)
+            .values_list("user_id", "priority")
+            .first()
+        )
+        # срочные не ждут окна сводки
+        if row is not None and row[1] != Priority.HIGH:
+            user_id = row[0]
+            outcome, due = digest.defer(user_id)
+            if outcome == digest.DEFERRED:
+                if digest.hold(notif_id, due):
+                    logger.info("Notification %s deferred to digest of user %s", notif_id, user_id)
+                return
+            if outcome == digest.OPENED:
+                flush_digest_task.apply_async((user_id, due), countdown=digest.window_sec())
+
+    started = time.perf_counter()
+    token, row = Notification.objects.claim_fetch(notif_id, _lease_sec(), _CLAIM_FIELDS)
+    metrics.CLAIM_SECONDS.observe(time.perf_counter() - started)
+    if token is None:
+        if not Notification.objects.filter(pk=notif_id).exists():
+            # строка ещё не видна (транзакция создателя не закоммичена) — ретрай
+            raise Notification.DoesNotExist(f"Notification {notif_id} not found")
+        logger.info("Notification %s already delivered or leased; skipping", notif_id)
+        return
 
-        method = try_deliver(user, notif.message)
-        notif.attempts += 1
+    notif = Notification(pk=notif_id, **row)
+    # контакт из кеша вместо JOIN с User на каждую попытку (см. contacts)
+    user = contacts.contact_for(notif.user_id)
+    if smtp_user or smtp_password:
+        # контакт из кеша общий — разовые креды только в копию
+        user = dataclasses.replace(user, smtp_user=smtp_user, smtp_password=smtp_password)
 
-        if method:
-            notif.delivered = True
-            notif.delivery_method = method
+    now = time.time()
+    state = notif.channel_state or {}
+    # eager-режим повторяет задачу сразу, без countdown, — там сроки каналов не ждём
+    exclude = retry.settled(state) if self.request.is_eager else retry.excluded(state, now)
+    try:
+        # текст из шаблона рендерится в цепочке — по каналу, при обращении к нему
+        message = templating.messages_for([notif])[0]
+        result = get_default_manager().deliver(user, message, exclude=exclude)
+    except BaseException as exc:
+        _release_failed(self, Notification.objects.filter(pk=notif_id), token, exc)
+        raise
 
-        notif.save(
-            update_fields=["delivered", "delivery_method", "attempts"],
+    state = retry.record(state, result, now)
+    countdown = None if result.delivered else retry.next_retry_in(state, now)
+    if result.delivered:
+        status = DeliveryStatus.DELIVERED
+    else:
+        status = DeliveryStatus.DEAD if countdown is None else DeliveryStatus.FAILED
+    if status == DeliveryStatus.DEAD:
+        extra = {"last_error_class": retry.last_error_class(state, result)}
+    else:
+        extra = {}
+    released = Notification.objects.filter(pk=notif_id).release(
+        token, status, delivery_method=result.method, channel_state=state, **extra,
+    )
+    if not released:
+        logger.warning("Notification %s: lease expired before result was saved", notif_id)
+    elif result.delivered:
+        ready_at = max(notif.created_at, notif.send_at or notif.created_at)
+        metrics.observe_lag(result.method, (timezone.now() - ready_at).total_seconds())
+
+    if status == DeliveryStatus.DEAD:
+        logger.warning("Notification %s not delivered: no channel left to retry", notif_id)
+    elif status == DeliveryStatus.FAILED:
+        logger.warning(
+            "Notification %s not delivered; retry in %.1fs", notif_id, countdown,
         )
+        # число ретраев ограничивают попытки каналов, а не max_retries задачи
+        raise self.retry(countdown=countdown, max_retries=None)
+
+
+@shared_task
+def recover_expired_leases_task(limit: int = 500) -> int:
+    """
+    Подбирает уведомления, чья аренда истекла (воркер упал посреди отправки):
+    возвращает их в queued и публикует через outbox. Сама задача ничего не
+    отправляет — доставка идёт обычной send_notification_task в очереди
+    приоритета уведомления, с ретраями по каналам и своей арендой.
+    Уведомление, взятое в аренду NOTIFICATION_MAX_ATTEMPTS раз, уходит в dead.
+    """
+    from .outbox import publish_now
+
+    ids, dead = Notification.objects.requeue_expired(
+        limit, int(getattr(settings, "NOTIFICATION_MAX_ATTEMPTS", 20)),
+    )
+    if ids:
+        publish_now(ids)
+        logger.info("Recovered %s notifications with expired leases", len(ids))
+    if dead:
+        logger.warning("%s notifications with expired leases moved to dead letters", dead)
+    return len(ids) + dead
+
+
+@shared_task
+def dispatch_scheduled_task(batch_size: Optional[int] = None, max_batches: int = 100) -> int:
+    """
+    Диспетчер отложенных уведомлений (beat раз в NOTIFICATION_DISPATCH_INTERVAL).
+    Берёт наступившие send_at пачками по частичному индексу и передаёт
+    outbox-релею, который ставит их в очереди приоритетов. В брокер попадает
+    только то, что пора отправлять, — память воркеров не зависит от числа
+    запланированных (в отличие от eta). Заодно сбрасывает опоздавшие сводки.
+    """
+    size = batch_size or int(getattr(settings, "NOTIFICATION_DISPATCH_BATCH", 1000))
+    total = 0
+    for _ in range(max_batches):
+        taken = Notification.objects.take_due(size)
+        total += taken
+        if taken < size:
+            break
+    if total:
+        logger.info("Dispatched %s scheduled notifications", total)
+
+    # сводки, чей сброс потерялся: окно в Redis не переживает сбоев, строки в БД — да
+    users, due = digest.sweep(size)
+    for user_id in users:
+        flush_digest_task.delay(user_id, due)
+    if users:
+        logger.warning("Digest sweep: flushing overdue digests of %s users", len(users))
+    return total
+
+
+@shared_task
+def relay_outbox_task() -> int:
+    """Публикует в брокер уведомления, помеченные dispatch_pending (см. outbox)."""
+    from .outbox import relay
+
+    return relay()
+
+
+@shared_task
+def replay_dead_letters_task(
+    filters: dict,
+    rate: Optional[float] = None,
+    priority: Optional[int] = None,
+    reset_permanent: bool = False,
+    after_id: int = 0,
+) -> int:
+    """
+    Повтор dead letters по фильтрам replay.dead_letters (channel, error_class,
+    dead_after, dead_before) с ограничением скорости — для API. Одна задача —
+    одна пачка после after_id; следующая ставится с countdown, за который
+    пачка укладывается в rate. Задача не спит и не упирается в
+    CELERY_TASK_TIME_LIMIT, сколько бы строк ни было в проходе.
+    """
+    from .replay import dead_letters, default_rate, replay_chunk
+
+    rate = default_rate() if rate is None else rate
+    replayed, last_id = replay_chunk(
+        dead_letters(**filters), after_id, priority=priority, reset_permanent=reset_permanent,
+    )
+    if replayed:
+        logger.info("Dead letters: %s replayed, last id %s", replayed, last_id)
+        replay_dead_letters_task.apply_async(
+            (filters,),
+            {"rate": rate, "priority": priority, "reset_permanent": reset_permanent, "after_id": last_id},
+            countdown=replayed / rate if rate else 0,
+        )
+    return replayed
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def flush_digest_task(user_id: int, due: Optional[float] = None) -> int:
+    """
+    Закрывает окно сводки: забирает строки пользователя со сроком сводки не
+    позже due (не больше DIGEST_MAX_ITEMS за раз) и отдаёт их на отправку
+    одной сводкой. Остаток — следующим сбросом. Строки, чей сброс так и не
+    прошёл, подберёт диспетчер (см. digest.sweep).
+    """
+    ids, left = digest.take(user_id, due, digest.max_items())
+    if ids:
+        send_digest_task.delay(user_id, ids)
+    if left:
+        flush_digest_task.delay(user_id, due)
+    return len(ids)
+
 
-        if not notif.delivered:
-            logger.warning(
-                "Notification %s not delivered; triggering retry", notif_id
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+)
+def send_digest_task(self, user_id: int, notif_ids: List[int]) -> int:
+    """
+    Одна сводка вместо пачки сообщений пользователю. Все строки сводки берутся
+    в аренду одним токеном и получают общий итог доставки.
+    """
+    token, claimed = Notification.objects.claim_many(notif_ids, _lease_sec())
+    if not claimed:
+        return 0
+    notifs = list(Notification.objects.filter(pk__in=claimed).order_by("id").only(*_MESSAGE_FIELDS))
+    rows = Notification.objects.filter(pk__in=claimed)
+
+    try:
+        messages = templating.messages_for(notifs)
+        # одно уведомление уходит как есть (с вариантами каналов шаблона),
+        # сводка — из текстов по умолчанию
+        message = messages[0] if len(messages) == 1 else digest.render(
+            [templating.text_of(m) for m in messages]
+        )
+        result = get_default_manager().deliver(contacts.contact_for(user_id), message)
+    except BaseException as exc:
+        _release_failed(self, rows, token, exc)
+        raise
+
+    if result.delivered:
+        rows.release(token, DeliveryStatus.DELIVERED, delivery_method=result.method)
+        logger.info("Digest of %s notifications delivered to user %s", len(claimed), user_id)
+        return len(claimed)
+
+    if self.request.retries >= self.max_retries:
+        # класс ошибки для фильтра dead letters — как у строк, закрытых ретраями каналов
+        state = retry.record({}, result, time.time())
+        rows.release(
+            token, DeliveryStatus.DEAD, last_error_class=retry.last_error_class(state, result),
+        )
+    else:
+        rows.release(token, DeliveryStatus.FAILED)
+    logger.warning("Digest for user %s not delivered; triggering retry", user_id)
+    raise RuntimeError("Отправка сводки не получилась, ретрай")
+
+
+@shared_task(ignore_result=True)
+def send_bulk_task(notif_ids: List[int]) -> int:
+    """
+    Массовые уведомления (Priority.BULK) от outbox-релея: вместо задачи на
+    строку — пакетные задачи канала (одна SMTP-сессия на пачку, конкурентный
+    Telegram). Канал строки — первый в цепочке, для которого у пользователя
+    есть контакт; недоставленные пачкой уходят в цепочку с fallback.
+    Строки с историей попыток (ретрай, повтор dead letters) и все строки при
+    непоследовательной стратегии цепочки — обычной send_notification_task.
+    """
+    rows = list(
+        Notification.objects.filter(pk__in=notif_ids, status__in=PENDING_STATUSES)
+        .order_by("id")
+        .values_list("id", "user_id", "channel_state")
+    )
+    manager = get_default_manager()
+    batchable = manager.strategy == SEQUENTIAL
+    users = contacts.get_contacts(user_id for _, user_id, state in rows if batchable and not state)
+    by_channel: dict = {}
+    single: List[int] = []
+    for notif_id, user_id, state in rows:
+        channel = None
+        if batchable and not state:
+            channel = manager.first_channel(users.get(user_id) or contacts.UserContact(user_id))
+        if channel in _BATCH_TASKS:
+            by_channel.setdefault(channel, []).append(notif_id)
+        else:
+            single.append(notif_id)
+    for channel, ids in by_channel.items():
+        enqueue_batches(channel, ids)
+    for notif_id in single:
+        enqueue_notification(notif_id, Priority.BULK)
+    return len(rows)
+
+
+def _deliver_batch(channel: str, notif_ids: List[int]) -> dict:
+    """
+    Пачка уведомлений через один канал (deliver_many отправщика).
+    Доставленные помечаются сразу; недоставленные (нет контакта, отказ)
+    уходят в обычную цепочку send_notification_task — с fallback. Отказ
+    пачкой записывается в channel_state строки, как попытка канала в цепочке:
+    цепочка не повторяет канал раньше его retry_at.
+    """
+    token, claimed = Notification.objects.claim_many(notif_ids, _lease_sec())
+    if not claimed:
+        return {"delivered": 0, "fallback": 0}
+    notifs = list(
+        Notification.objects.filter(pk__in=claimed).order_by("id").only(
+            "user_id", "priority", "channel_state", *_MESSAGE_FIELDS,
+        )
+    )
+    users = contacts.get_contacts(n.user_id for n in notifs)
+
+    sender = get_default_manager().get_sender(channel)
+    breaker = get_breaker(channel)
+    now = time.time()
+    results = [False] * len(notifs)
+    attempts: Dict[int, DeliveryResult] = {}
+    # без пакетной отправки или при разомкнутом канале — сразу в цепочку с fallback
+    if sender is not None and hasattr(sender, "deliver_many") and (breaker is None or breaker.allow()):
+        # шаблоны пачки берутся и компилируются один раз на всю рассылку
+        items, positions = [], []
+        for idx, (n, message) in enumerate(zip(notifs, templating.messages_for(notifs))):
+            # канал, закрытый для строки или ждущий её ретрая, оставляем цепочке
+            if channel in retry.excluded(n.channel_state or {}, now):
+                continue
+            attempt = attempts[idx] = DeliveryResult()
+            try:
+                text, options = templating.content_for(message, channel)
+            except DeliveryError as exc:
+                attempt.fail(channel, exc)
+                continue
+            items.append((users.get(n.user_id) or contacts.UserContact(n.user_id), text, options))
+            positions.append(idx)
+        sent = sender.deliver_many(items) if items else []
+        for idx, ok in zip(positions, sent):
+            results[idx] = bool(ok)
+            if not ok:
+                attempts[idx].fail(channel, None)
+            # исход каждого получателя: один отказ в пачке не размыкает канал,
+            # а сплошные отказы размыкают с той же долей, что и в цепочке
+            if breaker is not None:
+                breaker.record(bool(ok))
+
+    ok_ids = [n.id for n, ok in zip(notifs, results) if ok]
+    failed = [(idx, n) for idx, (n, ok) in enumerate(zip(notifs, results)) if not ok]
+
+    if ok_ids:
+        Notification.objects.filter(pk__in=ok_ids).release(
+            token, DeliveryStatus.DELIVERED, delivery_method=channel,
+        )
+    if failed:
+        states = {
+            n.id: retry.record(n.channel_state or {}, attempts[idx], now)
+            for idx, n in failed if idx in attempts
+        }
+        fields = {}
+        if states:
+            fields["channel_state"] = Case(
+                *(When(pk=pk, then=Value(state, output_field=JSONField())) for pk, state in states.items()),
+                default=F("channel_state"),
+                output_field=JSONField(),
             )
-            raise RuntimeError("Отправка не получилась, ретрай")
+        Notification.objects.filter(pk__in=[n.id for _, n in failed]).release(
+            token, DeliveryStatus.FAILED, **fields,
+        )
+
+    for _, notif in failed:
+        enqueue_notification(notif.id, notif.priority)
+
+    logger.info(
+        "%s batch: %s delivered, %s passed to fallback chain",
+        channel,
+        len(ok_ids),
+        len(failed),
+    )
+    return {"delivered": len(ok_ids), "fallback": len(failed)}
+
+
+@shared_task
+def send_email_batch_task(notif_ids: List[int]) -> dict:
+    """Пачка уведомлений по email через одну SMTP-сессию."""
+    return _deliver_batch("email", notif_ids)
+
+
+@shared_task
+def send_telegram_batch_task(notif_ids: List[int]) -> dict:
+    """Пачка уведомлений в Telegram: конкурентно при TELEGRAM_TRANSPORT=async."""
+    return _deliver_batch("telegram", notif_ids)
+
+
+_BATCH_TASKS = {
+    "email": (send_email_batch_task, "EMAIL_BATCH_SIZE", 200),
+    "telegram": (send_telegram_batch_task, "TELEGRAM_BATCH_SIZE", 500),
+}
+
 
+def enqueue_batches(
+    channel: str,
+    notif_ids: Iterable[int],
+    batch_size: Optional[int] = None,
+) -> int:
+    """Режет id на пачки по <CHANNEL>_BATCH_SIZE и ставит пакетную задачу канала."""
+    task, setting_name, default_size = _BATCH_TASKS[channel]
+    size = batch_size or int(getattr(settings, setting_name, default_size))
+    batch: List[int] = []
+    batches = 0
+    for notif_id in notif_ids:
+        batch.append(notif_id)
+        if len(batch) >= size:
+            task.delay(batch)
+            batches += 1
+            batch = []
+    if batch:
+        task.delay(batch)
+        batches += 1
+    return batches
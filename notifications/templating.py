@@ -0,0 +1,231 @@
+"""
+Шаблоны сообщений (NotificationTemplate). Уведомление из шаблона хранит
+шаблон и параметры (params), а не готовый текст — текст собирается при
+доставке, для каждого канала свой:
+
+- email: html_body — HTML-письмом, параметры экранируются; без него —
+  body текстом. Тема письма — subject;
+- telegram: telegram_body (или body) с telegram_parse_mode; для HTML
+  параметры экранируются, для MarkdownV2 их экранирует продюсер;
+- остальные каналы: body.
+
+Синтаксис — язык шаблонов Django без загрузчиков: {{ name }}, фильтры,
+{% if %}. Цепочка рендерит текст канала при первом обращении к каналу:
+каналы, до которых очередь не дошла, ничего не стоят.
+
+Скомпилированные шаблоны живут в LRU процесса (TEMPLATE_CACHE_SIZE):
+один шаблон компилируется в воркере один раз, а рассылка на тысячи строк
+только рендерит готовый объект. Пакетные задачи берут шаблоны всей пачки
+одним запросом (messages_for). Правка шаблона сбрасывает кеш своего
+процесса сразу, остальных — не позже TEMPLATE_CACHE_SEC.
+
+Ошибка шаблона — постоянный отказ канала (PermanentDeliveryError):
+повтор её не исправит. Параметр, который шаблон выводит через {{ }} без
+фильтра default и вне {% if %}, обязателен: без него вместо текста с
+пустым местом канал получает ту же ошибку.
+"""
+from __future__ import annotations
+
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple, Union
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.template import Context, Engine, Template, TemplateSyntaxError
+from django.template.base import VariableNode
+from django.template.defaulttags import ForNode, IfNode, WithNode
+
+from .errors import PermanentDeliveryError
+from .localcache import LocalCache
+from .models import NotificationTemplate, TelegramParseMode
+
+# Имена каналов (Sender.name), у которых в шаблоне свой вариант текста
+EMAIL = "email"
+TELEGRAM = "telegram"
+
+_engine = Engine()
+
+
+def compile_source(source: str) -> Template:
+    """Компилирует текст шаблона; TemplateSyntaxError при ошибке."""
+    return _engine.from_string(source)
+
+
+# с этими фильтрами отсутствующий параметр — норма
+_OPTIONAL_FILTERS = {"default", "default_if_none"}
+
+
+def required_params(template: Template) -> FrozenSet[str]:
+    """
+    Имена параметров, без которых шаблон вывел бы пустое место: корни
+    переменных {{ }} без фильтра default. Вывод внутри {% if %} и
+    переменные циклов и with не в счёт.
+    """
+    nodelist = template.nodelist
+    bound = {"forloop"}
+    for node in nodelist.get_nodes_by_type(ForNode):
+        bound.update(node.loopvars)
+    for node in nodelist.get_nodes_by_type(WithNode):
+        bound.update(node.extra_context)
+    guarded = {
+        id(node)
+        for if_node in nodelist.get_nodes_by_type(IfNode)
+        for node in if_node.nodelist.get_nodes_by_type(VariableNode)
+    }
+    names = set()
+    for node in nodelist.get_nodes_by_type(VariableNode):
+        expression = node.filter_expression
+        lookups = getattr(expression.var, "lookups", None)
+        if not lookups or id(node) in guarded:
+            continue
+        if any(func.__name__ in _OPTIONAL_FILTERS for func, _ in expression.filters):
+            continue
+        names.add(lookups[0])
+    return frozenset(names - bound)
+
+
+class CompiledTemplate:
+    """
+    Части шаблона и их скомпилированные версии. Часть компилируется при
+    первом рендере и дальше переиспользуется всеми уведомлениями шаблона.
+    """
+
+    def __init__(self, template: NotificationTemplate) -> None:
+        self.id = template.pk
+        self.parse_mode = template.telegram_parse_mode or None
+        self._sources = {
+            "subject": template.subject,
+            "body": template.body,
+            "html_body": template.html_body,
+            "telegram_body": template.telegram_body,
+        }
+        self._compiled: Dict[str, Tuple[Template, FrozenSet[str]]] = {}
+
+    def has(self, part: str) -> bool:
+        return bool(self._sources[part])
+
+    def render(self, part: str, params: Mapping, autoescape: bool = False) -> str:
+        compiled = self._compiled.get(part)
+        if compiled is None:
+            # гонка двух потоков безвредна: оба скомпилируют одно и то же
+            template = compile_source(self._sources[part])
+            compiled = self._compiled[part] = (template, required_params(template))
+        template, required = compiled
+        missing = required.difference(params)
+        if missing:
+            raise ValueError(f"нет параметров: {', '.join(sorted(missing))}")
+        return template.render(Context(params, autoescape=autoescape))
+
+    def for_channel(self, channel: str, params: Mapping) -> Tuple[str, dict]:
+        """Текст и именованные аргументы deliver отправщика канала."""
+        if channel == EMAIL:
+            options = {}
+            if self.has("subject"):
+                # перевод строки в заголовке письма недопустим
+                options["subject"] = " ".join(self.render("subject", params).split())
+            if self.has("html_body"):
+                options["html"] = True
+                return self.render("html_body", params, autoescape=True), options
+            return self.render("body", params), options
+        if channel == TELEGRAM:
+            part = "telegram_body" if self.has("telegram_body") else "body"
+            if self.parse_mode is None:
+                return self.render(part, params), {}
+            autoescape = self.parse_mode == TelegramParseMode.HTML
+            return self.render(part, params, autoescape=autoescape), {"parse_mode": self.parse_mode}
+        return self.render("body", params), {}
+
+
+class TemplateMessage:
+    """
+    Сообщение уведомления из шаблона. Цепочка спрашивает текст канала через
+    for_channel; каждый канал рендерится не больше одного раза.
+    """
+
+    __slots__ = ("template_id", "template", "params", "_rendered")
+
+    def __init__(
+        self, template_id: int, template: Optional[CompiledTemplate], params: Mapping,
+    ) -> None:
+        self.template_id = template_id
+        self.template = template
+        self.params = params
+        self._rendered: Dict[str, Tuple[str, dict]] = {}
+
+    def for_channel(self, channel: str) -> Tuple[str, dict]:
+        rendered = self._rendered.get(channel)
+        if rendered is not None:
+            return rendered
+        if self.template is None:
+            raise PermanentDeliveryError(f"Шаблон {self.template_id} не найден")
+        try:
+            rendered = self.template.for_channel(channel, self.params)
+        except Exception as exc:
+            raise PermanentDeliveryError(f"Шаблон {self.template_id}: {exc!r}") from exc
+        self._rendered[channel] = rendered
+        return rendered
+
+    def __repr__(self) -> str:
+        return f"<TemplateMessage template={self.template_id}>"
+
+
+Message = Union[str, TemplateMessage]
+
+
+def content_for(message: Message, channel: str) -> Tuple[str, dict]:
+    """Текст и аргументы deliver для канала; обычный текст — как есть, без аргументов."""
+    if isinstance(message, str):
+        return message, {}
+    return message.for_channel(channel)
+
+
+def text_of(message: Message) -> str:
+    """Текст без привязки к каналу (body) — для сводок."""
+    return content_for(message, "")[0]
+
+
+def _ttl() -> float:
+    return float(getattr(settings, "TEMPLATE_CACHE_SEC", 60))
+
+
+_cache: LocalCache[CompiledTemplate] = LocalCache(int(getattr(settings, "TEMPLATE_CACHE_SIZE", 1000)))
+
+
+def get_templates(template_ids: Iterable[int]) -> Dict[int, CompiledTemplate]:
+    """Шаблоны по id: из кеша процесса, промахи — одним SELECT. Удалённых в ответе нет."""
+    found: Dict[int, CompiledTemplate] = {}
+    missed = []
+    for template_id in dict.fromkeys(template_ids):
+        compiled = _cache.get(template_id)
+        if compiled is None:
+            missed.append(template_id)
+        else:
+            found[template_id] = compiled
+    if missed:
+        ttl = _ttl()
+        for template in NotificationTemplate.objects.filter(pk__in=missed):
+            compiled = CompiledTemplate(template)
+            if ttl > 0:
+                _cache.put(template.pk, compiled, ttl)
+            found[template.pk] = compiled
+    return found
+
+
+def messages_for(notifs: Iterable) -> List[Message]:
+    """
+    Сообщения строк Notification (нужны message, template_id и params) в том
+    же порядке. Шаблоны всей пачки берутся одним обращением к кешу и БД.
+    """
+    notifs = list(notifs)
+    templates = get_templates(n.template_id for n in notifs if n.template_id)
+    return [
+        TemplateMessage(n.template_id, templates.get(n.template_id), n.params or {})
+        if n.template_id
+        else n.message
+        for n in notifs
+    ]
+
+
+@receiver([post_save, post_delete], sender=NotificationTemplate, dispatch_uid="notifications.templating.changed")
+def _template_changed(sender, instance: NotificationTemplate, **kwargs) -> None:
+    _cache.discard(instance.pk)
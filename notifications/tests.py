@@ -1,2 +1,1825 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import os
+import smtplib
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from email.message import EmailMessage
+from unittest import mock
 
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from redis.exceptions import RedisError
+from rest_framework.renderers import JSONRenderer
+
+from . import (
+    bulk, circuit, contacts, digest, fastjson, ingest, metrics, outbox, replay, retry, services, tasks,
+    templating,
+)
+from .bench.harness import bench_manager, use_manager
+from .bench.servers import Behaviour, BotApiStub, SmtpSink, marker
+from .circuit import CircuitBreaker
+from .localcache import LocalCache
+from .errors import PermanentDeliveryError, ThrottledDeliveryError, TransientDeliveryError
+from .models import DeliveryStatus, Notification, NotificationTemplate, User
+from .ratelimit import TelegramRateLimiter
+from .senders import email as email_sender
+from .senders.email import SMTPConfig, SmtpConnectionPool, SmtpPoolConfig, smtp_error
+from .senders.registry import TransportRegistry
+from .senders.telegram import TelegramConfig, response_error
+from .senders.telegram_async import AsyncTelegramTransport, _LoopThread
+from .serializers import NotificationSerializer
+from .services import (
+    BROADCAST,
+    CIRCUIT_OPEN,
+    DELIVERED,
+    FAILED,
+    HEDGED,
+    PENDING,
+    REJECTED,
+    SKIPPED,
+    DeliveryChainManager,
+    DeliveryResult,
+)
+
+
+@override_settings(
+    DELIVERY_RETRY_BASE_SEC=10, DELIVERY_RETRY_MAX_SEC=600, DELIVERY_CHANNEL_MAX_ATTEMPTS=3,
+)
+class RetryTests(SimpleTestCase):
+    """Состояние ретраев по каналам (retry)."""
+
+    def test_backoff_grows_with_jitter_up_to_cap(self):
+        for attempts, full in ((1, 10), (2, 20), (4, 80), (20, 600)):
+            for _ in range(20):
+                delay = retry.backoff(attempts)
+                self.assertGreaterEqual(delay, full / 2)
+                self.assertLessEqual(delay, full)
+
+    def test_backoff_respects_retry_after(self):
+        self.assertEqual(retry.backoff(1, retry_after=30), 30)
+
+    def test_record_transient_failure_schedules_retry(self):
+        error = TransientDeliveryError("timeout", retry_after=42)
+        result = DeliveryResult(outcomes={"email": FAILED}, errors={"email": error})
+        state = retry.record({}, result, now=1000.0)
+
+        entry = state["email"]
+        self.assertEqual(entry["attempts"], 1)
+        self.assertEqual(entry["error_class"], "TransientDeliveryError")
+        self.assertGreaterEqual(entry["retry_at"], 1042.0)
+        self.assertNotIn("permanent", entry)
+
+    def test_record_does_not_mutate_input(self):
+        state = {"email": {"attempts": 1, "retry_at": 5.0}}
+        retry.record(state, DeliveryResult(outcomes={"email": FAILED}), now=10.0)
+        self.assertEqual(state, {"email": {"attempts": 1, "retry_at": 5.0}})
+
+    def test_record_rejected_closes_channel(self):
+        error = PermanentDeliveryError("blocked")
+        result = DeliveryResult(outcomes={"telegram": REJECTED}, errors={"telegram": error})
+        state = retry.record({"telegram": {"attempts": 1, "retry_at": 5.0}}, result, now=10.0)
+
+        self.assertTrue(state["telegram"]["permanent"])
+        self.assertNotIn("retry_at", state["telegram"])
+        self.assertEqual(retry.settled(state), {"telegram"})
+
+    def test_record_skipped_and_delivered(self):
+        result = DeliveryResult(method="email", outcomes={"sms": SKIPPED, "email": DELIVERED})
+        state = retry.record({}, result, now=10.0)
+
+        self.assertEqual(state["sms"]["error_class"], SKIPPED)
+        self.assertTrue(state["sms"]["permanent"])
+        self.assertNotIn("email", state)
+
+    def test_record_circuit_open_without_error_uses_outcome(self):
+        state = retry.record({}, DeliveryResult(outcomes={"email": CIRCUIT_OPEN}), now=10.0)
+        self.assertEqual(state["email"]["error_class"], CIRCUIT_OPEN)
+        self.assertIn("retry_at", state["email"])
+
+    def test_excluded_and_settled(self):
+        state = {
+            "email": {"attempts": 1, "retry_at": 100.0},
+            "sms": {"attempts": 3, "retry_at": 50.0},
+            "telegram": {"attempts": 1, "permanent": True},
+        }
+        self.assertEqual(retry.settled(state), {"sms", "telegram"})
+        self.assertEqual(retry.excluded(state, now=99.0), {"email", "sms", "telegram"})
+        self.assertEqual(retry.excluded(state, now=100.0), {"sms", "telegram"})
+
+    def test_next_retry_in(self):
+        state = {
+            "email": {"attempts": 1, "retry_at": 130.0},
+            "telegram": {"attempts": 1, "retry_at": 110.0},
+        }
+        self.assertEqual(retry.next_retry_in(state, now=100.0), 10.0)
+        # срок прошёл — повторять сразу, не в прошлое
+        self.assertEqual(retry.next_retry_in(state, now=200.0), 0.0)
+
+    def test_next_retry_in_none_when_all_closed(self):
+        state = {
+            "email": {"attempts": 3, "retry_at": 130.0},
+            "telegram": {"permanent": True},
+        }
+        self.assertIsNone(retry.next_retry_in(state, now=100.0))
+        self.assertIsNone(retry.next_retry_in({}, now=100.0))
+
+
+class ErrorClassificationTests(SimpleTestCase):
+    """Постоянный или временный отказ по ответу сервиса."""
+
+    def test_smtp_recipient_rejected_is_permanent(self):
+        exc = smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user")})
+        self.assertIsInstance(smtp_error(exc), PermanentDeliveryError)
+
+    def test_smtp_recipient_policy_is_transient(self):
+        # 554 на RCPT — обычно relay denied, то есть настройка сервера, а не адрес
+        exc = smtplib.SMTPRecipientsRefused({
+            "a@example.com": (550, b"no such user"),
+            "b@example.com": (554, b"relay access denied"),
+        })
+        self.assertIsInstance(smtp_error(exc), TransientDeliveryError)
+
+    def test_smtp_auth_and_sender_errors_are_transient(self):
+        for exc in (
+            smtplib.SMTPAuthenticationError(535, b"bad credentials"),
+            smtplib.SMTPSenderRefused(553, b"sender not allowed", "noreply@example.com"),
+            smtplib.SMTPDataError(554, b"rejected by policy"),
+            smtplib.SMTPServerDisconnected("gone"),
+            ConnectionRefusedError(),
+        ):
+            with self.subTest(exc=exc):
+                self.assertIsInstance(smtp_error(exc), TransientDeliveryError)
+
+    def test_telegram_bad_request_and_blocked_are_permanent(self):
+        for code in (400, 403):
+            error = response_error(code, {"description": "chat not found"}, "")
+            self.assertIsInstance(error, PermanentDeliveryError)
+            self.assertIn("chat not found", str(error))
+
+    def test_telegram_429_is_transient_with_retry_after(self):
+        error = response_error(429, {"parameters": {"retry_after": 7}}, "")
+        self.assertIsInstance(error, TransientDeliveryError)
+        self.assertEqual(error.retry_after, 7.0)
+
+    def test_telegram_5xx_is_transient(self):
+        error = response_error(502, None, "Bad Gateway")
+        self.assertIsInstance(error, TransientDeliveryError)
+        self.assertIsNone(error.retry_after)
+        self.assertIn("Bad Gateway", str(error))
+
+
+class FastJsonTests(TestCase):
+    """fastjson отдаёт те же байты, что JSONRenderer DRF, с orjson и без него."""
+
+    VALUES = {
+        "big": 2 ** 70,
+        "negative": -(2 ** 65),
+        "floats": [1e16, 1.5e300, 1e-7, 1e-5, 0.1, 100.0, 1760000000.25],
+        "text": "строка\u2028с разделителями\u2029 ✓",
+    }
+
+    def encoders(self):
+        yield
+        with mock.patch.object(fastjson, "orjson", None):
+            yield
+
+    def test_dumps_matches_renderer(self):
+        for _ in self.encoders():
+            for value in (self.VALUES, [self.VALUES], {"plain": [1, 2.5, "1e5"]}):
+                self.assertEqual(fastjson.dumps(value), JSONRenderer().render(value))
+
+    def test_notification_rows_match_serializer(self):
+        user = User.objects.create(email="json@example.com")
+        notif = Notification.objects.create(
+            user=user,
+            message="текст\u2029",
+            params=self.VALUES,
+            channel_state={"email": {"attempts": 1, "retry_at": 1760000000.125}},
+            send_at=timezone.now().replace(microsecond=123456),
+        )
+        qs = Notification.objects.filter(pk=notif.pk)
+        expected = JSONRenderer().render(NotificationSerializer(qs, many=True).data)
+        for _ in self.encoders():
+            rows = qs.values_list(*fastjson.NOTIFICATION_COLUMNS)
+            self.assertEqual(fastjson.dumps(fastjson.notification_dicts(rows)), expected)
+
+
+class SmtpPoolTests(SimpleTestCase):
+    """Пул SMTP-сессий на заменителе SMTP-сервера из bench."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.smtp = SmtpSink().start()
+        cls.cfg = SMTPConfig(host="127.0.0.1", port=cls.smtp.port, use_tls=False, user=None, timeout_sec=5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.smtp.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        patcher = mock.patch.object(email_sender, "_open_smtp", wraps=email_sender._open_smtp)
+        self.opened = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pool(self, **config):
+        pool = SmtpConnectionPool(SmtpPoolConfig(**{"noop_after_sec": 60, **config}))
+        self.addCleanup(pool.close_all)
+        return pool
+
+    def message(self, n):
+        msg = EmailMessage()
+        msg["From"], msg["To"], msg["Subject"] = "noreply@example.com", f"u{n}@example.com", "pool"
+        msg.set_content(f"{marker(n)} pool")
+        return msg
+
+    def idle(self, pool):
+        return [conn for bucket in pool._idle.values() for conn in bucket]
+
+    def test_session_is_reused(self):
+        pool = self.pool()
+        pool.send_message(self.cfg, self.message(300))
+        pool.send_message(self.cfg, self.message(301))
+        self.assertEqual(pool.send_many(self.cfg, [self.message(n) for n in (302, 303)]), [True, True])
+
+        self.assertEqual(self.opened.call_count, 1)
+        self.assertTrue({300, 301, 302, 303} <= set(self.smtp.recorder.received))
+
+    def test_session_reopened_after_max_messages(self):
+        pool = self.pool(max_messages=2)
+        self.assertEqual(pool.send_many(self.cfg, [self.message(n) for n in range(310, 315)]), [True] * 5)
+        self.assertEqual(self.opened.call_count, 3)
+
+    def test_reconnects_after_server_disconnect(self):
+        pool = self.pool()
+        pool.send_message(self.cfg, self.message(320))
+        # сессия в пуле оборвана: send_message получит SMTPServerDisconnected
+        self.idle(pool)[0].smtp.close()
+        pool.send_message(self.cfg, self.message(321))
+        self.idle(pool)[0].smtp.close()
+        self.assertEqual(pool.send_many(self.cfg, [self.message(322)]), [True])
+
+        self.assertEqual(self.opened.call_count, 3)
+        self.assertTrue({321, 322} <= set(self.smtp.recorder.received))
+
+    def test_dead_idle_session_fails_noop_and_is_replaced(self):
+        pool = self.pool(noop_after_sec=0)
+        pool.send_message(self.cfg, self.message(330))
+        dead = self.idle(pool)[0]
+        dead.smtp.close()
+
+        conn = pool.acquire(self.cfg)
+        self.assertIsNot(conn, dead)
+        pool.release(self.cfg, conn)
+        self.assertEqual(self.opened.call_count, 2)
+
+    def test_close_all_quits_idle_sessions(self):
+        pool = self.pool(max_idle_per_key=2)
+        first, second = pool.acquire(self.cfg), pool.acquire(self.cfg)
+        pool.release(self.cfg, first)
+        pool.release(self.cfg, second)
+        self.assertEqual(len(self.idle(pool)), 2)
+
+        pool.close_all()
+        self.assertEqual(self.idle(pool), [])
+        deadline = time.monotonic() + 2
+        while self.smtp._sessions and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.smtp._sessions)
+
+
+class FakeSender:
+    """Канал для тестов стратегий: ждёт release (если задан), затем отвечает."""
+
+    def __init__(self, name, priority, ok=True, error=None, release=None):
+        self.name, self.priority = name, priority
+        self.ok, self.error, self.release = ok, error, release
+        self.calls = 0
+        self.finished = threading.Event()
+
+    def deliver(self, user, text, **options):
+        self.calls += 1
+        try:
+            if self.release is not None:
+                self.release.wait(5)
+            if self.error is not None:
+                raise self.error
+            return self.ok
+        finally:
+            self.finished.set()
+
+
+class DeliveryStrategyTests(SimpleTestCase):
+    """Параллельные стратегии цепочки: hedged и broadcast."""
+
+    def deliver(self, senders, strategy, hedge_delay_sec=0.05):
+        manager = DeliveryChainManager(senders, strategy=strategy, hedge_delay_sec=hedge_delay_sec)
+        return manager.deliver(object(), "текст")
+
+    def test_hedged_starts_next_channel_after_delay_and_ignores_loser(self):
+        release = threading.Event()
+        slow = FakeSender("email", 10, release=release)
+        fast = FakeSender("telegram", 20)
+
+        result = self.deliver([slow, fast], HEDGED)
+        self.assertEqual(result.method, "telegram")
+        self.assertEqual(result.outcomes, {"email": PENDING, "telegram": DELIVERED})
+
+        # проигравший досылает уже после ответа — итог доставки не меняется
+        release.set()
+        self.assertTrue(slow.finished.wait(5))
+        self.assertEqual(result.outcomes["email"], PENDING)
+        self.assertEqual(result.method, "telegram")
+
+    def test_hedged_does_not_start_next_when_first_answers_in_time(self):
+        first, second = FakeSender("email", 10), FakeSender("telegram", 20)
+        result = self.deliver([first, second], HEDGED, hedge_delay_sec=5)
+
+        self.assertEqual(result.outcomes, {"email": DELIVERED})
+        self.assertEqual(second.calls, 0)
+
+    def test_hedged_failure_starts_next_without_waiting(self):
+        failing = FakeSender("email", 10, error=TransientDeliveryError("timeout"))
+        backup = FakeSender("telegram", 20)
+        started = time.monotonic()
+        with self.assertLogs("notifications.services", "WARNING"):
+            result = self.deliver([failing, backup], HEDGED, hedge_delay_sec=5)
+
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(result.method, "telegram")
+        self.assertEqual(result.outcomes, {"email": FAILED, "telegram": DELIVERED})
+        self.assertIsInstance(result.errors["email"], TransientDeliveryError)
+
+    def test_broadcast_aggregates_every_outcome(self):
+        release = threading.Event()
+        # лучший по приоритету канал отвечает последним — method всё равно он
+        best = FakeSender("email", 10, release=release)
+        rejected = FakeSender("telegram", 20, error=PermanentDeliveryError("blocked"))
+        failed = FakeSender("sms", 30, ok=False)
+        delivered = FakeSender("push", 40)
+        threading.Timer(0.05, release.set).start()
+
+        with self.assertLogs("notifications.services", "WARNING"):
+            result = self.deliver([delivered, failed, rejected, best], BROADCAST)
+
+        self.assertEqual(result.method, "email")
+        self.assertEqual(result.outcomes, {
+            "email": DELIVERED, "telegram": REJECTED, "sms": FAILED, "push": DELIVERED,
+        })
+        self.assertEqual(set(result.errors), {"telegram"})
+
+    def test_executor_is_recreated_after_fork(self):
+        executor = services._get_executor()
+        self.assertIs(services._get_executor(), executor)
+        self.addCleanup(setattr, services, "_executor_pid", services._executor_pid)
+        self.addCleanup(setattr, services, "_executor", executor)
+        with mock.patch.object(services.os, "getpid", return_value=services._executor_pid + 1):
+            forked = services._get_executor()
+        self.addCleanup(forked.shutdown)
+        self.assertIsNot(forked, executor)
+        self.assertEqual(services._executor_pid, services.os.getpid() + 1)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """Автомат circuit breaker: в Redis и в памяти процесса."""
+
+    def breaker(self, use_redis=True, **options):
+        options = {"failure_rate": 0.5, "min_calls": 4, "open_sec": 0.1, **options}
+        return CircuitBreaker(
+            "test", prefix=f"test-cb:{uuid.uuid4().hex}", use_redis=use_redis, **options,
+        )
+
+    def both(self, **options):
+        for use_redis in (True, False):
+            with self.subTest(redis=use_redis):
+                yield self.breaker(use_redis, **options)
+
+    def open(self, breaker):
+        with self.assertLogs("notifications.circuit", "WARNING"):
+            for ok in (True, True, False, False):
+                breaker.record(ok)
+
+    def test_opens_on_failure_rate_after_min_calls(self):
+        for breaker in self.both():
+            for ok in (False, False, True):
+                breaker.record(ok)
+            self.assertTrue(breaker.allow())
+            self.open(breaker)
+            self.assertFalse(breaker.allow())
+            self.assertEqual(breaker.state(), circuit.OPEN)
+
+    def test_half_open_lets_one_probe_and_success_closes(self):
+        for breaker in self.both():
+            self.open(breaker)
+            time.sleep(0.15)
+            self.assertEqual(breaker.state(), circuit.HALF_OPEN)
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+
+            breaker.record(True)
+            self.assertEqual(breaker.state(), circuit.CLOSED)
+            self.assertTrue(breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        for breaker in self.both():
+            self.open(breaker)
+            time.sleep(0.15)
+            self.assertTrue(breaker.allow())
+            breaker.record(False)
+            self.assertFalse(breaker.allow())
+            self.assertEqual(breaker.state(), circuit.OPEN)
+
+    def test_successes_are_written_in_batches(self):
+        breaker = self.breaker(min_calls=100, success_batch=50)
+        client = circuit.get_redis()
+        with mock.patch.object(client, "eval", wraps=client.eval) as evals:
+            for _ in range(10):
+                breaker.record(True)
+            # первый успех пишется сразу, остальные ждут корзину окна или неудачу
+            self.assertEqual(evals.call_count, 1)
+            breaker.record(False)
+
+        self.assertEqual(evals.call_count, 2)
+        self.assertEqual(evals.call_args.args[4:6], (9, 1))
+        windows = client.keys(f"{breaker._base}:w:*")
+        totals = [client.hmget(key, "total", "fail") for key in windows]
+        self.assertEqual(
+            (sum(int(t) for t, _ in totals), sum(int(f or 0) for _, f in totals)), (11, 1),
+        )
+
+    def test_falls_back_to_memory_when_redis_is_down(self):
+        broken = mock.Mock(**{"eval.side_effect": RedisError, "get.side_effect": RedisError})
+        breaker = self.breaker()
+        with mock.patch.object(circuit, "get_redis", return_value=broken), \
+                self.assertLogs("notifications.circuit", "WARNING") as logs:
+            for ok in (True, True, False, False):
+                breaker.record(ok)
+            self.assertFalse(breaker.allow())
+        self.assertIn("работает локально", logs.output[0])
+
+
+class TelegramThrottleTests(SimpleTestCase):
+    """Лимитер Bot API по ботам и его отказы для circuit breaker."""
+
+    def limiter(self):
+        return TelegramRateLimiter(
+            global_rate=1, global_burst=1, chat_rate=1, chat_burst=1,
+            max_wait_sec=0.05, use_redis=False,
+        )
+
+    def test_buckets_are_per_bot(self):
+        limiter = self.limiter()
+        self.assertEqual(limiter.reserve("1", bot="a"), 0.0)
+        self.assertGreater(limiter.reserve("2", bot="a"), 0.0)
+        self.assertEqual(limiter.reserve("2", bot="b"), 0.0)
+
+    def test_pause_is_per_bot(self):
+        limiter = self.limiter()
+        limiter.pause(30, bot="a")
+        self.assertGreater(limiter.reserve("1", bot="a"), 25)
+        self.assertTrue(limiter.acquire("1", bot="b"))
+        self.assertFalse(limiter.acquire("2", bot="a"))
+
+    def test_async_acquire_does_not_block_loop(self):
+        limiter = self.limiter()
+        threads = []
+
+        def reserve(chat_id, bot=""):
+            threads.append(threading.current_thread())
+            return 0.0
+
+        async def acquire():
+            with mock.patch.object(limiter, "reserve", side_effect=reserve):
+                return await limiter.aacquire("1", bot="a"), threading.current_thread()
+
+        acquired, loop_thread = asyncio.run(acquire())
+        self.assertTrue(acquired)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], loop_thread)
+
+    def test_throttling_does_not_open_circuit(self):
+        class Throttled:
+            name = "telegram"
+
+            def deliver(self, user, text, **options):
+                raise ThrottledDeliveryError("нет слота")
+
+        breaker = CircuitBreaker("telegram", min_calls=2, use_redis=False)
+        manager = DeliveryChainManager([Throttled()], breakers={"telegram": breaker})
+        with self.assertLogs("notifications.services", "WARNING"):
+            for _ in range(5):
+                ok, error = manager._call(Throttled(), object(), "текст")
+                self.assertFalse(ok)
+                self.assertIsInstance(error, TransientDeliveryError)
+        self.assertTrue(breaker.allow())
+
+
+class AsyncTelegramTransportTests(SimpleTestCase):
+    """Клиент httpx привязан к loop; при смене loop старый закрывается."""
+
+    def test_client_of_previous_loop_is_closed_in_that_loop(self):
+        transport = AsyncTelegramTransport(TelegramConfig(token="t"))
+
+        async def client():
+            return transport._ensure_client()
+
+        first = _LoopThread().run(client())
+        second = asyncio.run(client())
+        self.assertIsNot(first, second)
+
+        deadline = time.monotonic() + 2
+        while not first.is_closed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(first.is_closed)
+        self.assertFalse(second.is_closed)
+
+
+class TransportRegistryTests(SimpleTestCase):
+    """Вытеснение из реестра не закрывает объект, которым ещё пользуются."""
+
+    class Closable:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def test_evicted_idle_object_is_closed(self):
+        registry = TransportRegistry(maxsize=1)
+        with registry.lease("a", self.Closable) as first:
+            pass
+        with registry.lease("b", self.Closable):
+            self.assertTrue(first.closed)
+
+    def test_evicted_object_in_use_is_closed_after_last_release(self):
+        registry = TransportRegistry(maxsize=1)
+        with registry.lease("a", self.Closable) as first:
+            with registry.lease("a", self.Closable) as again:
+                self.assertIs(again, first)
+            with registry.lease("b", self.Closable):
+                pass
+            registry.clear()
+            self.assertFalse(first.closed)
+        self.assertTrue(first.closed)
+        self.assertEqual(len(registry), 0)
+
+
+class LeaseTests(TestCase):
+    """Аренда уведомлений (NotificationQuerySet)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="lease@example.com")
+
+    def _notif(self, **fields):
+        return Notification.objects.create(user=self.user, message="hi", **fields)
+
+    def _claim(self, notif):
+        return Notification.objects.claim_fetch(notif.pk, 60, ("id",))[0]
+
+    def _expire(self, notif):
+        Notification.objects.filter(pk=notif.pk).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1),
+        )
+
+    def test_claim_is_exclusive(self):
+        notif = self._notif()
+        token = self._claim(notif)
+
+        self.assertIsNotNone(token)
+        self.assertIsNone(self._claim(notif))
+        notif.refresh_from_db()
+        self.assertEqual(notif.status, DeliveryStatus.SENDING)
+        self.assertEqual(notif.attempts, 1)
+
+    def test_expired_lease_can_be_reclaimed_and_old_token_is_ignored(self):
+        notif = self._notif()
+        old = self._claim(notif)
+        self._expire(notif)
+        new = self._claim(notif)
+
+        self.assertIsNotNone(new)
+        self.assertEqual(
+            Notification.objects.filter(pk=notif.pk).release(old, DeliveryStatus.DELIVERED), 0,
+        )
+        self.assertEqual(
+            Notification.objects.filter(pk=notif.pk).release(new, DeliveryStatus.DELIVERED), 1,
+        )
+        notif.refresh_from_db()
+        self.assertTrue(notif.delivered)
+        self.assertIsNone(notif.lease_token)
+
+    def test_delivered_and_scheduled_are_not_claimable(self):
+        delivered = self._notif(status=DeliveryStatus.DELIVERED)
+        scheduled = self._notif(status=DeliveryStatus.SCHEDULED)
+        self.assertIsNone(self._claim(delivered))
+        self.assertIsNone(self._claim(scheduled))
+
+    def test_claim_fetch_returns_row(self):
+        notif = self._notif(channel_state={"email": {"attempts": 1}})
+        token, row = Notification.objects.claim_fetch(
+            notif.pk, 60, ("user_id", "message", "channel_state"),
+        )
+        self.assertIsNotNone(token)
+        self.assertEqual(
+            row, {"user_id": self.user.pk, "message": "hi", "channel_state": {"email": {"attempts": 1}}},
+        )
+        self.assertEqual(Notification.objects.claim_fetch(notif.pk, 60, ("message",)), (None, None))
+
+    def test_claim_many_skips_taken(self):
+        first, second = self._notif(), self._notif()
+        self._claim(first)
+
+        token, claimed = Notification.objects.claim_many([first.pk, second.pk], 60)
+        self.assertEqual(claimed, [second.pk])
+        self.assertEqual(
+            Notification.objects.filter(pk__in=claimed).release(token, DeliveryStatus.FAILED), 1,
+        )
+
+    def test_release_dead_marks_dead_at(self):
+        notif = self._notif()
+        token = self._claim(notif)
+        Notification.objects.filter(pk=notif.pk).release(
+            token, DeliveryStatus.DEAD, last_error_class="TransientDeliveryError",
+        )
+        notif.refresh_from_db()
+        self.assertEqual(notif.status, DeliveryStatus.DEAD)
+        self.assertIsNotNone(notif.dead_at)
+
+    def test_requeue_expired(self):
+        live, expired, poisoned = self._notif(), self._notif(), self._notif()
+        for notif in (live, expired, poisoned):
+            self._claim(notif)
+        self._expire(expired)
+        self._expire(poisoned)
+        Notification.objects.filter(pk=poisoned.pk).update(attempts=5)
+
+        ids, dead = Notification.objects.requeue_expired(10, max_attempts=5)
+
+        self.assertEqual((ids, dead), ([expired.pk], 1))
+        expired.refresh_from_db()
+        poisoned.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual(expired.status, DeliveryStatus.QUEUED)
+        self.assertTrue(expired.dispatch_pending)
+        self.assertIsNone(expired.lease_token)
+        self.assertEqual(poisoned.status, DeliveryStatus.DEAD)
+        self.assertEqual(live.status, DeliveryStatus.SENDING)
+
+
+class OutboxTests(TestCase):
+    """Публикация задач outbox (relay, publish_now)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="outbox@example.com")
+
+    def _pending(self, count, **fields):
+        return [
+            Notification.objects.create(
+                user=self.user, message="hi", dispatch_pending=True, **fields,
+            ).pk
+            for _ in range(count)
+        ]
+
+    @contextmanager
+    def _broker(self, side_effect=None):
+        with mock.patch.object(outbox.app, "producer_or_acquire") as producer, \
+                mock.patch.object(outbox.send_notification_task, "apply_async") as publish, \
+                mock.patch.object(outbox.send_bulk_task, "apply_async") as publish_bulk:
+            publish.side_effect = side_effect
+            publish.bulk = publish_bulk
+            yield publish
+        self.assertTrue(producer.called)
+
+    def _published(self, publish):
+        return [(c.args[0][0], c.kwargs["queue"]) for c in publish.call_args_list]
+
+    def test_relay_publishes_pending_to_priority_queue_and_clears_flag(self):
+        high = self._pending(1, priority=0)
+        normal = self._pending(1, priority=1)
+        Notification.objects.create(user=self.user, message="done")
+
+        with self._broker() as publish:
+            self.assertEqual(outbox.relay(size=1), 2)
+
+        self.assertEqual(
+            self._published(publish), [(high[0], "notif.high"), (normal[0], "notif.default")],
+        )
+        self.assertFalse(Notification.objects.filter(dispatch_pending=True).exists())
+
+    def test_relay_publishes_bulk_rows_as_one_task_per_batch(self):
+        normal = self._pending(1, priority=1)
+        bulk = self._pending(3, priority=2)
+
+        with self._broker() as publish:
+            self.assertEqual(outbox.relay(size=10), 4)
+
+        self.assertEqual(self._published(publish), [(normal[0], "notif.default")])
+        self.assertEqual([c.args[0] for c in publish.bulk.call_args_list], [(bulk,)])
+
+    @override_settings(BULK_BATCH_DELIVERY=False)
+    def test_relay_bulk_batches_can_be_disabled(self):
+        bulk = self._pending(2, priority=2)
+        with self._broker() as publish:
+            outbox.relay()
+        self.assertEqual(self._published(publish), [(pk, "notif.bulk") for pk in bulk])
+        self.assertFalse(publish.bulk.called)
+
+    def test_relay_keeps_flags_when_broker_is_down(self):
+        ids = self._pending(2)
+        with self._broker(side_effect=OperationalError("down")), \
+                self.assertLogs("notifications.outbox", "WARNING"):
+            self.assertEqual(outbox.relay(), 0)
+        self.assertEqual(
+            set(Notification.objects.filter(dispatch_pending=True).values_list("id", flat=True)),
+            set(ids),
+        )
+
+    @override_settings(OUTBOX_RELAY_BATCH=2)
+    def test_publish_now_only_given_ids(self):
+        ids = self._pending(5)
+        with self._broker() as publish:
+            self.assertEqual(outbox.publish_now(ids[:3]), 3)
+            # уже опубликованные повторно не уходят
+            self.assertEqual(outbox.publish_now(ids[:3]), 0)
+        self.assertEqual([pk for pk, _ in self._published(publish)], ids[:3])
+        self.assertEqual(
+            list(Notification.objects.filter(dispatch_pending=True).values_list("id", flat=True)),
+            ids[3:],
+        )
+
+    def test_publish_on_commit_waits_for_commit(self):
+        ids = self._pending(1)
+        with self._broker() as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                outbox.publish_on_commit(ids)
+                self.assertFalse(publish.called)
+        self.assertEqual(self._published(publish), [(ids[0], "notif.default")])
+
+
+class DirectSendTests(TestCase):
+    """Форма с разовыми SMTP-кредами: задача ставится сразу, релей — страховка."""
+
+    def setUp(self):
+        self.user = User.objects.create(email="direct@example.com")
+        self.form = {
+            "user_id": self.user.id, "message": "hi", "smtp_user": "me",
+            "idempotency_key": uuid.uuid4().hex,
+        }
+
+    def test_published_row_is_not_left_for_relay(self):
+        with mock.patch("notifications.views.enqueue_notification") as enqueue:
+            self.client.post("/send/", self.form)
+
+        notif = Notification.objects.get(user=self.user)
+        enqueue.assert_called_once_with(notif.id, notif.priority, "me", None)
+        self.assertFalse(notif.dispatch_pending)
+
+    def test_relay_between_create_and_publish_skips_row(self):
+        relayed = []
+
+        def relay_first(*args):
+            # релей успел пройти между коммитом строки и публикацией с кредами
+            with mock.patch.object(outbox.app, "producer_or_acquire"), \
+                    mock.patch.object(outbox.send_notification_task, "apply_async") as publish:
+                relayed.append(outbox.relay())
+            self.assertFalse(publish.called)
+
+        with mock.patch("notifications.views.enqueue_notification", side_effect=relay_first) as enqueue:
+            self.client.post("/send/", self.form)
+
+        self.assertEqual(relayed, [0])
+        self.assertEqual(enqueue.call_args.args[2:], ("me", None))
+
+    def test_broker_down_hands_row_to_relay(self):
+        with mock.patch(
+            "notifications.views.enqueue_notification", side_effect=OperationalError("down"),
+        ):
+            response = self.client.post("/send/", self.form, follow=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [m.level_tag for m in response.context["messages"]], ["warning"],
+        )
+        self.assertTrue(Notification.objects.get(user=self.user).dispatch_pending)
+
+        # повтор с тем же ключом строку не создаёт и задачу не ставит
+        with mock.patch("notifications.views.enqueue_notification") as enqueue:
+            self.client.post("/send/", self.form)
+        self.assertFalse(enqueue.called)
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 1)
+
+
+class BulkCreateTests(TestCase):
+    """Массовое создание: POST /api/notifications/bulk/ и insert_notifications."""
+
+    URL = "/api/notifications/bulk/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(email=f"bulk{i}@example.com") for i in range(3)]
+        cls.template = NotificationTemplate.objects.create(name="bulk", body="Привет, {{ name }}")
+
+    def post(self, payload):
+        return self.client.post(self.URL, payload, content_type="application/json")
+
+    def test_items_inserted_in_order_and_ids_returned(self):
+        Notification.objects.create(user=self.users[0], message="раньше")
+        items = [
+            {"user_id": self.users[2].id, "message": " первое "},
+            {"user_id": self.users[0].id, "template_id": self.template.id, "params": {"name": "A"}},
+            {"user_id": self.users[1].id, "message": "третье"},
+        ]
+        response = self.post({"items": items})
+
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual((body["status"], body["count"]), (DeliveryStatus.QUEUED, 3))
+        rows = list(
+            Notification.objects.filter(id__range=(body["first_id"], body["last_id"]))
+            .order_by("id")
+            .values_list("user_id", "message", "template_id", "priority", "dispatch_pending")
+        )
+        self.assertEqual(rows, [
+            (self.users[2].id, "первое", None, 2, True),
+            (self.users[0].id, "", self.template.id, 2, True),
+            (self.users[1].id, "третье", None, 2, True),
+        ])
+
+    def test_one_message_for_user_ids(self):
+        ids = [user.id for user in self.users]
+        response = self.post({"user_ids": ids, "message": "всем", "priority": 1})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            list(Notification.objects.order_by("id").values_list("user_id", "priority")),
+            [(pk, 1) for pk in ids],
+        )
+
+    def test_future_send_at_schedules_rows(self):
+        send_at = (timezone.now() + timedelta(hours=1)).isoformat()
+        response = self.post({"user_ids": [self.users[0].id], "message": "позже", "send_at": send_at})
+
+        self.assertEqual(response.json()["status"], DeliveryStatus.SCHEDULED)
+        notif = Notification.objects.get()
+        self.assertEqual(notif.status, DeliveryStatus.SCHEDULED)
+        self.assertFalse(notif.dispatch_pending)
+
+    def test_validation_errors(self):
+        user_id = self.users[0].id
+        for payload in (
+            {},
+            {"items": []},
+            {"items": [{"user_id": user_id, "message": "x"}], "message": "y"},
+            {"user_ids": [user_id]},
+            {"user_ids": [user_id], "message": "x", "template_id": self.template.id},
+            {"items": [{"user_id": user_id}]},
+        ):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.post(payload).status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_unknown_users_and_templates_are_listed(self):
+        response = self.post({"user_ids": [self.users[0].id, 999999], "message": "x"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("999999", response.json()["user_ids"][0])
+
+        response = self.post({"user_ids": [self.users[0].id], "template_id": 999999})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("999999", response.json()["template_id"][0])
+        self.assertFalse(Notification.objects.exists())
+
+    @override_settings(NOTIFICATIONS_BULK_MAX_ITEMS=2)
+    def test_size_limit(self):
+        response = self.post({"user_ids": [user.id for user in self.users], "message": "x"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_insert_returns_ids_of_this_batch_in_order(self):
+        # SQLite в Django 3.2 не отдаёт id из bulk_create — берутся последние N
+        Notification.objects.create(user=self.users[0], message="чужая")
+        objs = [Notification(user=self.users[i % 3], message=f"n{i}") for i in range(5)]
+        ids = bulk.insert_notifications(objs, batch_size=2)
+
+        self.assertEqual(
+            list(Notification.objects.filter(id__in=ids).order_by("id").values_list("message", flat=True)),
+            [f"n{i}" for i in range(5)],
+        )
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 5)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    """Микробатчер приёма: пачки по окну и по размеру, ошибки записи."""
+
+    def batcher(self, window=0.02, max_size=100, fail=False, after=None):
+        batches = []
+
+        async def write(items):
+            batches.append(list(items))
+            if fail:
+                raise RuntimeError("db down")
+            return [{"id": item["n"]} for item in items]
+
+        return ingest.MicroBatcher(write, window, max_size, after=after), batches
+
+    def test_requests_within_window_share_one_batch(self):
+        batcher, batches = self.batcher()
+
+        async def run():
+            return await asyncio.gather(
+                batcher.submit([{"n": 1}]), batcher.submit([{"n": 2}, {"n": 3}]),
+            )
+
+        self.assertEqual(asyncio.run(run()), [[{"id": 1}], [{"id": 2}, {"id": 3}]])
+        self.assertEqual(batches, [[{"n": 1}, {"n": 2}, {"n": 3}]])
+
+    def test_full_batch_does_not_wait_for_window(self):
+        batcher, batches = self.batcher(window=30, max_size=2)
+
+        async def run():
+            first = asyncio.ensure_future(batcher.submit([{"n": 1}]))
+            await asyncio.sleep(0)
+            second = await asyncio.wait_for(batcher.submit([{"n": 2}, {"n": 3}]), 2)
+            return await first, second
+
+        self.assertEqual(asyncio.run(run()), ([{"id": 1}], [{"id": 2}, {"id": 3}]))
+        self.assertEqual(batches, [[{"n": 1}, {"n": 2}], [{"n": 3}]])
+
+    def test_after_gets_batch_results(self):
+        published = []
+
+        async def after(results):
+            published.append(results)
+
+        batcher, _ = self.batcher(after=after)
+
+        async def run():
+            await batcher.submit([{"n": 1}])
+            await batcher.drain()
+
+        asyncio.run(run())
+        self.assertEqual(published, [[{"id": 1}]])
+
+    def test_write_error_reaches_every_request(self):
+        batcher, _ = self.batcher(fail=True)
+
+        async def run():
+            return await asyncio.gather(
+                batcher.submit([{"n": 1}]), batcher.submit([{"n": 2}]), return_exceptions=True,
+            )
+
+        with self.assertLogs("notifications.ingest", "ERROR"):
+            results = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+
+@override_settings(INGEST_PUBLISH=False, INGEST_BATCH_WINDOW_MS=1)
+class IngestTests(TestCase):
+    """Приём /api/ingest/: запись пачки, ответы handle и ASGI-приложение."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="ingest@example.com")
+        cls.template = NotificationTemplate.objects.create(name="ingest", body="{{ x }}")
+
+    def handle(self, payload):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        status, data = async_to_sync(ingest.handle)(body)
+        return status, json.loads(data)
+
+    def test_write_batch_reports_errors_per_item(self):
+        results = ingest.write_batch([
+            {"user_id": self.user.id, "message": " a ", "template_id": None, "params": {},
+             "priority": 1, "send_at": None},
+            {"user_id": 999999, "message": "b", "template_id": None, "params": {},
+             "priority": 1, "send_at": None},
+            {"user_id": self.user.id, "message": "", "template_id": 999999, "params": {},
+             "priority": 1, "send_at": None},
+        ])
+
+        notif = Notification.objects.get()
+        self.assertEqual(results[0], {"status": DeliveryStatus.QUEUED, "id": notif.id})
+        self.assertEqual(results[1]["field"], "user_id")
+        self.assertEqual(results[2]["field"], "template_id")
+        self.assertEqual((notif.message, notif.dispatch_pending), ("a", True))
+
+    def test_single_item_errors_use_failing_field(self):
+        status, data = self.handle({"user_id": self.user.id, "template_id": 999999})
+        self.assertEqual(status, 400)
+        self.assertEqual(list(data), ["template_id"])
+
+        status, data = self.handle({"user_id": 999999, "message": "x"})
+        self.assertEqual(status, 400)
+        self.assertEqual(list(data), ["user_id"])
+
+        status, data = self.handle(b"{")
+        self.assertEqual((status, list(data)), (400, ["detail"]))
+
+    def test_single_and_many(self):
+        status, data = self.handle({"user_id": self.user.id, "message": "x"})
+        self.assertEqual(status, 202)
+        self.assertEqual(Notification.objects.get(pk=data["id"]).message, "x")
+
+        status, data = self.handle({"items": [
+            {"user_id": self.user.id, "template_id": self.template.id, "params": {"x": 1}},
+            {"user_id": 999999, "message": "y"},
+        ]})
+        self.assertEqual(status, 202)
+        self.assertIn("id", data["results"][0])
+        self.assertEqual(data["results"][1]["field"], "user_id")
+
+    def call_asgi(self, method, body=b"", path="/api/ingest/"):
+        from notif import asgi
+
+        sent = []
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "headers": []}
+        async_to_sync(asgi.application)(scope, receive, send)
+        return sent
+
+    def test_asgi_app_serves_ingest(self):
+        body = json.dumps({"user_id": self.user.id, "message": "asgi"}).encode()
+        start, response = self.call_asgi("POST", body)
+        self.assertEqual(start["status"], 202)
+        self.assertEqual(Notification.objects.get(pk=json.loads(response["body"])["id"]).message, "asgi")
+
+        start, _ = self.call_asgi("GET")
+        self.assertEqual(start["status"], 405)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_asgi_app_rejects_large_body(self):
+        start, _ = self.call_asgi("POST", b"x" * 11)
+        self.assertEqual(start["status"], 413)
+
+    def test_other_paths_go_to_django(self):
+        from notif import asgi
+
+        with mock.patch.object(asgi, "django_application", new_callable=mock.AsyncMock) as django_app, \
+                mock.patch.object(asgi, "ingest_app", new_callable=mock.AsyncMock) as ingest_app:
+            self.call_asgi("POST", path="/api/notifications/")
+            self.call_asgi("POST", path="/api/ingest/")
+
+        self.assertEqual(django_app.call_count, 1)
+        self.assertEqual(ingest_app.call_count, 1)
+
+
+class BulkTaskTests(TestCase):
+    """Раскладка рассылки по пакетным задачам каналов (send_bulk_task)."""
+
+    def test_rows_grouped_by_first_channel_with_contact(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            email_user = User.objects.create(email="bulk@example.com")
+            tg_user = User.objects.create(telegram_id="101")
+        by_email = Notification.objects.create(user=email_user, message="a", priority=2)
+        by_tg = Notification.objects.create(user=tg_user, message="b", priority=2)
+        retried = Notification.objects.create(
+            user=email_user, message="c", priority=2, status=DeliveryStatus.FAILED,
+            channel_state={"email": {"attempts": 1, "retry_at": 0}},
+        )
+        delivered = Notification.objects.create(
+            user=email_user, message="d", priority=2, status=DeliveryStatus.DELIVERED,
+        )
+
+        with use_manager(bench_manager(1, "http://127.0.0.1:1")), \
+                mock.patch.object(tasks, "enqueue_batches") as batches, \
+                mock.patch.object(tasks, "enqueue_notification") as single:
+            taken = tasks.send_bulk_task([by_email.pk, by_tg.pk, retried.pk, delivered.pk])
+
+        self.assertEqual(taken, 3)
+        self.assertEqual(
+            sorted(c.args for c in batches.call_args_list),
+            [("email", [by_email.pk]), ("telegram", [by_tg.pk])],
+        )
+        single.assert_called_once_with(retried.pk, 2)
+
+
+@override_settings(CIRCUIT_BREAKER_ENABLED=False)
+class BatchDeliveryTests(TestCase):
+    """Пакетные задачи каналов на заменителях SMTP и Bot API из bench."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.smtp = SmtpSink().start()
+        cls.bot = BotApiStub().start()
+        cls.failing_bot = BotApiStub(Behaviour(error_rate=1.0, error_code=502)).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.smtp.stop()
+        cls.bot.stop()
+        cls.failing_bot.stop()
+        super().tearDownClass()
+
+    def _notifs(self, count, start, **contact):
+        ids = []
+        for i in range(start, start + count):
+            # контакт попадает в кеш после коммита — как у пользователя, созданного API
+            with self.captureOnCommitCallbacks(execute=True):
+                user = User.objects.create(**{k: v.format(i=i) for k, v in contact.items()})
+            ids.append(Notification.objects.create(
+                user=user, message=f"{marker(i)} batch", priority=2,
+            ).pk)
+        return ids
+
+    def test_email_batch_delivers_over_smtp(self):
+        ids = self._notifs(3, 100, email="u{i}@example.com")
+        with use_manager(bench_manager(self.smtp.port, self.bot.url)):
+            result = tasks.send_email_batch_task(ids)
+
+        self.assertEqual(result, {"delivered": 3, "fallback": 0})
+        self.assertTrue({100, 101, 102} <= set(self.smtp.recorder.received))
+        self.assertEqual(
+            set(Notification.objects.filter(pk__in=ids).values_list("status", "delivery_method")),
+            {(DeliveryStatus.DELIVERED, "email")},
+        )
+
+    def test_telegram_batch_delivers_to_bot_api(self):
+        ids = self._notifs(2, 200, telegram_id="{i}")
+        with use_manager(bench_manager(self.smtp.port, self.bot.url)):
+            result = tasks.send_telegram_batch_task(ids)
+
+        self.assertEqual(result, {"delivered": 2, "fallback": 0})
+        self.assertTrue({200, 201} <= set(self.bot.recorder.received))
+
+    def test_failed_batch_falls_back_to_chain(self):
+        ids = self._notifs(2, 300, telegram_id="{i}")
+        with use_manager(bench_manager(self.smtp.port, self.failing_bot.url)), \
+                mock.patch.object(tasks, "enqueue_notification") as enqueue, \
+                self.assertLogs("notifications.senders", "WARNING"):
+            result = tasks.send_telegram_batch_task(ids)
+
+        self.assertEqual(result, {"delivered": 0, "fallback": 2})
+        self.assertEqual(self.failing_bot.recorder.errors, 2)
+        self.assertEqual(sorted(c.args for c in enqueue.call_args_list), [(pk, 2) for pk in ids])
+        self.assertEqual(
+            set(Notification.objects.filter(pk__in=ids).values_list("status", flat=True)),
+            {DeliveryStatus.FAILED},
+        )
+        # попытка пачкой — в channel_state: цепочка не повторит telegram до retry_at
+        for state in Notification.objects.filter(pk__in=ids).values_list("channel_state", flat=True):
+            self.assertEqual(state["telegram"]["attempts"], 1)
+            self.assertIn("telegram", retry.excluded(state, time.time()))
+
+    def test_breaker_records_each_recipient(self):
+        ids = self._notifs(3, 400, telegram_id="{i}")
+        breaker = mock.Mock(**{"allow.return_value": True})
+        sender = mock.Mock(**{"deliver_many.return_value": [True, False, True]})
+        manager = mock.Mock(**{"get_sender.return_value": sender})
+        with mock.patch.object(tasks, "get_breaker", return_value=breaker), \
+                mock.patch.object(tasks, "get_default_manager", return_value=manager), \
+                mock.patch.object(tasks, "enqueue_notification"):
+            result = tasks.send_telegram_batch_task(ids)
+
+        self.assertEqual(result, {"delivered": 2, "fallback": 1})
+        self.assertEqual([c.args for c in breaker.record.call_args_list], [(True,), (False,), (True,)])
+
+    def test_channel_waiting_for_retry_is_left_to_chain(self):
+        ids = self._notifs(2, 500, telegram_id="{i}")
+        waiting = {"telegram": {"attempts": 1, "retry_at": time.time() + 600}}
+        Notification.objects.filter(pk=ids[0]).update(channel_state=waiting)
+        with use_manager(bench_manager(self.smtp.port, self.bot.url)), \
+                mock.patch.object(tasks, "enqueue_notification") as enqueue:
+            result = tasks.send_telegram_batch_task(ids)
+
+        self.assertEqual(result, {"delivered": 1, "fallback": 1})
+        self.assertEqual(enqueue.call_args.args, (ids[0], 2))
+        self.assertEqual(Notification.objects.get(pk=ids[0]).channel_state, waiting)
+
+
+class DigestTests(TestCase):
+    """Окно сводки в Redis, подбор опоздавших сбросов и текст сводки."""
+
+    def setUp(self):
+        self.user = User.objects.create(email="digest@example.com")
+
+    def test_first_notification_opens_window_and_rest_are_deferred(self):
+        user_id = uuid.uuid4().int >> 64
+        with override_settings(DIGEST_WINDOW_SEC=60):
+            opened, due = digest.defer(user_id)
+            deferred, same_due = digest.defer(user_id)
+
+        self.assertEqual((opened, deferred), (digest.OPENED, digest.DEFERRED))
+        self.assertEqual(due, same_due)
+        self.assertAlmostEqual(due, timezone.now().timestamp() + 60, delta=5)
+
+    def test_window_is_bypassed_when_redis_is_down(self):
+        broken = mock.Mock(**{"eval.side_effect": RedisError})
+        with mock.patch.object(digest, "get_redis", return_value=broken), \
+                self.assertLogs("notifications.digest", "WARNING"):
+            self.assertEqual(digest.defer(1), (digest.BYPASS, None))
+
+    def test_sweep_takes_only_overdue_rows_and_moves_their_due(self):
+        now = timezone.now()
+        overdue, fresh = (
+            Notification.objects.create(
+                user=self.user, message=text, status=DeliveryStatus.QUEUED, digest_due_at=due,
+            )
+            for text, due in (("old", now - timedelta(seconds=120)), ("new", now))
+        )
+        with override_settings(DIGEST_SWEEP_GRACE_SEC=60):
+            users, due = digest.sweep(10)
+            again, _ = digest.sweep(10)
+
+        self.assertEqual(users, {self.user.pk})
+        self.assertEqual(again, set())
+        overdue.refresh_from_db()
+        self.assertAlmostEqual(overdue.digest_due_at.timestamp(), due, places=3)
+        self.assertEqual(digest.take(self.user.pk, due, 10), ([overdue.pk, fresh.pk], False))
+
+    @override_settings(
+        DIGEST_TEMPLATE="{count}:\n{items}", DIGEST_ITEM_TEMPLATE="- {message}",
+        DIGEST_MORE_TEMPLATE="+{count}", DIGEST_MAX_CHARS=30,
+    )
+    def test_render_folds_items_over_limit(self):
+        text = digest.render(["aaaaaaaa", "bbbbbbbb", "cccccccc", "dddddddd"])
+        self.assertEqual(text, "4:\n- aaaaaaaa\n- bbbbbbbb\n+2")
+        self.assertLessEqual(len(text), 30)
+
+        long = digest.render(["x" * 100])
+        self.assertLessEqual(len(long), 30)
+        self.assertTrue(long.startswith("1:\n- xxx"))
+        self.assertIn("…", long)
+
+    def test_dead_digest_rows_get_error_class(self):
+        ids = [
+            Notification.objects.create(user=self.user, message=text, status=DeliveryStatus.QUEUED).pk
+            for text in ("a", "b")
+        ]
+        failing = FakeSender("email", 1, error=TransientDeliveryError("smtp down"))
+        with use_manager(DeliveryChainManager([failing])), \
+                self.assertLogs("notifications", "WARNING"):
+            tasks.send_digest_task.apply((self.user.pk, ids), retries=3)
+
+        self.assertEqual(
+            set(Notification.objects.filter(pk__in=ids).values_list("status", "last_error_class")),
+            {(DeliveryStatus.DEAD, "TransientDeliveryError")},
+        )
+
+
+class StatusBackfillMigrationTests(TestCase):
+    """Бэкфилл статуса в 0003: пачками по диапазонам id, только строки queued."""
+
+    migration = importlib.import_module("notifications.migrations.0003_notification_status")
+
+    def test_backfill_by_id_ranges(self):
+        user = User.objects.create(email="backfill@example.com")
+        rows = [
+            # (delivered, attempts, status до бэкфилла) -> ожидаемый статус
+            ((True, 1, "queued"), DeliveryStatus.DELIVERED),
+            ((False, 4, "queued"), DeliveryStatus.DEAD),
+            ((False, 1, "queued"), DeliveryStatus.QUEUED),
+            ((True, 1, "failed"), DeliveryStatus.FAILED),
+            ((False, 9, "queued"), DeliveryStatus.DEAD),
+        ]
+        ids = [
+            Notification.objects.create(
+                user=user, message="m", delivered=delivered, attempts=attempts, status=status,
+            ).pk
+            for (delivered, attempts, status), _ in rows
+        ]
+        # дыра в id: пустая пачка пропускается, а не обрывает бэкфилл
+        Notification.objects.filter(pk=ids[2]).delete()
+        del ids[2], rows[2]
+
+        with mock.patch.object(self.migration, "BACKFILL_BATCH", 2):
+            self.migration.backfill_status(apps, None)
+
+        self.assertEqual(
+            list(Notification.objects.filter(pk__in=ids).order_by("id").values_list("status", flat=True)),
+            [expected for _, expected in rows],
+        )
+
+
+class ListingTests(TestCase):
+    """Keyset-страницы списка уведомлений и потоковая выгрузка JSON Lines."""
+
+    URL = "/api/notifications/"
+
+    def setUp(self):
+        user = User.objects.create(email="listing@example.com")
+        self.ids = [
+            Notification.objects.create(user=user, message=f"m{i}").pk for i in range(5)
+        ]
+        # одно время создания у всех: порядок страниц держится только на id
+        Notification.objects.filter(pk__in=self.ids).update(created_at=timezone.now())
+
+    def test_cursor_walks_all_rows_once_newest_first(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            query = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            body = self.client.get(self.URL, query).json()
+            seen += [item["id"] for item in body["results"]]
+            pages += 1
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, sorted(self.ids, reverse=True))
+        self.assertEqual(pages, 3)
+
+    def test_invalid_cursor_and_limit(self):
+        for query in ({"cursor": "abc"}, {"cursor": 0}, {"limit": 0}):
+            with self.subTest(query=query):
+                response = self.client.get(self.URL, query)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(next(iter(query)), response.json())
+
+        with override_settings(NOTIFICATIONS_PAGE_MAX=2):
+            body = self.client.get(self.URL, {"limit": 50}).json()
+        self.assertEqual(len(body["results"]), 2)
+        self.assertEqual(body["next_cursor"], sorted(self.ids)[-2])
+
+    @override_settings(NOTIFICATIONS_EXPORT_CHUNK=2)
+    def test_export_streams_serializer_shaped_lines(self):
+        response = self.client.get(self.URL + "export/")
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 3)
+
+        lines = b"".join(chunks).decode().splitlines()
+        expected = [
+            json.loads(JSONRenderer().render(NotificationSerializer(n).data))
+            for n in Notification.objects.order_by("-id")
+        ]
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_filters_apply_to_pages_and_export(self):
+        Notification.objects.filter(pk=self.ids[1]).update(status=DeliveryStatus.DEAD)
+        body = self.client.get(self.URL, {"status": "dead"}).json()
+        self.assertEqual([item["id"] for item in body["results"]], [self.ids[1]])
+
+        export = b"".join(self.client.get(self.URL + "export/", {"status": "dead"}).streaming_content)
+        self.assertEqual([json.loads(line)["id"] for line in export.splitlines()], [self.ids[1]])
+
+
+class QueueRoutingTests(SimpleTestCase):
+    """Очереди приоритетов и каналов: куда Celery отправит задачу."""
+
+    def route(self, task_name, **options):
+        return tasks.send_notification_task.app.amqp.router.route(options, task_name)["queue"]
+
+    def test_priority_selects_queue(self):
+        for priority, queue in ((0, "notif.high"), (1, "notif.default"), (2, "notif.bulk"), (None, "notif.default")):
+            with self.subTest(priority=priority):
+                self.assertEqual(tasks.queue_for(priority), queue)
+                with mock.patch.object(tasks.send_notification_task, "apply_async") as publish:
+                    tasks.enqueue_notification(7, priority)
+                publish.assert_called_once_with((7,), queue=queue)
+
+    def test_channel_and_service_tasks_have_own_queues(self):
+        expected = {
+            "send_email_batch_task": "notif.email",
+            "send_telegram_batch_task": "notif.telegram",
+            "send_bulk_task": "notif.bulk",
+            "send_digest_task": "notif.bulk",
+            "relay_outbox_task": "notif.high",
+            "send_notification_task": "notif.default",
+        }
+        for task, queue in expected.items():
+            with self.subTest(task=task):
+                self.assertEqual(self.route(f"notifications.tasks.{task}").name, queue)
+
+    def test_each_queue_is_bound_to_its_own_routing_key(self):
+        for queue_name in ("notif.high", "notif.default", "notif.bulk", "notif.email", "notif.telegram"):
+            with self.subTest(queue=queue_name):
+                queue = self.route("notifications.tasks.send_notification_task", queue=queue_name)
+                self.assertEqual(
+                    (queue.name, queue.exchange.name, queue.routing_key), (queue_name,) * 3,
+                )
+
+    def test_batches_are_cut_by_channel_batch_size(self):
+        with override_settings(EMAIL_BATCH_SIZE=2), \
+                mock.patch.object(tasks.send_email_batch_task, "delay") as delay:
+            self.assertEqual(tasks.enqueue_batches("email", range(5)), 3)
+        self.assertEqual([c.args[0] for c in delay.call_args_list], [[0, 1], [2, 3], [4]])
+
+
+class ScheduledDispatchTests(TestCase):
+    """Диспетчер отложенных: только наступившие send_at, пачками."""
+
+    def setUp(self):
+        self.user = User.objects.create(email="scheduled@example.com")
+        now = timezone.now()
+        self.due = [
+            self._scheduled(now - timedelta(minutes=minutes)).pk for minutes in (3, 2, 1)
+        ]
+        self.future = self._scheduled(now + timedelta(hours=1)).pk
+        # send_at в прошлом, но строка уже в очереди — не трогаем
+        self.queued = Notification.objects.create(
+            user=self.user, message="q", send_at=now - timedelta(minutes=5),
+        ).pk
+
+    def _scheduled(self, send_at):
+        return Notification.objects.create(
+            user=self.user, message="s", status=DeliveryStatus.SCHEDULED, send_at=send_at,
+        )
+
+    def _statuses(self):
+        return dict(Notification.objects.values_list("id", "status"))
+
+    def test_take_due_respects_batch_size_and_send_at_order(self):
+        self.assertEqual(Notification.objects.take_due(2), 2)
+        taken = Notification.objects.filter(dispatch_pending=True).values_list("id", flat=True)
+        self.assertEqual(sorted(taken), self.due[:2])
+
+        self.assertEqual(Notification.objects.take_due(2), 1)
+        self.assertEqual(Notification.objects.take_due(2), 0)
+
+        statuses = self._statuses()
+        self.assertEqual({statuses[pk] for pk in self.due}, {DeliveryStatus.QUEUED})
+        self.assertEqual(statuses[self.future], DeliveryStatus.SCHEDULED)
+        self.assertFalse(Notification.objects.get(pk=self.queued).dispatch_pending)
+
+    def test_take_due_skips_locked_rows(self):
+        with mock.patch.object(
+            QuerySet, "select_for_update", autospec=True, side_effect=QuerySet.select_for_update,
+        ) as lock:
+            Notification.objects.take_due(10)
+        self.assertTrue(lock.call_args.kwargs["skip_locked"])
+
+    def test_dispatcher_takes_batches_until_short_one(self):
+        with mock.patch.object(Notification.objects, "take_due", wraps=Notification.objects.take_due) as take:
+            self.assertEqual(tasks.dispatch_scheduled_task(batch_size=2), 3)
+        self.assertEqual(take.call_count, 2)
+
+
+@unittest.skipUnless(
+    connection.features.has_select_for_update_skip_locked, "нужна БД с SKIP LOCKED",
+)
+class ScheduledDispatchConcurrencyTests(TransactionTestCase):
+    """Два диспетчера не берут одни и те же строки и не ждут друг друга."""
+
+    def test_rows_locked_by_another_dispatcher_are_skipped(self):
+        user = User.objects.create(email="locked@example.com")
+        past = timezone.now() - timedelta(minutes=1)
+        ids = [
+            Notification.objects.create(
+                user=user, message="s", status=DeliveryStatus.SCHEDULED, send_at=past,
+            ).pk
+            for _ in range(4)
+        ]
+        locked, release = threading.Event(), threading.Event()
+
+        def other_dispatcher():
+            try:
+                with transaction.atomic():
+                    list(Notification.objects.filter(pk__in=ids[:2]).select_for_update())
+                    locked.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_dispatcher)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(5))
+            self.assertEqual(Notification.objects.take_due(10), 2)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(
+            sorted(Notification.objects.filter(status=DeliveryStatus.QUEUED).values_list("id", flat=True)),
+            ids[2:],
+        )
+
+
+class DeadLetterReplayTests(TestCase):
+    """Выборка dead letters по фильтрам и их возврат в очередь."""
+
+    def setUp(self):
+        self.user = User.objects.create(email="dead@example.com")
+        self.now = timezone.now()
+
+    def _dead(self, state=None, error_class=None, dead_at=None):
+        return Notification.objects.create(
+            user=self.user, message="d", status=DeliveryStatus.DEAD,
+            channel_state=state or {}, last_error_class=error_class, dead_at=dead_at or self.now,
+        ).pk
+
+    def _ids(self, qs):
+        return sorted(qs.values_list("id", flat=True))
+
+    def test_channel_and_error_class_filters(self):
+        email = self._dead(
+            {"email": {"attempts": 4, "error_class": "TransientDeliveryError"}}, "TransientDeliveryError",
+        )
+        telegram = self._dead(
+            {"telegram": {"attempts": 1, "permanent": True, "error_class": "PermanentDeliveryError"},
+             "email": {"permanent": True, "error_class": "skipped"}},
+            "PermanentDeliveryError",
+        )
+        Notification.objects.create(user=self.user, message="q", channel_state={"email": {"attempts": 1}})
+
+        # канал без попыток (пропущен без контакта) не считается отказавшим
+        self.assertEqual(self._ids(replay.dead_letters(channel="email")), [email])
+        self.assertEqual(
+            self._ids(replay.dead_letters(channel="telegram", error_class="PermanentDeliveryError")),
+            [telegram],
+        )
+        self.assertEqual(self._ids(replay.dead_letters(channel="telegram", error_class="Other")), [])
+        self.assertEqual(self._ids(replay.dead_letters(error_class="TransientDeliveryError")), [email])
+
+    def test_since_and_until_accept_iso_strings(self):
+        ids = [self._dead(dead_at=self.now - timedelta(hours=hours)) for hours in (3, 2, 1)]
+        since = (self.now - timedelta(hours=2, minutes=30)).isoformat()
+        until = (self.now - timedelta(hours=1, minutes=30)).isoformat()
+        self.assertEqual(self._ids(replay.dead_letters(dead_after=since, dead_before=until)), [ids[1]])
+
+        # без зоны — в зоне проекта
+        naive = timezone.localtime(self.now - timedelta(hours=1, minutes=30)).replace(tzinfo=None)
+        self.assertEqual(self._ids(replay.dead_letters(dead_after=naive.isoformat())), [ids[2]])
+
+        with self.assertRaises(ValueError):
+            replay.dead_letters(dead_after="вчера")
+        with self.assertRaises(CommandError):
+            call_command("replay_dead_letters", "--since", "вчера", "--dry-run")
+
+    def test_replay_keeps_permanent_failures_unless_reset(self):
+        state = {
+            "email": {"attempts": 4, "error_class": "TransientDeliveryError"},
+            "telegram": {"attempts": 1, "permanent": True, "error_class": "PermanentDeliveryError"},
+        }
+        kept, reset = self._dead(state, "TransientDeliveryError"), self._dead(state)
+
+        replay.replay_chunk(Notification.objects.filter(pk=kept))
+        replay.replay_chunk(Notification.objects.filter(pk=reset), reset_permanent=True)
+
+        rows = {
+            row[0]: row[1:]
+            for row in Notification.objects.values_list(
+                "id", "status", "dispatch_pending", "dead_at", "last_error_class", "channel_state",
+            )
+        }
+        self.assertEqual(rows[kept], (DeliveryStatus.QUEUED, True, None, None, {"telegram": state["telegram"]}))
+        self.assertEqual(rows[reset], (DeliveryStatus.QUEUED, True, None, None, {}))
+
+    @override_settings(DEAD_LETTER_REPLAY_CHUNK=2)
+    def test_task_replays_one_chunk_and_schedules_next(self):
+        ids = [self._dead() for _ in range(3)]
+        filters = {"dead_before": (self.now + timedelta(minutes=1)).isoformat()}
+        with mock.patch.object(tasks.replay_dead_letters_task, "apply_async") as schedule:
+            self.assertEqual(tasks.replay_dead_letters_task(filters, rate=4, priority=2), 2)
+            self.assertEqual(schedule.call_args.args[1]["after_id"], ids[1])
+            self.assertEqual(schedule.call_args.kwargs["countdown"], 0.5)
+
+            self.assertEqual(tasks.replay_dead_letters_task(**{"filters": filters, **schedule.call_args.args[1]}), 1)
+            self.assertEqual(schedule.call_count, 2)
+            self.assertEqual(tasks.replay_dead_letters_task(filters, after_id=ids[2]), 0)
+            self.assertEqual(schedule.call_count, 2)
+
+        self.assertEqual(
+            set(Notification.objects.filter(pk__in=ids).values_list("status", "priority")),
+            {(DeliveryStatus.QUEUED, 2)},
+        )
+
+    def test_command_dry_run_only_counts(self):
+        self._dead({"email": {"attempts": 4}})
+        out = io.StringIO()
+        call_command("replay_dead_letters", "--channel", "email", "--dry-run", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Подходит: 1")
+        self.assertEqual(Notification.objects.get().status, DeliveryStatus.DEAD)
+
+
+@unittest.skipIf(metrics.prometheus_client is None, "prometheus_client не установлен")
+class MetricsTests(SimpleTestCase):
+    """GET /metrics: метрики процесса или сумма по процессам из каталога."""
+
+    def test_scrape_returns_delivery_metrics(self):
+        metrics.observe_call("email", 0.02, DELIVERED, None)
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('notif_sender_outcomes_total{channel="email",error_class="",outcome="delivered"}', body)
+        self.assertIn('notif_sender_latency_seconds_bucket{channel="email",le="0.025"}', body)
+        self.assertEqual(self.client.post("/metrics").status_code, 405)
+
+    def test_multiprocess_dir_switches_to_collector_registry(self):
+        metrics.observe_call("email", 0.02, DELIVERED, None)
+        with tempfile.TemporaryDirectory() as path, \
+                mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": path}), \
+                mock.patch.object(
+                    metrics.multiprocess, "MultiProcessCollector",
+                    wraps=metrics.multiprocess.MultiProcessCollector,
+                ) as collector:
+            data, _ = metrics.render()
+
+        registry = collector.call_args.args[0]
+        self.assertIsNot(registry, metrics.prometheus_client.REGISTRY)
+        # каталог пуст: значения этого процесса в выдачу не попадают
+        self.assertNotIn(b"notif_sender_outcomes_total", data)
+
+
+class ContactRoutingTests(TestCase):
+    """Маска каналов контакта: цепочка отбрасывает каналы без контакта по биту."""
+
+    class BitSender(FakeSender):
+        def __init__(self, name, priority, bit):
+            super().__init__(name, priority)
+            self.channel_bit = bit
+
+        def can_deliver(self, user):
+            raise AssertionError("при маске контакта can_deliver не вызывается")
+
+    def setUp(self):
+        self.user = User.objects.create(email="bits@example.com", telegram_id="42")
+        contacts.invalidate([self.user.pk])
+        self.addCleanup(contacts.invalidate, [self.user.pk])
+
+    def test_mask_and_round_trip(self):
+        contact = contacts.get_contact(self.user.pk)
+        self.assertEqual(contact.channels, contacts.EMAIL | contacts.TELEGRAM)
+        raw = contact.dumps()
+        self.assertEqual(contacts.UserContact.loads(self.user.pk, raw.encode()), contact)
+
+    def test_chain_skips_channels_missing_from_mask(self):
+        sms = self.BitSender("sms", 1, contacts.SMS)
+        email = self.BitSender("email", 2, contacts.EMAIL)
+        result = DeliveryChainManager([sms, email]).deliver(contacts.contact_for(self.user.pk), "hi")
+
+        self.assertEqual(result.outcomes, {"sms": SKIPPED, "email": DELIVERED})
+        self.assertEqual((sms.calls, email.calls), (0, 1))
+
+    def test_mask_follows_update_and_delete(self):
+        self.assertTrue(contacts.get_contact(self.user.pk).channels & contacts.TELEGRAM)
+
+        self.user.telegram_id = ""
+        self.user.phone = "+70000000000"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(contacts.get_contact(self.user.pk).channels, contacts.EMAIL | contacts.SMS)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertIsNone(contacts.get_contact(self.user.pk))
+        self.assertEqual(contacts.contact_for(self.user.pk).channels, 0)
+
+
+class ContactCacheTests(TestCase):
+    """Контакты: память процесса, затем один MGET в Redis, затем один SELECT."""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users = [User.objects.create(email=f"c{i}@example.com") for i in range(3)]
+        self.ids = [user.pk for user in self.users]
+        self.addCleanup(contacts.invalidate, self.ids)
+
+    def lookups(self):
+        return mock.patch.object(contacts, "_count", wraps=contacts._count)
+
+    def sources(self, count):
+        # то же, что уйдёт в notif_contact_lookups_total{result}
+        return {c.args[0]: c.args[1] for c in count.call_args_list if c.args[1]}
+
+    def test_new_user_is_written_through_to_both_tiers(self):
+        with self.lookups() as count, self.assertNumQueries(0):
+            found = contacts.get_contacts(self.ids)
+        self.assertEqual([found[pk].email for pk in self.ids], [u.email for u in self.users])
+        self.assertEqual(self.sources(count), {"local": 3})
+
+    def test_fallback_order_local_redis_db(self):
+        contacts._local.discard(self.ids[0])
+        contacts._local.discard(self.ids[1])
+        contacts.get_redis().delete(contacts._redis_key(self.ids[1]))
+
+        client = contacts.get_redis()
+        with self.lookups() as count, \
+                mock.patch.object(client, "mget", wraps=client.mget) as mget, \
+                self.assertNumQueries(1):
+            found = contacts.get_contacts(self.ids)
+
+        self.assertEqual(set(found), set(self.ids))
+        self.assertEqual(self.sources(count), {"local": 1, "redis": 1, "db": 1})
+        # один MGET только по тем, кого нет в памяти процесса
+        mget.assert_called_once_with([contacts._redis_key(pk) for pk in self.ids[:2]])
+        # промах БД записан в Redis, все — в память процесса
+        self.assertIsNotNone(client.get(contacts._redis_key(self.ids[1])))
+        with self.assertNumQueries(0):
+            contacts.get_contacts(self.ids)
+
+    def test_update_invalidates_and_update_queryset_needs_invalidate(self):
+        contacts.get_contacts(self.ids)
+        user = self.users[0]
+        user.email = "new@example.com"
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(contacts.get_contact(user.pk).email, "new@example.com")
+
+        # update() сигналов не шлёт: кеш устарел, пока не позван invalidate
+        User.objects.filter(pk=user.pk).update(email="bulk@example.com")
+        self.assertEqual(contacts.get_contact(user.pk).email, "new@example.com")
+        contacts.invalidate([user.pk])
+        self.assertEqual(contacts.get_contact(user.pk).email, "bulk@example.com")
+
+    def test_redis_down_reads_db(self):
+        contacts._local.clear()
+        broken = mock.Mock(**{"mget.side_effect": RedisError, "pipeline.side_effect": RedisError})
+        with mock.patch.object(contacts, "get_redis", return_value=broken), \
+                self.assertLogs("notifications.contacts", "WARNING"), \
+                self.assertNumQueries(1):
+            found = contacts.get_contacts(self.ids + [10 ** 9])
+        self.assertEqual(set(found), set(self.ids))
+
+    def test_local_cache_ttl_and_lru(self):
+        cache = LocalCache(2)
+        cache.put("a", 1, 60)
+        cache.put("b", 2, 60)
+        cache.get("a")
+        cache.put("c", 3, 60)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+        cache.put("old", 4, -1)
+        self.assertIsNone(cache.get("old"))
+
+    def test_cacheops_covers_only_rare_user_reads(self):
+        self.assertEqual(set(settings.CACHEOPS), {"notifications.user"})
+        self.assertEqual(set(settings.CACHEOPS["notifications.user"]["ops"]), {"get", "exists"})
+        self.assertTrue(settings.CACHEOPS_DEGRADE_ON_FAILURE)
+
+
+class TemplatingTests(TestCase):
+    """Текст канала из шаблона, обязательные параметры и кеш скомпилированных."""
+
+    def setUp(self):
+        self.template = NotificationTemplate.objects.create(
+            name=f"t-{uuid.uuid4().hex[:8]}",
+            subject="Привет,\n{{ name }}",
+            body="Привет, {{ name }}!",
+            html_body="<p>{{ name }}</p>",
+            telegram_body="<b>{{ name }}</b>",
+            telegram_parse_mode="HTML",
+        )
+
+    def message(self, params, template=None):
+        notif = Notification(template_id=(template or self.template).pk, params=params)
+        return templating.messages_for([notif])[0]
+
+    def test_each_channel_gets_its_variant(self):
+        message = self.message({"name": "<Аня>"})
+        self.assertEqual(
+            templating.content_for(message, "email"),
+            ("<p>&lt;Аня&gt;</p>", {"subject": "Привет, <Аня>", "html": True}),
+        )
+        self.assertEqual(
+            templating.content_for(message, "telegram"),
+            ("<b>&lt;Аня&gt;</b>", {"parse_mode": "HTML"}),
+        )
+        self.assertEqual(templating.content_for(message, "sms"), ("Привет, <Аня>!", {}))
+        self.assertEqual(templating.content_for("готовый текст", "email"), ("готовый текст", {}))
+
+    def test_missing_params_are_permanent_errors(self):
+        template = NotificationTemplate.objects.create(
+            name=f"p-{uuid.uuid4().hex[:8]}",
+            body=(
+                "Код {{ code }}{% if note %}, {{ note }}{% endif %} {{ sign|default:'—' }}"
+                "{% for item in items %} {{ item }}{% endfor %}"
+            ),
+        )
+        with self.assertRaisesMessage(PermanentDeliveryError, "нет параметров: code"):
+            templating.content_for(self.message({}, template), "sms")
+        self.assertEqual(
+            templating.content_for(self.message({"code": 7, "items": [1]}, template), "sms"),
+            ("Код 7 — 1", {}),
+        )
+
+        deleted = Notification(template_id=self.template.pk, params={"name": "x"})
+        self.template.delete()
+        with self.assertRaisesMessage(PermanentDeliveryError, "не найден"):
+            templating.content_for(templating.messages_for([deleted])[0], "sms")
+
+    def test_edit_invalidates_compiled_template(self):
+        first = templating.get_templates([self.template.pk])[self.template.pk]
+        with self.assertNumQueries(0):
+            self.assertIs(templating.get_templates([self.template.pk])[self.template.pk], first)
+
+        self.template.body = "Пока, {{ name }}"
+        self.template.save()
+        with self.assertNumQueries(1):
+            message = self.message({"name": "Аня"})
+        self.assertEqual(templating.content_for(message, "sms"), ("Пока, Аня", {}))
@@ -1,25 +1,43 @@
 from __future__ import annotations
 
 from typing import Callable, Optional
+from uuid import uuid4
 
 from django.contrib import messages
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.views.decorators.http import require_GET, require_POST
 from django.views.generic import TemplateView
+from kombu.exceptions import OperationalError
 
 from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from .models import Notification, User
+from .bulk import bulk_create_notifications
+from . import idempotency, ingest, metrics, outbox, replay
+from .fastjson import USER_COLUMNS, dumps, json_response, notification_dicts, user_dicts
+from .listing import filter_notifications, iter_jsonl, keyset_page, page_size_limits
+from .models import (
+    DeliveryStatus,
+    Notification,
+    NotificationTemplate,
+    Priority,
+    User,
+    initial_delivery_fields,
+)
 from .serializers import (
+    DeadLetterReplaySerializer,
+    NotificationBulkCreateSerializer,
     NotificationCreateSerializer,
-    NotificationSerializer,
+    NotificationListQuerySerializer,
+    NotificationTemplateSerializer,
     UserSerializer,
+    missing_templates,
 )
 from notifications.senders.telegram import send_telegram_message
-from .tasks import send_notification_task
+from .tasks import enqueue_notification, replay_dead_letters_task
 
 
 # Небольшая обёртка, чтобы можно было подменить отправку в тестах.
@@ -52,34 +70,192 @@ def telegram_ping_view(
     return HttpResponse(body, status=code, content_type="text/plain; charset=utf-8")
 
 
+@require_GET
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """Метрики доставки для Prometheus (сумма по процессам при PROMETHEUS_MULTIPROC_DIR)."""
+    data, content_type = metrics.render()
+    return HttpResponse(data, content_type=content_type)
+
+
+async def ingest_view(request: HttpRequest) -> HttpResponse:
+    """
+    Приём уведомлений общими пачками (см. ingest). Под ASGI этот путь
+    обслуживает ingest.asgi_app мимо middleware; view — для runserver/WSGI.
+    """
+    # декораторы Django 3.2 (require_POST, csrf_exempt) оборачивают view в
+    # синхронную функцию, поэтому метод проверяется здесь, а csrf_exempt — атрибутом
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    status_code, data = await ingest.handle(request.body)
+    # без ASGI event loop живёт один запрос: публикацию пачки ждём до ответа
+    await ingest.get_batcher().drain()
+    return json_response(data, status=status_code)
+
+
+ingest_view.csrf_exempt = True
+
+
 class UserViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     """API для пользователей: создание и список."""
     queryset = User.objects.all().order_by("id")
     serializer_class = UserSerializer
 
+    def list(self, request: HttpRequest) -> HttpResponse:
+        # тот же JSON, что у UserSerializer, но без объекта-сериализатора на строку
+        rows = self.get_queryset().values_list(*USER_COLUMNS)
+        return json_response(dumps(user_dicts(rows)))
+
+
+class NotificationTemplateViewSet(
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.UpdateModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    API шаблонов сообщений. Удаления нет: на шаблон ссылаются уведомления.
+    Правку воркеры подхватят не позже TEMPLATE_CACHE_SEC (см. templating).
+    """
+    queryset = NotificationTemplate.objects.all().order_by("id")
+    serializer_class = NotificationTemplateSerializer
+
 
 class NotificationViewSet(viewsets.ViewSet):
     """API уведомлений: список и создание (асинхронная отправка через Celery)."""
 
-    def list(self, request: HttpRequest) -> Response:
-        qs = Notification.objects.select_related("user").order_by("-id")
-        data = NotificationSerializer(qs, many=True).data
-        return Response(data)
+    def _query_params(self, request: HttpRequest) -> dict:
+        params = NotificationListQuerySerializer(data=request.query_params.dict())
+        params.is_valid(raise_exception=True)
+        return params.validated_data
+
+    def list(self, request: HttpRequest) -> HttpResponse:
+        """
+        Страница уведомлений, новые сверху: ?cursor=<id>&limit=<n> + фильтры.
+        Ответ: {"results": [...], "next_cursor": <id или null>};
+        элементы — в форме NotificationSerializer, кодируются через fastjson.
+        """
+        params = self._query_params(request)
+        default_limit, _ = page_size_limits()
+        qs = filter_notifications(Notification.objects.all(), params)
+        rows, next_cursor = keyset_page(
+            qs, params.get("cursor"), params.get("limit", default_limit),
+        )
+        return json_response(
+            dumps({"results": notification_dicts(rows), "next_cursor": next_cursor})
+        )
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request: HttpRequest) -> StreamingHttpResponse:
+        """Выгрузка всех уведомлений по фильтрам в JSON Lines, потоком."""
+        params = self._query_params(request)
+        qs = filter_notifications(Notification.objects.all(), params)
+        response = StreamingHttpResponse(
+            iter_jsonl(qs), content_type="application/x-ndjson; charset=utf-8",
+        )
+        response["Content-Disposition"] = 'attachment; filename="notifications.jsonl"'
+        return response
 
     def create(self, request: HttpRequest) -> Response:
+        """
+        Создание с отправкой. Строка создаётся с отметкой outbox, задача
+        публикуется сразу после коммита; если брокер недоступен — релеем.
+        Заголовок Idempotency-Key делает повтор запроса безопасным: вернётся
+        тот же id, второго уведомления нет.
+        С send_at в будущем уведомление ждёт диспетчера (status: scheduled).
+        Вместо message можно передать template_id + params: хранятся параметры,
+        текст для каждого канала собирается при доставке.
+        """
         serializer = NotificationCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        message = data["message"].strip()
+        fields = initial_delivery_fields(data["send_at"])
+        if data["template_id"] is not None:
+            if missing_templates([data["template_id"]]):
+                return Response(
+                    {"template_id": [f"Шаблон с id={data['template_id']} не найден."]},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            fields.update(template_id=data["template_id"], params=data["params"])
+        try:
+            notif_id, _ = idempotency.create_notification(
+                idempotency.clean_key(request.headers.get(idempotency.HEADER)),
+                data["user_id"],
+                message,
+                priority=data["priority"],
+                **fields,
+            )
+        except idempotency.InvalidIdempotencyKey as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except idempotency.IdempotencyInProgress as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except idempotency.IdempotencyKeyReused as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        outbox.publish_on_commit([notif_id])
+        return Response(
+            {"status": fields.get("status", DeliveryStatus.QUEUED), "id": notif_id},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request: HttpRequest) -> Response:
+        """
+        Массовое создание: {"items": [{"user_id", "message"}, ...]}
+        или {"user_ids": [...], "message": "..."}; вместо message — template_id
+        и params (в items — свои у каждого элемента, так рассылка персонализируется).
+        Один запрос проверки пользователей и bulk_create; задачи публикуются
+        после коммита пачками через одно соединение с брокером (см. outbox).
+        """
+        serializer = NotificationBulkCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        message = serializer.validated_data["message"].strip()
-        notif = Notification.objects.create(
-            user_id=serializer.validated_data["user_id"],
-            message=message,
+        rows = [
+            {**row, "message": row["message"].strip()}
+            for row in serializer.validated_data["rows"]
+        ]
+        fields = initial_delivery_fields(serializer.validated_data["send_at"])
+        ids = bulk_create_notifications(
+            rows, priority=serializer.validated_data["priority"], **fields,
+        )
+        outbox.publish_on_commit(ids)
+
+        return Response(
+            {
+                "status": fields.get("status", DeliveryStatus.QUEUED),
+                "count": len(ids),
+                "first_id": ids[0],
+                "last_id": ids[-1],
+            },
+            status=status.HTTP_202_ACCEPTED,
         )
 
-        # ставим задачу на отправку
-        send_notification_task.delay(notif.id)
+    @action(detail=False, methods=["post"], url_path="replay")
+    def replay_dead_letters(self, request: HttpRequest) -> Response:
+        """
+        Повтор dead letters: {"channel", "error_class", "dead_after", "dead_before",
+        "rate", "priority", "reset_permanent"} — все поля необязательны.
+        Проход идёт фоновой задачей с ограничением скорости; в ответе —
+        сколько строк подходит под фильтр сейчас.
+        """
+        serializer = DeadLetterReplaySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        return Response({"status": "queued", "id": notif.id}, status=status.HTTP_202_ACCEPTED)
+        filters = serializer.filters()
+        matched = replay.dead_letters(**filters).count()
+        if matched:
+            replay_dead_letters_task.delay(
+                filters,
+                rate=serializer.validated_data.get("rate"),
+                priority=serializer.validated_data.get("priority"),
+                reset_permanent=serializer.validated_data["reset_permanent"],
+            )
+        return Response(
+            {"status": "replaying" if matched else "nothing_to_replay", "matched": matched},
+            status=status.HTTP_202_ACCEPTED,
+        )
 
 
 class DemoView(TemplateView):
@@ -90,6 +266,9 @@ class DemoView(TemplateView):
         context = super().get_context_data(**kwargs)
         context["users"] = User.objects.order_by("-id")[:10]
         context["notifs"] = Notification.objects.select_related("user").order_by("-id")[:10]
+        # ключ формы: повторная отправка той же формы не создаст дубль
+        context["idempotency_key"] = uuid4().hex
+        context["priorities"] = Priority.choices
         return context
 
 
@@ -117,6 +296,7 @@ def send_notification_view(request: HttpRequest) -> HttpResponse:
     """
     Обработчик формы отправки уведомления.
     Ожидает: user_id, message (+ опционально smtp_user/smtp_password).
+    Idempotency-Key — из заголовка или скрытого поля формы idempotency_key.
     """
     user_id_raw = request.POST.get("user_id")
     try:
@@ -140,9 +320,51 @@ def send_notification_view(request: HttpRequest) -> HttpResponse:
     smtp_user: Optional[str] = (request.POST.get("smtp_user") or "").strip() or None
     smtp_password: Optional[str] = (request.POST.get("smtp_password") or "").strip() or None
 
-    notif = Notification.objects.create(user_id=user_id, message=message)
-
-    send_notification_task.delay(notif.id, smtp_user, smtp_password)
+    try:
+        priority = Priority(int(request.POST.get("priority", Priority.NORMAL)))
+    except (TypeError, ValueError):
+        priority = Priority.NORMAL
+
+    # разовые SMTP-креды в БД не пишем, поэтому с ними задача ставится напрямую,
+    # без outbox: иначе релей мог бы опубликовать ту же строку ещё раз, уже без
+    # кредов. Без кредов — через outbox, как в API
+    direct = bool(smtp_user or smtp_password)
+    broker_down = False
+
+    def enqueue_direct(notif: Notification) -> None:
+        nonlocal broker_down
+        try:
+            enqueue_notification(notif.id, notif.priority, smtp_user, smtp_password)
+        except OperationalError:
+            # строка уже закоммичена под ключом идемпотентности: отдаём её
+            # релею, он доставит с кредами по умолчанию
+            Notification.objects.filter(id=notif.id).update(dispatch_pending=True)
+            broker_down = True
+
+    raw_key = request.headers.get(idempotency.HEADER) or request.POST.get("idempotency_key")
+    try:
+        notif_id, created = idempotency.create_notification(
+            idempotency.clean_key(raw_key),
+            user_id,
+            message,
+            on_created=enqueue_direct if direct else None,
+            priority=priority,
+            **initial_delivery_fields(outbox=not direct),
+        )
+    except idempotency.IdempotencyError as exc:
+        messages.error(request, str(exc))
+        return redirect(reverse("demo"))
 
-    messages.success(request, f"Уведомление поставлено в очередь (id={notif.id}).")
+    if not direct:
+        outbox.publish_on_commit([notif_id])
+    if broker_down:
+        messages.warning(
+            request,
+            f"Очередь недоступна: уведомление id={notif_id} будет отправлено позже "
+            "с SMTP-аккаунтом по умолчанию.",
+        )
+    elif created:
+        messages.success(request, f"Уведомление поставлено в очередь (id={notif_id}).")
+    else:
+        messages.info(request, f"Уведомление уже в очереди (id={notif_id}).")
     return redirect(reverse("demo"))
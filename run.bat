@@ -10,7 +10,28 @@ call .\.venv\Scripts\activate
 
 set DJANGO_SETTINGS_MODULE=notif.settings
 
-start "celery" cmd /k call .\.venv\Scripts\activate ^&^& set DJANGO_SETTINGS_MODULE=notif.settings^&^& celery -A notif.celery:app worker -l info -P solo
+rem Метрики воркеров и веба собираются в один /metrics через общий каталог;
+rem файлы прошлого запуска удаляем, иначе счётчики продолжатся со старых значений
+if not defined PROMETHEUS_MULTIPROC_DIR set PROMETHEUS_MULTIPROC_DIR=%CD%\.metrics
+if exist "%PROMETHEUS_MULTIPROC_DIR%" rmdir /s /q "%PROMETHEUS_MULTIPROC_DIR%"
+mkdir "%PROMETHEUS_MULTIPROC_DIR%"
+
+rem Воркеры по очередям: срочные, обычные+сводки, массовые, пакетные email и Telegram.
+rem Concurrency каждого задаётся переменными окружения
+if not defined CELERY_CONCURRENCY_HIGH set CELERY_CONCURRENCY_HIGH=8
+if not defined CELERY_CONCURRENCY_DEFAULT set CELERY_CONCURRENCY_DEFAULT=4
+if not defined CELERY_CONCURRENCY_BULK set CELERY_CONCURRENCY_BULK=4
+if not defined CELERY_CONCURRENCY_EMAIL set CELERY_CONCURRENCY_EMAIL=4
+if not defined CELERY_CONCURRENCY_TELEGRAM set CELERY_CONCURRENCY_TELEGRAM=2
+
+start "celery-high" cmd /k call .\.venv\Scripts\activate ^&^& set DJANGO_SETTINGS_MODULE=notif.settings^&^& celery -A notif.celery:app worker -l info -P threads -c %CELERY_CONCURRENCY_HIGH% -Q notif.high -n high@%%h
+start "celery-default" cmd /k call .\.venv\Scripts\activate ^&^& set DJANGO_SETTINGS_MODULE=notif.settings^&^& celery -A notif.celery:app worker -l info -P threads -c %CELERY_CONCURRENCY_DEFAULT% -Q notif.default -n default@%%h
+start "celery-bulk" cmd /k call .\.venv\Scripts\activate ^&^& set DJANGO_SETTINGS_MODULE=notif.settings^&^& celery -A notif.celery:app worker -l info -P threads -c %CELERY_CONCURRENCY_BULK% -Q notif.bulk -n bulk@%%h
+start "celery-email" cmd /k call .\.venv\Scripts\activate ^&^& set DJANGO_SETTINGS_MODULE=notif.settings^&^& celery -A notif.celery:app worker -l info -P threads -c %CELERY_CONCURRENCY_EMAIL% -Q notif.email -n email@%%h
+start "celery-telegram" cmd /k call .\.venv\Scripts\activate ^&^& set DJANGO_SETTINGS_MODULE=notif.settings^&^& celery -A notif.celery:app worker -l info -P threads -c %CELERY_CONCURRENCY_TELEGRAM% -Q notif.telegram -n telegram@%%h
+
+rem beat: outbox-релей (страховка публикации), диспетчер отложенных, возврат просроченных аренд
+start "celery-beat" cmd /k call .\.venv\Scripts\activate ^&^& set DJANGO_SETTINGS_MODULE=notif.settings^&^& celery -A notif.celery:app beat -l info
 
 rem Поднимаем сервер Django
 python manage.py runserver 0.0.0.0:8000